@@ -0,0 +1,114 @@
+"""
+Tail latency of analysis calls with and without hedged requests.
+
+Runs the analyzer in-process on the fake model with log-normal latencies
+(a heavy tail with --sigma 1), sending distinct texts so neither the result
+cache nor coalescing answers them. Every configuration is run with the same
+seed and reports p50/p90/p99/max latency and the number of upstream
+requests; hedging should cut p99 while adding at most HEDGE_BUDGET_RATIO of
+requests.
+
+Usage:
+    python benchmarks/bench_hedging.py [--requests 600] [--concurrency 8]
+        [--latency-ms 200] [--sigma 1.0] [--budget 0.05] [--async]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cloud-server")
+sys.path.insert(0, SERVER_DIR)
+
+
+def percentile(latencies, pct):
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def texts(count):
+    # Unknown words keep the local fast path out of the way
+    return [f"zqx{number} vbhgt{number}" for number in range(count)]
+
+
+def run_sync(analyzer, items, concurrency):
+    def timed(text):
+        started = time.perf_counter()
+        analyzer.analyze_and_correct_text(text)
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(timed, items))
+
+
+def run_async(analyzer, items, concurrency):
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def timed(text):
+            async with semaphore:
+                started = time.perf_counter()
+                await analyzer.aanalyze_and_correct_text(text)
+                return time.perf_counter() - started
+
+        return await asyncio.gather(*(timed(text) for text in items))
+
+    return asyncio.run(main())
+
+
+def bench(analyzer_class, hedging, args):
+    os.environ["HEDGE_ENABLED"] = "true" if hedging else "false"
+    analyzer = analyzer_class()
+    run = run_async if args.use_async else run_sync
+    # Warm-up: fills the latency window the hedging threshold comes from
+    run(analyzer, [f"warm{text}" for text in texts(100)], args.concurrency)
+    retry_before = analyzer.retry_policy.stats()
+    hedged_before = sum(stats['hedged'] for stats in analyzer.hedger.stats()['operations'].values()) if hedging else 0
+
+    latencies = run(analyzer, texts(args.requests), args.concurrency)
+
+    retry = analyzer.retry_policy.stats()
+    hedged = sum(stats['hedged'] for stats in analyzer.hedger.stats()['operations'].values()) if hedging else 0
+    upstream = (retry['calls'] - retry_before['calls'] + retry['retries'] - retry_before['retries']
+                + hedged - hedged_before)
+    wins = analyzer.hedger.stats()['operations'].get('analyze', {}).get('win_rate', 0) if hedging else 0
+    print(f"{'on' if hedging else 'off':>7} {statistics.median(latencies) * 1000:>8.0f} "
+          f"{percentile(latencies, 90) * 1000:>8.0f} {percentile(latencies, 99) * 1000:>8.0f} "
+          f"{max(latencies) * 1000:>8.0f} {upstream:>9} {upstream / args.requests - 1:>8.1%} {wins:>9.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=600)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--sigma", type=float, default=1.0)
+    parser.add_argument("--budget", type=float, default=0.05)
+    parser.add_argument("--async", dest="use_async", action="store_true", help="Use the async analyzer methods")
+    args = parser.parse_args()
+
+    os.environ.update({
+        "LLM_BACKEND": "fake",
+        "FAKE_LLM_LATENCY_MS": str(args.latency_ms),
+        "FAKE_LLM_LATENCY_SIGMA": str(args.sigma),
+        "FAKE_LLM_SEED": "7",
+        "HEDGE_BUDGET_RATIO": str(args.budget),
+        "RESULT_CACHE_DB_PATH": "",
+        "LAZY_STARTUP": "false",
+    })
+    import logging
+    from langchain_vertex_analyzer import LangChainTextAnalyzer
+    logging.getLogger().setLevel(logging.WARNING)
+
+    print(f"{'hedging':>7} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8} {'upstream':>9} "
+          f"{'extra':>8} {'hedge win':>9}")
+    bench(LangChainTextAnalyzer, False, args)
+    bench(LangChainTextAnalyzer, True, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Microbenchmark for LanguageDetector layout conversion.
+
+Times convert_last_language and convert_full on inputs from 10 characters up
+to 1 MB and prints the cost per character, which should stay flat as the
+input grows.
+
+Usage:
+    python benchmarks/bench_language_detector.py
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cloud-server"))
+
+from language_detector import LanguageDetector  # noqa: E402
+
+SIZES = [10, 100, 1_000, 10_000, 100_000, 1_000_000]
+SAMPLE = "akuo ugkn vfk cxsr? "  # "שלום עולם הכל בסדר?" typed on an English layout
+
+
+def make_text(size: int) -> str:
+    """
+    Build a single-language input of exactly `size` characters so the whole
+    text is one segment (the worst case for convert_last_language).
+    """
+    return (SAMPLE * (size // len(SAMPLE) + 1))[:size]
+
+
+def bench(func, text: str) -> float:
+    """
+    Return the best per-call time in seconds.
+    """
+    number = max(1, 200_000 // len(text))
+    return min(timeit.repeat(lambda: func(text), number=number, repeat=5)) / number
+
+
+def main():
+    detector = LanguageDetector()
+    print(f"{'size':>10} {'last_language (s)':>18} {'ns/char':>8} {'convert_full (s)':>17} {'ns/char':>8}")
+    for size in SIZES:
+        text = make_text(size)
+        last = bench(detector.convert_last_language, text)
+        full = bench(lambda t: detector.convert_full(t, "english_to_hebrew"), text)
+        print(f"{size:>10} {last:>18.6f} {last / size * 1e9:>8.1f} {full:>17.6f} {full / size * 1e9:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
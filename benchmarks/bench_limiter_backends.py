@@ -0,0 +1,103 @@
+"""
+Benchmark and cross-process check for the APILimiter state backends.
+
+For each backend (local, shared_memory, redis against the in-memory stand-in)
+reports the cost of one admit + release, then checks that limits are enforced
+across processes: several worker processes hammer the same client key and the
+total number of admitted requests must not exceed the per-minute limit.
+
+Usage:
+    python benchmarks/bench_limiter_backends.py [--requests 20000] [--workers 4]
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cloud-server"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from limiter_backends import (  # noqa: E402
+    ADMITTED, LocalLimiterBackend, RedisLimiterBackend, SharedMemoryLimiterBackend
+)
+
+REDIS_PORT = 6390
+LIMIT = 500
+
+
+def make_backend(name, shm_path):
+    if name == "local":
+        return LocalLimiterBackend()
+    if name == "shared_memory":
+        return SharedMemoryLimiterBackend(shm_path)
+    return RedisLimiterBackend(f"redis://127.0.0.1:{REDIS_PORT}/0")
+
+
+def measure(name, backend, requests):
+    start = time.perf_counter()
+    for i in range(requests):
+        status, token = backend.admit(f"10.0.{i % 250}.{i % 200}", 10 ** 9, 1, 1000)
+        if status == ADMITTED:
+            backend.release(token)
+    elapsed = time.perf_counter() - start
+    print(f"{name:>14}: {elapsed / requests * 1e6:8.1f} us per admit+release")
+
+
+def hammer(name, shm_path, attempts, results):
+    backend = make_backend(name, shm_path)
+    admitted = 0
+    for _ in range(attempts):
+        status, token = backend.admit("203.0.113.7", LIMIT, 1, 1000)
+        if status == ADMITTED:
+            admitted += 1
+            backend.release(token)
+    results.put(admitted)
+
+
+def check_shared_limit(name, shm_path, workers):
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=hammer, args=(name, shm_path, LIMIT, results))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    admitted = sum(results.get() for _ in processes)
+    for process in processes:
+        process.join()
+    verdict = "ok" if admitted <= LIMIT else "LIMIT EXCEEDED"
+    print(f"{name:>14}: {workers} processes x {LIMIT} requests -> {admitted} admitted "
+          f"(limit {LIMIT}) {verdict}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20_000, help="Admissions per latency run")
+    parser.add_argument("--workers", type=int, default=4, help="Processes in the shared limit check")
+    args = parser.parse_args()
+
+    backends = ["local", "shared_memory"]
+    try:
+        import redis  # noqa: F401
+        from local_redis_server import start_in_thread
+        start_in_thread(port=REDIS_PORT)
+        backends.append("redis")
+    except ImportError:
+        print("redis package not installed - skipping the redis backend")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print("Latency")
+        for name in backends:
+            shm_path = os.path.join(tmp, f"latency_{name}")
+            measure(name, make_backend(name, shm_path), args.requests)
+
+        print("Shared limit across processes")
+        for name in backends[1:]:
+            check_shared_limit(name, os.path.join(tmp, f"shared_{name}"), args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,407 @@
+"""
+Load test for the KeyFixer server.
+
+Sends a weighted mix of requests to /, /api/convert, /api/translate,
+/api/rephrase_to_prompt and /health and reports throughput, p50/p95/p99
+latency and the status breakdown (429 rate limited, 503 busy) per endpoint.
+
+    open loop:   requests arrive at --rps regardless of how fast the server
+                 answers; latency is measured from the scheduled arrival time,
+                 so client-side queueing is not hidden (no coordinated omission)
+    closed loop: --concurrency clients each send a request, wait for the
+                 answer and send the next, paced to --rps in total if given
+
+With --server flask|asgi the server is started on a free port with the local
+fake model (LLM_BACKEND=fake unless set; FAKE_LLM_* variables are passed
+through), so runs are comparable from one commit to the next. Results are
+written as JSON with --output and compared against an earlier run with
+--compare; the exit status is 1 if a latency percentile or the throughput
+regressed by more than --tolerance.
+
+Usage:
+    python benchmarks/bench_load.py --server flask --mode open --rps 50 --duration 30 --output run.json
+    python benchmarks/bench_load.py --server flask --compare run.json
+    python benchmarks/bench_load.py --url http://127.0.0.1:8080 --mode closed --concurrency 20
+"""
+
+import argparse
+import http.client
+import json
+import os
+import queue
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+from collections import Counter, defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_startup import SERVER_DIR, first_200, free_port, server_command  # noqa: E402
+
+DEFAULT_MIX = "convert=60,index=10,translate=10,rephrase=10,health=10"
+
+CONVERT_TEXTS = ["akuo", "ghbdtn vbh", "tku cuk", "hello עםרךג", "nv ,uc", "שקךךם", "vfvf vskf", "ktp vh vkl"]
+TRANSLATE_TEXTS = ["שלום עולם", "good morning everyone", "מה שלומך היום?", "the meeting moved to Thursday"]
+REPHRASE_TEXTS = ["make me a website for my bakery", "explain recursion", "write tests for the login page"]
+
+PERCENTILES = (50, 95, 99)
+
+
+def _text(texts, rng, unique, number):
+    text = rng.choice(texts)
+    # A counter suffix defeats the result cache and request coalescing
+    return f"{text} {number}" if unique else text
+
+
+# Endpoint name -> (method, path, body factory)
+ENDPOINTS = {
+    "index": ("POST", "/", lambda rng, unique, n: {"text": _text(CONVERT_TEXTS, rng, unique, n)}),
+    "convert": ("POST", "/api/convert", lambda rng, unique, n: {"text": _text(CONVERT_TEXTS, rng, unique, n)}),
+    "translate": ("POST", "/api/translate", lambda rng, unique, n: {"text": _text(TRANSLATE_TEXTS, rng, unique, n)}),
+    "rephrase": ("POST", "/api/rephrase_to_prompt",
+                 lambda rng, unique, n: {"text": _text(REPHRASE_TEXTS, rng, unique, n)}),
+    "health": ("GET", "/health", None),
+}
+
+
+def parse_mix(spec):
+    """
+    Parse "convert=60,health=10" into a list of (endpoint, weight).
+    """
+    mix = []
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"Unknown endpoint {name!r} (choose from {', '.join(ENDPOINTS)})")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+class Recorder:
+    """
+    Thread-safe collection of (endpoint, status, latency) samples
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+
+    def record(self, endpoint, status, latency):
+        with self.lock:
+            self.samples[endpoint].append(latency)
+            self.statuses[endpoint][status] += 1
+
+
+class Client:
+    """
+    One keep-alive HTTP connection sending mixed requests
+    """
+
+    def __init__(self, base_url, args, seed):
+        url = urllib.parse.urlsplit(base_url)
+        self.host, self.port = url.hostname, url.port or 80
+        self.timeout = args.timeout
+        self.unique = args.unique
+        self.clients = args.clients
+        self.rng = random.Random(seed)
+        self.connection = None
+
+    def send(self, endpoint, number):
+        """
+        Send one request; return its status code as a string ("error" on failure).
+        """
+        method, path, body_factory = ENDPOINTS[endpoint]
+        headers = {"X-Forwarded-For": self._client_ip()}
+        body = None
+        if body_factory:
+            body = json.dumps(body_factory(self.rng, self.unique, number)).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        try:
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            response.read()
+            if response.getheader("Connection", "").lower() == "close":
+                self.close()
+            return str(response.status)
+        except (OSError, http.client.HTTPException):
+            self.close()
+            return "error"
+
+    def _client_ip(self):
+        # Spread requests over --clients addresses so the per-IP rate limit applies per simulated user
+        number = self.rng.randrange(self.clients)
+        return f"10.{number >> 16 & 255}.{number >> 8 & 255}.{number & 255}"
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def choose_endpoints(mix, count, rng):
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    return rng.choices(names, weights, k=count)
+
+
+def run_open_loop(base_url, args, mix, recorder):
+    """
+    Issue arrivals at args.rps from a scheduler thread; a pool of args.max_in_flight
+    workers sends them. Latency counts from the scheduled arrival time.
+    """
+    rng = random.Random(args.seed)
+    total = int(args.rps * (args.warmup + args.duration))
+    endpoints = choose_endpoints(mix, total, rng)
+    arrivals = queue.Queue()
+
+    def worker(seed):
+        client = Client(base_url, args, seed)
+        while True:
+            item = arrivals.get()
+            if item is None:
+                break
+            number, endpoint, scheduled = item
+            status = client.send(endpoint, number)
+            if scheduled >= measure_from:
+                recorder.record(endpoint, status, time.perf_counter() - scheduled)
+        client.close()
+
+    workers = [threading.Thread(target=worker, args=(args.seed + 1 + i,), daemon=True)
+               for i in range(args.max_in_flight)]
+    for thread in workers:
+        thread.start()
+
+    started = time.perf_counter()
+    measure_from = started + args.warmup
+    scheduled = started
+    for number, endpoint in enumerate(endpoints):
+        # Poisson arrivals, or evenly spaced with --arrivals uniform
+        scheduled += rng.expovariate(args.rps) if args.arrivals == "poisson" else 1 / args.rps
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        arrivals.put((number, endpoint, scheduled))
+    for _ in workers:
+        arrivals.put(None)
+    for thread in workers:
+        thread.join()
+    return time.perf_counter() - measure_from
+
+
+def run_closed_loop(base_url, args, mix, recorder):
+    """
+    Run args.concurrency clients back to back, each paced to rps / concurrency if rps is set.
+    """
+    started = time.perf_counter()
+    measure_from = started + args.warmup
+    end = measure_from + args.duration
+    counter = iter(range(sys.maxsize))
+    counter_lock = threading.Lock()
+
+    def worker(index):
+        client = Client(base_url, args, args.seed + 1 + index)
+        rng = random.Random(args.seed - 1 - index)
+        interval = args.concurrency / args.rps if args.rps else 0
+        next_send = started + rng.random() * interval
+        while True:
+            if interval:
+                delay = next_send - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                next_send += interval
+            began = time.perf_counter()
+            if began >= end:
+                break
+            with counter_lock:
+                number = next(counter)
+            endpoint = choose_endpoints(mix, 1, rng)[0]
+            status = client.send(endpoint, number)
+            if began >= measure_from:
+                recorder.record(endpoint, status, time.perf_counter() - began)
+        client.close()
+
+    workers = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(args.concurrency)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return time.perf_counter() - measure_from
+
+
+def percentile(sorted_values, pct):
+    """
+    Nearest-rank percentile of an ascending list.
+    """
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(latencies, statuses, elapsed):
+    latencies = sorted(latencies)
+    summary = {
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0,
+        "latency_ms": {f"p{pct}": round(percentile(latencies, pct) * 1000, 2) if latencies else None
+                       for pct in PERCENTILES},
+        "status": dict(sorted(statuses.items())),
+        "rate_limited_429": statuses.get("429", 0),
+        "busy_503": statuses.get("503", 0),
+        "errors": statuses.get("error", 0),
+    }
+    if latencies:
+        summary["latency_ms"]["mean"] = round(sum(latencies) / len(latencies) * 1000, 2)
+        summary["latency_ms"]["max"] = round(latencies[-1] * 1000, 2)
+    return summary
+
+
+def build_results(args, mix, recorder, elapsed):
+    all_latencies = [latency for samples in recorder.samples.values() for latency in samples]
+    all_statuses = Counter()
+    for statuses in recorder.statuses.values():
+        all_statuses.update(statuses)
+    return {
+        "config": {
+            "mode": args.mode,
+            "rps": args.rps,
+            "concurrency": args.concurrency if args.mode == "closed" else args.max_in_flight,
+            "arrivals": args.arrivals if args.mode == "open" else None,
+            "duration_s": args.duration,
+            "warmup_s": args.warmup,
+            "mix": dict(mix),
+            "clients": args.clients,
+            "unique": args.unique,
+            "seed": args.seed,
+            "server": args.server,
+            "model": {name: os.environ[name] for name in sorted(os.environ)
+                      if name == "LLM_BACKEND" or name.startswith("FAKE_LLM_")},
+        },
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "elapsed_s": round(elapsed, 3),
+        "overall": summarize(all_latencies, all_statuses, elapsed),
+        "endpoints": {endpoint: summarize(recorder.samples[endpoint], recorder.statuses[endpoint], elapsed)
+                      for endpoint in sorted(recorder.samples)},
+    }
+
+
+def print_results(results):
+    header = f"{'endpoint':>10} {'reqs':>7} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} " \
+             f"{'429':>6} {'503':>6} {'err':>5}"
+    print(header)
+    rows = list(results["endpoints"].items()) + [("overall", results["overall"])]
+    for name, summary in rows:
+        latency = summary["latency_ms"]
+        cells = [f"{latency[f'p{pct}']:9.1f}" if latency[f"p{pct}"] is not None else f"{'-':>9}"
+                 for pct in PERCENTILES]
+        print(f"{name:>10} {summary['requests']:>7} {summary['throughput_rps']:>8.1f} {' '.join(cells)} "
+              f"{summary['rate_limited_429']:>6} {summary['busy_503']:>6} {summary['errors']:>5}")
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print changes against a baseline run; return the list of regressions.
+    """
+    regressions = []
+    print(f"\nchange vs baseline ({baseline['started_at']}), tolerance {tolerance:.0%}:")
+    rows = [("overall", results["overall"], baseline["overall"])]
+    rows += [(name, summary, baseline["endpoints"][name])
+             for name, summary in results["endpoints"].items() if name in baseline["endpoints"]]
+    for name, current, previous in rows:
+        changes = []
+        # (label, current value, baseline value, True if higher is worse)
+        metrics = [(f"p{pct}", current["latency_ms"][f"p{pct}"], previous["latency_ms"][f"p{pct}"], True)
+                   for pct in PERCENTILES]
+        metrics.append(("rps", current["throughput_rps"], previous["throughput_rps"], False))
+        for label, value, old, higher_is_worse in metrics:
+            if not value or not old:
+                continue
+            change = (value - old) / old
+            changes.append(f"{label} {change:+.1%}")
+            if (change if higher_is_worse else -change) > tolerance:
+                regressions.append(f"{name} {label}: {old} -> {value}")
+        print(f"{name:>10}  {', '.join(changes)}")
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return regressions
+
+
+def start_server(server):
+    """
+    Start the server on a free port with the fake model; return (process, base URL).
+    """
+    port = free_port()
+    env = dict(os.environ)
+    env.setdefault("LLM_BACKEND", "fake")
+    env.setdefault("LAZY_STARTUP", "false")
+    process = subprocess.Popen(server_command(server, port), cwd=SERVER_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    if first_200(f"{base_url}/health", time.perf_counter()) is None:
+        process.terminate()
+        raise SystemExit(f"{server} server did not become healthy")
+    return process, base_url
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--url", default="http://127.0.0.1:8080", help="Base URL of a running server")
+    target.add_argument("--server", choices=["flask", "asgi"], help="Start this server locally with the fake model")
+    parser.add_argument("--mode", choices=["open", "closed"], default="open")
+    parser.add_argument("--rps", type=float, help="Target requests per second (required for open loop)")
+    parser.add_argument("--concurrency", type=int, default=10, help="Closed loop: number of clients")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="Open loop: sender threads")
+    parser.add_argument("--arrivals", choices=["poisson", "uniform"], default="poisson",
+                        help="Open loop: inter-arrival distribution")
+    parser.add_argument("--duration", type=float, default=30, help="Measured seconds")
+    parser.add_argument("--warmup", type=float, default=3, help="Unmeasured seconds before the run")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"Endpoint weights (default {DEFAULT_MIX})")
+    parser.add_argument("--clients", type=int, default=1000,
+                        help="Distinct client IPs (X-Forwarded-For) the requests are spread over")
+    parser.add_argument("--unique", action="store_true", help="Make every text unique (no cache hits)")
+    parser.add_argument("--timeout", type=float, default=30, help="Per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="Baseline results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="Allowed relative regression before the exit status is 1")
+    args = parser.parse_args()
+    if args.mode == "open" and not args.rps:
+        parser.error("--rps is required in open-loop mode")
+
+    process = None
+    base_url = args.url
+    if args.server:
+        process, base_url = start_server(args.server)
+    try:
+        recorder = Recorder()
+        run = run_open_loop if args.mode == "open" else run_closed_loop
+        elapsed = run(base_url, args, args.mix, recorder)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    results = build_results(args, args.mix, recorder, elapsed)
+    print_results(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(results, output, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Overhead of the /metrics instrumentation.
+
+Reports the cost of one stage observation and one counter increment, and the
+instrumentation cost of a whole request: the seven stage timings (two
+perf_counter() calls and one observation each) plus the result counter. It
+also measures the cost with METRICS_ENABLED=false and under contention from
+several threads.
+
+Usage:
+    python benchmarks/bench_metrics.py [--iterations 200000] [--threads 8]
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cloud-server"))
+
+from metrics import STAGES, Metrics  # noqa: E402
+
+
+def instrumented_request(metrics):
+    """
+    The metrics work done while serving one /api/convert request that reaches the model.
+    """
+    for stage in STAGES:
+        started = time.perf_counter()
+        metrics.observe_stage(stage, time.perf_counter() - started)
+    metrics.count_analysis("llm")
+
+
+def uninstrumented_request():
+    """
+    The same loop without metrics, to separate the loop cost from the instrumentation.
+    """
+    for _ in STAGES:
+        pass
+
+
+def per_call_ns(func, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - started) / iterations * 1e9
+
+
+def contended_ns(func, iterations, threads):
+    """
+    Average wall time per call with `threads` threads calling func concurrently.
+    """
+    barrier = threading.Barrier(threads + 1)
+
+    def worker():
+        barrier.wait()
+        for _ in range(iterations):
+            func()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    return (time.perf_counter() - started) / (iterations * threads) * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200_000)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    enabled = Metrics(enabled=True)
+    disabled = Metrics(enabled=False)
+    request_iterations = args.iterations // 10
+
+    print(f"{'operation':>38} {'ns/call':>9}")
+    rows = [
+        ("observe_stage", per_call_ns(lambda: enabled.observe_stage("llm", 0.2), args.iterations)),
+        ("count_analysis", per_call_ns(lambda: enabled.count_analysis("llm"), args.iterations)),
+        ("perf_counter pair", per_call_ns(lambda: time.perf_counter() - time.perf_counter(), args.iterations)),
+        ("request, no instrumentation", per_call_ns(uninstrumented_request, request_iterations)),
+        ("request, metrics enabled", per_call_ns(lambda: instrumented_request(enabled), request_iterations)),
+        ("request, metrics disabled", per_call_ns(lambda: instrumented_request(disabled), request_iterations)),
+        (f"request, enabled, {args.threads} threads",
+         contended_ns(lambda: instrumented_request(enabled), request_iterations // args.threads, args.threads)),
+    ]
+    for name, value in rows:
+        print(f"{name:>38} {value:>9.0f}")
+
+    started = time.perf_counter()
+    enabled.render()
+    print(f"{'render (scrape, no components)':>38} {(time.perf_counter() - started) * 1e9:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
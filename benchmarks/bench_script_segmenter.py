@@ -0,0 +1,116 @@
+"""
+Script-run segmenter vs. the per-character loops it replaces.
+
+Times, on mixed Hebrew/English inputs from 1 KB to 1 MB:
+    - translate direction: the old loop calling detect_character_language for
+      every character vs. dominant_language(text), which counts letters on the
+      UTF-8 bytes
+    - last-language conversion: convert_last_language scanning the reversed
+      text vs. reusing the spans of an earlier segment() call
+    - segment() itself and convert_mistyped_runs on its spans
+
+Mixed inputs switch script every few words, the worst case for the segmenter
+(one span per switch); --run-words sets how many words a run has. Before
+timing, both methods are checked to agree on --fuzz random strings mixing
+Hebrew and English letters, Hebrew points, neighbouring Armenian letters,
+spaces, digits and layout punctuation.
+
+Usage:
+    python benchmarks/bench_script_segmenter.py [--run-words 3] [--fuzz 100000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cloud-server"))
+
+from language_detector import LanguageDetector  # noqa: E402
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+ENGLISH_WORDS = ["meeting", "budget", "Thursday", "notes", "update", "deploy", "review"]
+HEBREW_WORDS = ["שלום", "פגישה", "תקציב", "מחר", "עדכון", "סיכום", "בדיקה"]
+FUZZ_ALPHABET = "abcXYZשלוםת\u05b0\u05bf\u05c0\u0585\u058f\u0600é ,.;:/'?!-1\n"
+
+
+def make_text(size: int, run_words: int) -> str:
+    """
+    Build a mixed-script input of exactly `size` characters.
+    """
+    rng = random.Random(size)
+    words = []
+    length = 0
+    while length < size:
+        vocabulary = HEBREW_WORDS if (len(words) // run_words) % 2 else ENGLISH_WORDS
+        word = rng.choice(vocabulary) + rng.choice([" ", " ", ", ", ". "])
+        words.append(word)
+        length += len(word)
+    return "".join(words)[:size]
+
+
+def direction_per_character(detector: LanguageDetector, text: str) -> str:
+    """
+    The translate direction as computed before the segmenter.
+    """
+    hebrew_chars = 0
+    english_chars = 0
+    for char in text:
+        lang = detector.detect_character_language(char)
+        if lang == "hebrew":
+            hebrew_chars += 1
+        elif lang == "english":
+            english_chars += 1
+    return "hebrew" if hebrew_chars > english_chars else "english"
+
+
+def check_random_inputs(detector: LanguageDetector, count: int) -> None:
+    """
+    Assert that the span-based results equal the per-character ones on random strings.
+    """
+    rng = random.Random(0)
+    for _ in range(count):
+        text = "".join(rng.choice(FUZZ_ALPHABET) for _ in range(rng.randint(0, 40)))
+        spans = detector.segment(text)
+        assert direction_per_character(detector, text) == (detector.dominant_language(text) or "english"), text
+        assert detector.convert_last_language(text) == detector.convert_last_language(text, spans), text
+
+
+def bench(func) -> float:
+    """
+    Return the best per-call time in milliseconds.
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(number=number, repeat=3)) / number * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--run-words", type=int, default=3)
+    parser.add_argument("--fuzz", type=int, default=100_000, help="Random strings checked before timing")
+    args = parser.parse_args()
+
+    detector = LanguageDetector()
+    check_random_inputs(detector, args.fuzz)
+    print(f"{'size':>9} {'spans':>7} {'dir loop':>9} {'dir bytes':>10} {'last rev':>9} "
+          f"{'last spans':>11} {'segment':>8} {'all runs':>9}   (ms)")
+    for size in SIZES:
+        text = make_text(size, args.run_words)
+        spans = detector.segment(text)
+        assert direction_per_character(detector, text) == detector.dominant_language(text)
+        assert detector.convert_last_language(text) == detector.convert_last_language(text, spans)
+
+        direction_loop = bench(lambda: direction_per_character(detector, text))
+        direction_spans = bench(lambda: detector.dominant_language(text))
+        last_reversed = bench(lambda: detector.convert_last_language(text))
+        last_spans = bench(lambda: detector.convert_last_language(text, spans))
+        segment = bench(lambda: detector.segment(text))
+        all_runs = bench(lambda: detector.convert_mistyped_runs(text, lambda original, converted: (None, 0.0), spans))
+        print(f"{size:>9} {len(spans):>7} {direction_loop:>9.3f} {direction_spans:>10.3f} {last_reversed:>9.3f} "
+              f"{last_spans:>11.3f} {segment:>8.3f} {all_runs:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
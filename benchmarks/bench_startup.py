@@ -0,0 +1,91 @@
+"""
+Startup-time benchmark: time from launching the server process to its first
+200 on /health and on /api/convert, with lazy and eager analyzer startup.
+
+With LAZY_STARTUP=true /health answers as soon as the web framework is up,
+while /api/convert waits for the background warm-up; with LAZY_STARTUP=false
+both wait for the model to be built and probed on the import path.
+
+Usage:
+    python benchmarks/bench_startup.py [--server flask|asgi] [--runs 3]
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cloud-server")
+TIMEOUT = 120
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def server_command(server, port):
+    if server == "asgi":
+        return [sys.executable, "-m", "uvicorn", "asgi_app:app", "--host", "127.0.0.1", "--port", str(port)]
+    return [sys.executable, "-c", f"from app import app; app.run(host='127.0.0.1', port={port})"]
+
+
+def first_200(url, started, data=None):
+    """
+    Poll url until it answers 200; return seconds since started.
+    """
+    body = json.dumps(data).encode("utf-8") if data is not None else None
+    while time.perf_counter() - started < TIMEOUT:
+        request = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=TIMEOUT) as response:
+                if response.status == 200:
+                    return time.perf_counter() - started
+        except (urllib.error.URLError, ConnectionError):
+            pass
+        time.sleep(0.02)
+    return None
+
+
+def run_once(server, lazy):
+    port = free_port()
+    env = dict(os.environ, LAZY_STARTUP="true" if lazy else "false")
+    started = time.perf_counter()
+    process = subprocess.Popen(server_command(server, port), cwd=SERVER_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        base = f"http://127.0.0.1:{port}"
+        health = first_200(f"{base}/health", started)
+        convert = first_200(f"{base}/api/convert", started, {"text": "akuo"})
+        return health, convert
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def fmt(values):
+    values = [value for value in values if value is not None]
+    return f"{statistics.median(values):7.2f}s" if values else "    n/a"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=["flask", "asgi"], default="flask")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'mode':>6}  {'first /health 200':>18}  {'first /api/convert 200':>23}  (median of {args.runs})")
+    for lazy in (True, False):
+        results = [run_once(args.server, lazy) for _ in range(args.runs)]
+        print(f"{'lazy' if lazy else 'eager':>6}  {fmt([r[0] for r in results]):>18}  {fmt([r[1] for r in results]):>23}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Translation latency vs. input length, single-shot and chunked.
+
+Runs the analyzer in-process on the deterministic fake model. Its latency is
+a fixed base plus a per-output-token cost, like a real model generating the
+translation. Single-shot latency therefore grows linearly with the input,
+while chunked translation pays roughly one chunk's generation time per
+round of TRANSLATE_CHUNK_WORKERS concurrent chunks. The result cache is
+cleared before every call.
+
+Usage:
+    python benchmarks/bench_translate_chunks.py [--chunk-chars 1500] [--workers 4]
+        [--latency-ms 300] [--ms-per-token 10] [--repeat 3]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cloud-server")
+sys.path.insert(0, SERVER_DIR)
+
+SIZES = [250, 500, 1_000, 2_000, 4_000, 8_000, 16_000]
+PARAGRAPH = ("The meeting moved to Thursday afternoon. Please bring the updated budget and the list of "
+             "open questions! Who will take the notes this time?")
+
+
+def make_text(size: int) -> str:
+    """
+    Build an English input of about `size` characters made of short paragraphs.
+    """
+    paragraphs = []
+    while sum(len(paragraph) + 2 for paragraph in paragraphs) < size:
+        paragraphs.append(f"{PARAGRAPH} ({len(paragraphs) + 1})")
+    return "\n\n".join(paragraphs)[:size].rstrip()
+
+
+def timed(analyzer, text: str, repeat: int) -> float:
+    """
+    Median wall time of translate_with_vertex on text, with a cold cache.
+    """
+    samples = []
+    for _ in range(repeat):
+        analyzer.result_cache.clear()
+        started = time.perf_counter()
+        analyzer.translate_with_vertex(text)
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunk-chars", type=int, default=1500)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--ms-per-token", type=float, default=10)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    os.environ.update({
+        "LLM_BACKEND": "fake",
+        "FAKE_LLM_LATENCY_MS": str(args.latency_ms),
+        "FAKE_LLM_LATENCY_SIGMA": "0",
+        "FAKE_LLM_MS_PER_TOKEN": str(args.ms_per_token),
+        "TRANSLATE_CHUNK_WORKERS": str(args.workers),
+        "RESULT_CACHE_DB_PATH": "",
+    })
+    import logging
+    from langchain_vertex_analyzer import LangChainTextAnalyzer
+    from text_chunker import split_into_chunks
+    logging.getLogger().setLevel(logging.WARNING)
+
+    analyzer = LangChainTextAnalyzer()
+    # Without a route output cap the single-shot answers are not truncated
+    for route in analyzer.router.routes + [analyzer.router.fallback_route]:
+        route.max_output_tokens = 1_000_000
+
+    print(f"{'chars':>7} {'chunks':>7} {'single (ms)':>12} {'chunked (ms)':>13} {'speedup':>8}")
+    for size in SIZES:
+        text = make_text(size)
+        analyzer.translate_chunk_chars = 0
+        single = timed(analyzer, text, args.repeat)
+        analyzer.translate_chunk_chars = args.chunk_chars
+        chunks = len(split_into_chunks(text, args.chunk_chars)[0]) if len(text) > args.chunk_chars else 1
+        chunked = timed(analyzer, text, args.repeat)
+        print(f"{len(text):>7} {chunks:>7} {single * 1000:>12.0f} {chunked * 1000:>13.0f} {single / chunked:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+In-memory stand-in for a Redis server, for exercising RedisLimiterBackend locally.
+
+Speaks enough of the RESP protocol for redis-py and implements the commands the
+limiter uses. Lua is not interpreted: the limiter's ADMIT_SCRIPT and
+ACQUIRE_SCRIPT are recognized by their SHA1 and executed by an equivalent Python function, atomically with
+respect to other commands (the server handles one command at a time).
+
+Usage:
+    python benchmarks/local_redis_server.py [--port 6390]
+    LIMITER_BACKEND=redis REDIS_URL=redis://localhost:6390/0 gunicorn app:app
+"""
+
+import argparse
+import asyncio
+import hashlib
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cloud-server"))
+
+from limiter_backends import ACQUIRE_SCRIPT, ADMIT_SCRIPT  # noqa: E402
+
+
+class ReplyError(Exception):
+    pass
+
+
+class InMemoryStore:
+    """
+    Hashes and sorted sets with expiry, plus the limiter's scripts
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+        self.scripts = {}
+        self.register(ADMIT_SCRIPT, self._admit)
+        self.register(ACQUIRE_SCRIPT, self._acquire)
+
+    def register(self, script, handler):
+        self.scripts[hashlib.sha1(script.encode("utf-8")).hexdigest()] = handler
+
+    def _get(self, key, kind):
+        expires_at = self.expires.get(key)
+        if expires_at is not None and expires_at <= time.time():
+            self.data.pop(key, None)
+            del self.expires[key]
+        return self.data.setdefault(key, kind()) if kind else self.data.get(key)
+
+    def _admit(self, keys, args):
+        rate = self._get(keys[0], dict)
+        window, fraction, limit, weight = float(args[0]), float(args[1]), float(args[2]), float(args[3])
+
+        stored_window = rate.get("w")
+        current, previous = rate.get("cur", 0.0), rate.get("prev", 0.0)
+        if stored_window is None:
+            current = previous = 0.0
+        elif stored_window != window:
+            previous = current if window - stored_window == 1 else 0.0
+            current = 0.0
+        if previous * (1 - fraction) + current + weight > limit:
+            return 0
+
+        rate.update(w=window, cur=current + weight, prev=previous)
+        self.expires[keys[0]] = time.time() + float(args[4])
+        return 1 if self._acquire([keys[1]], args[5:]) else -1
+
+    def _acquire(self, keys, args):
+        leases = self._get(keys[0], dict)
+        now = float(args[0])
+        for member in [member for member, score in leases.items() if score <= now]:
+            del leases[member]
+        if len(leases) >= float(args[1]):
+            return 0
+        leases[args[3]] = float(args[2])
+        return 1
+
+    def execute(self, command, args):
+        if command == "PING":
+            return "PONG"
+        if command == "HELLO":
+            protocol = int(args[0]) if args else 2
+            reply = {"server": "redis", "version": "7.0.0", "proto": protocol, "mode": "standalone"}
+            return reply if protocol == 3 else [item for pair in reply.items() for item in pair]
+        if command in ("CLIENT", "SELECT"):
+            return "OK"
+        if command == "SCRIPT" and args[0].upper() == "LOAD":
+            sha = hashlib.sha1(args[1].encode("utf-8")).hexdigest()
+            if sha not in self.scripts:
+                raise ReplyError("ERR only the limiter scripts are supported")
+            return sha
+        if command in ("EVALSHA", "EVAL"):
+            sha = args[0] if command == "EVALSHA" else hashlib.sha1(args[0].encode("utf-8")).hexdigest()
+            handler = self.scripts.get(sha)
+            if handler is None:
+                raise ReplyError("NOSCRIPT No matching script. Please use EVAL.")
+            numkeys = int(args[1])
+            return handler(args[2:2 + numkeys], args[2 + numkeys:])
+        if command == "ZREM":
+            leases = self._get(args[0], None) or {}
+            return sum(1 for member in args[1:] if leases.pop(member, None) is not None)
+        if command == "ZCOUNT":
+            leases = self._get(args[0], None) or {}
+            low = float("-inf") if args[1] == "-inf" else float(args[1])
+            high = float("inf") if args[2] == "+inf" else float(args[2])
+            return sum(1 for score in leases.values() if low <= score <= high)
+        if command == "FLUSHALL":
+            self.data.clear()
+            self.expires.clear()
+            return "OK"
+        raise ReplyError(f"ERR unknown command '{command}'")
+
+
+def encode(value):
+    if isinstance(value, ReplyError):
+        return f"-{value}\r\n".encode("utf-8")
+    if isinstance(value, int):
+        return f":{value}\r\n".encode("utf-8")
+    if isinstance(value, str):
+        return f"+{value}\r\n".encode("utf-8")
+    if isinstance(value, dict):
+        # RESP3 map
+        return f"%{len(value)}\r\n".encode("utf-8") + b"".join(
+            encode(key) + encode(item) for key, item in value.items()
+        )
+    if isinstance(value, list):
+        return f"*{len(value)}\r\n".encode("utf-8") + b"".join(encode(item) for item in value)
+    raise TypeError(type(value))
+
+
+async def read_command(reader):
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        # Inline command
+        return line.decode("utf-8").split()
+    parts = []
+    for _ in range(int(line[1:])):
+        size = int((await reader.readline())[1:])
+        parts.append((await reader.readexactly(size + 2))[:-2].decode("utf-8"))
+    return parts
+
+
+def make_handler(store):
+    async def handle(reader, writer):
+        try:
+            while True:
+                parts = await read_command(reader)
+                if parts is None:
+                    break
+                try:
+                    reply = store.execute(parts[0].upper(), parts[1:])
+                except ReplyError as e:
+                    reply = e
+                writer.write(encode(reply))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    return handle
+
+
+async def serve(host, port, ready=None):
+    server = await asyncio.start_server(make_handler(InMemoryStore()), host, port)
+    if ready is not None:
+        ready.set()
+    async with server:
+        await server.serve_forever()
+
+
+def start_in_thread(host="127.0.0.1", port=6390):
+    """
+    Run the server on a daemon thread; returns once it accepts connections.
+    """
+    ready = threading.Event()
+    threading.Thread(target=lambda: asyncio.run(serve(host, port, ready)), daemon=True).start()
+    ready.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    args = parser.parse_args()
+    print(f"In-memory Redis stand-in listening on {args.host}:{args.port}")
+    asyncio.run(serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
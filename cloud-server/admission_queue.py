@@ -0,0 +1,311 @@
+"""
+admission_queue.py - Bounded priority queue for requests waiting for a concurrency slot.
+
+Instead of answering 503 as soon as every slot is taken, the API limiter parks
+the request here for up to its endpoint's max queue time. A slot released in
+this process is handed straight to the highest-priority waiter (FIFO within a
+class); with a shared limiter backend the head waiter also polls for slots
+freed by other workers. Requests that could not be served before their
+deadline are rejected up front instead of queueing.
+"""
+
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from metrics import Histogram
+from retry_policy import get_request_deadline
+
+# Priority classes, served lowest value first
+PRIORITY_INTERACTIVE = 0   # keystroke fixes (/api/convert)
+PRIORITY_BATCH = 1         # /api/convert/batch
+PRIORITY_BACKGROUND = 2    # translation and rephrasing
+
+QUEUE_DEPTH_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+WAIT_MS_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class _Waiter:
+    """
+    A request waiting for a slot
+    """
+
+    __slots__ = ('priority', 'seq', 'token', 'signal')
+
+    def __init__(self, priority, seq, signal):
+        self.priority = priority
+        self.seq = seq
+        self.token = None
+        self.signal = signal
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class _AdmissionQueueBase:
+    """
+    Waiter bookkeeping and statistics shared by the thread and asyncio queues
+    """
+
+    def __init__(self, max_depth=100, poll_interval=0.05):
+        self.max_depth = max_depth
+        # How often the head waiter checks for slots freed by other workers
+        self.poll_interval = poll_interval
+        self._heap = []
+        self._seq = itertools.count()
+        # Counters
+        self.enqueued = 0
+        self.admitted = 0
+        self.handed_off = 0
+        self.timed_out = 0
+        self.rejected_full = 0
+        self.rejected_deadline = 0
+        self.depth_histogram = Histogram(QUEUE_DEPTH_BUCKETS)
+        self.wait_histogram = Histogram(WAIT_MS_BUCKETS)
+
+    def __len__(self):
+        return len(self._heap)
+
+    def _max_wait(self, priority, max_queue_time, service_time, slots):
+        """
+        How long a new waiter may wait, or None if it should be rejected now.
+        """
+        if len(self._heap) >= self.max_depth:
+            self.rejected_full += 1
+            return None
+
+        max_wait = max_queue_time
+        deadline = get_request_deadline()
+        if deadline is not None:
+            # Leave time to actually serve the request once admitted
+            max_wait = min(max_wait, deadline - time.monotonic() - service_time)
+
+        # Expected wait: waiters of the same or higher priority drain `slots` at a time
+        ahead = sum(1 for waiter in self._heap if waiter.priority <= priority)
+        expected_wait = (ahead + 1) * service_time / max(1, slots)
+        if max_wait <= 0 or expected_wait > max_wait:
+            self.rejected_deadline += 1
+            return None
+        return max_wait
+
+    def _push(self, waiter):
+        heapq.heappush(self._heap, waiter)
+
+    def _enqueue(self, priority, signal):
+        waiter = _Waiter(priority, next(self._seq), signal)
+        self.depth_histogram.observe(len(self._heap))
+        self._push(waiter)
+        self.enqueued += 1
+        return waiter
+
+    def _is_head(self, waiter):
+        return bool(self._heap) and self._heap[0] is waiter
+
+    def _remove(self, waiter):
+        if waiter in self._heap:
+            self._heap.remove(waiter)
+            heapq.heapify(self._heap)
+
+    def _pop_head(self):
+        return heapq.heappop(self._heap) if self._heap else None
+
+    def _record_admission(self, waited):
+        self.admitted += 1
+        self.wait_histogram.observe(waited * 1000)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return queue counters and histograms for the health endpoint.
+        """
+        return {
+            'depth': len(self._heap),
+            'max_depth': self.max_depth,
+            'enqueued': self.enqueued,
+            'admitted': self.admitted,
+            'handed_off': self.handed_off,
+            'timed_out': self.timed_out,
+            'rejected_full': self.rejected_full,
+            'rejected_deadline': self.rejected_deadline,
+            'depth_histogram': self.depth_histogram.snapshot(),
+            'wait_ms_histogram': self.wait_histogram.snapshot()
+        }
+
+
+class AdmissionQueue(_AdmissionQueueBase):
+    """
+    Admission queue for threaded servers (Flask under gunicorn)
+    """
+
+    def __init__(self, max_depth=100, poll_interval=0.05):
+        super().__init__(max_depth, poll_interval)
+        # Lock for thread-safe operations
+        self.lock = threading.Lock()
+
+    def wait(self, priority: int, max_queue_time: float, service_time: float, slots: int,
+             try_acquire: Optional[Callable[[], Any]] = None) -> Any:
+        """
+        Wait for a concurrency slot.
+
+        Args:
+            priority: Priority class of the request (PRIORITY_*)
+            max_queue_time: Longest time the endpoint lets a request wait, in seconds
+            service_time: Expected duration of a call once admitted, in seconds
+            slots: Current concurrency limit
+            try_acquire: Optional callable taking a slot from a shared backend
+                         (returns a release token or None); polled by the head waiter
+
+        Returns:
+            Release token of the slot, or None if the request should be rejected
+        """
+        with self.lock:
+            max_wait = self._max_wait(priority, max_queue_time, service_time, slots)
+            if max_wait is None:
+                return None
+            waiter = self._enqueue(priority, threading.Event())
+
+        started = time.monotonic()
+        end = started + max_wait
+        while True:
+            remaining = end - time.monotonic()
+            if remaining > 0:
+                waiter.signal.wait(min(remaining, self.poll_interval) if try_acquire else remaining)
+
+            polling = False
+            with self.lock:
+                if waiter.token is None and try_acquire is not None and self._is_head(waiter):
+                    # Leave the heap while polling so no hand-off targets us meanwhile
+                    self._remove(waiter)
+                    polling = True
+            if polling:
+                token = try_acquire()
+                with self.lock:
+                    if token is not None:
+                        waiter.token = token
+                    else:
+                        self._push(waiter)
+
+            with self.lock:
+                if waiter.token is not None:
+                    self._record_admission(time.monotonic() - started)
+                    return waiter.token
+                if time.monotonic() >= end:
+                    self._remove(waiter)
+                    self.timed_out += 1
+                    return None
+
+    def hand_off(self, token: Any) -> bool:
+        """
+        Give a released slot to the highest-priority waiter.
+
+        Returns:
+            True if a waiter took the slot, False if the caller must release it
+        """
+        with self.lock:
+            waiter = self._pop_head()
+            if waiter is None:
+                return False
+            waiter.token = token
+            self.handed_off += 1
+        waiter.signal.set()
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return super().stats()
+
+
+class AsyncAdmissionQueue(_AdmissionQueueBase):
+    """
+    Admission queue for the asyncio (ASGI) server; used from the event loop thread only
+    """
+
+    def __init__(self, max_depth=100, poll_interval=0.05):
+        super().__init__(max_depth, poll_interval)
+        # Release tasks of slots whose waiter was cancelled, kept referenced until they finish
+        self._releases = set()
+
+    async def wait(self, priority: int, max_queue_time: float, service_time: float, slots: int,
+                   try_acquire: Optional[Callable[[], Awaitable[Any]]] = None,
+                   release: Optional[Callable[[Any], Awaitable[Any]]] = None) -> Any:
+        """
+        Async version of AdmissionQueue.wait; try_acquire is an async callable.
+
+        Args:
+            release: Optional async callable giving back a slot's token; called for a
+                     slot that reached this waiter after it was cancelled
+        """
+        max_wait = self._max_wait(priority, max_queue_time, service_time, slots)
+        if max_wait is None:
+            return None
+        waiter = self._enqueue(priority, asyncio.Event())
+
+        started = time.monotonic()
+        end = started + max_wait
+        admitted = False
+        try:
+            while waiter.token is None:
+                remaining = end - time.monotonic()
+                if remaining <= 0:
+                    self.timed_out += 1
+                    return None
+                try:
+                    await asyncio.wait_for(waiter.signal.wait(),
+                                           timeout=min(remaining, self.poll_interval) if try_acquire else remaining)
+                except asyncio.TimeoutError:
+                    if try_acquire is not None and self._is_head(waiter):
+                        # Leave the heap while polling so no hand-off targets us meanwhile
+                        self._remove(waiter)
+                        waiter.token = await self._acquire(try_acquire, release)
+                        if waiter.token is None:
+                            self._push(waiter)
+            self._record_admission(time.monotonic() - started)
+            admitted = True
+            return waiter.token
+        finally:
+            self._remove(waiter)
+            if not admitted and waiter.token is not None:
+                # Cancelled after a hand-off or a successful poll: the slot must not leak
+                self._release_later(waiter.token, release)
+
+    async def _acquire(self, try_acquire: Callable[[], Awaitable[Any]],
+                       release: Optional[Callable[[Any], Awaitable[Any]]]) -> Any:
+        """
+        Poll the shared backend for a slot, releasing it if this waiter is cancelled meanwhile.
+        """
+        # Shielded: a backend call in a worker thread completes even if this waiter is cancelled
+        acquire = asyncio.ensure_future(try_acquire())
+        try:
+            return await asyncio.shield(acquire)
+        except asyncio.CancelledError:
+            acquire.add_done_callback(
+                lambda task: not task.cancelled() and task.exception() is None
+                and task.result() is not None and self._release_later(task.result(), release))
+            raise
+
+    def _release_later(self, token: Any, release: Optional[Callable[[Any], Awaitable[Any]]]) -> None:
+        """
+        Give back a slot no waiter will use, without awaiting in a cancelled task.
+        """
+        if release is None:
+            return
+        task = asyncio.ensure_future(release(token))
+        self._releases.add(task)
+        task.add_done_callback(self._releases.discard)
+
+    def hand_off(self, token: Any) -> bool:
+        """
+        Give a released slot to the highest-priority waiter.
+
+        Returns:
+            True if a waiter took the slot, False if the caller must release it
+        """
+        waiter = self._pop_head()
+        if waiter is None:
+            return False
+        waiter.token = token
+        waiter.signal.set()
+        self.handed_off += 1
+        return True
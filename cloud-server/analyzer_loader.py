@@ -0,0 +1,171 @@
+"""
+analyzer_loader.py - Non-blocking startup of the LangChainTextAnalyzer.
+
+Importing vertexai/langchain, vertexai.init and building the model take
+seconds, and the old startup then spent an LLM round trip (plus retries) on a
+synthetic availability prompt, all before the server could answer /health.
+
+In lazy mode (LAZY_STARTUP=true, the default) the heavy imports and the model
+construction run on a background warm-up thread; the server starts serving
+immediately, /health reports the readiness state, and requests arriving
+during warm-up wait for it (bounded by STARTUP_WAIT_SECONDS). Availability is
+derived from the outcome of real LLM calls instead of a probe prompt.
+
+In eager mode the analyzer is built and probed with is_available() on the
+import path, as before.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+STARTING = "starting"
+READY = "ready"
+FAILED = "failed"
+
+
+class AnalyzerLoader:
+    """
+    Builds the text analyzer in the background and tracks readiness and availability
+    """
+
+    def __init__(self, lazy: bool = True, wait_timeout: float = 10.0):
+        self.lazy = lazy
+        # Longest time a request waits for the warm-up to finish
+        self.wait_timeout = wait_timeout
+        self.state = STARTING
+        self.error: Optional[str] = None
+        self.analyzer = None
+        self._ready = threading.Event()
+        self._on_ready: List[Callable[[Any], None]] = []
+        self._created_at = time.monotonic()
+        self.startup_seconds: Optional[float] = None
+        # Outcomes of real LLM calls
+        self.lock = threading.Lock()
+        self.successes = 0
+        self.failures = 0
+        self.last_success: Optional[float] = None
+        self.last_failure: Optional[float] = None
+
+    def on_ready(self, callback: Callable[[Any], None]) -> None:
+        """
+        Register a callback receiving the analyzer once it is built
+        (called immediately if it already is).
+        """
+        if self.state == READY:
+            callback(self.analyzer)
+        else:
+            self._on_ready.append(callback)
+
+    def start(self) -> None:
+        """
+        Build the analyzer: on a daemon thread in lazy mode, inline otherwise.
+        """
+        if self.lazy:
+            threading.Thread(target=self._load, name="analyzer-warmup", daemon=True).start()
+        else:
+            self._load()
+
+    def _load(self) -> None:
+        try:
+            # Imported here so vertexai/langchain are loaded off the import path in lazy mode
+            from langchain_vertex_analyzer import LangChainTextAnalyzer
+
+            analyzer = LangChainTextAnalyzer()
+            if not self.lazy and not analyzer.is_available():
+                raise RuntimeError("Vertex AI availability check failed")
+            analyzer.retry_policy.add_listener(self._observe)
+            for callback in self._on_ready:
+                callback(analyzer)
+
+            self.analyzer = analyzer
+            self.state = READY
+            logger.info(f"AI text analysis ready after {time.monotonic() - self._created_at:.2f}s")
+        except Exception as e:
+            logger.error(f"Failed to initialize LangChainTextAnalyzer: {str(e)}")
+            self.error = str(e)
+            self.state = FAILED
+        finally:
+            self.startup_seconds = round(time.monotonic() - self._created_at, 3)
+            self._ready.set()
+
+    def _observe(self, rtt: float, success: bool) -> None:
+        """
+        RetryPolicy listener recording the outcome of every LLM attempt.
+        """
+        with self.lock:
+            if success:
+                self.successes += 1
+                self.last_success = time.time()
+            else:
+                self.failures += 1
+                self.last_failure = time.time()
+
+    def get(self, timeout: Optional[float] = None) -> Any:
+        """
+        Return the analyzer, waiting for the warm-up to finish if needed.
+
+        Returns:
+            The analyzer, or None if it failed to initialize or is still starting
+        """
+        if self.state == STARTING:
+            self._ready.wait(self.wait_timeout if timeout is None else timeout)
+        return self.analyzer if self.state == READY else None
+
+    async def aget(self, timeout: Optional[float] = None) -> Any:
+        """
+        Async version of get; waits without blocking the event loop.
+        """
+        if self.state == STARTING:
+            await asyncio.to_thread(self._ready.wait, self.wait_timeout if timeout is None else timeout)
+        return self.analyzer if self.state == READY else None
+
+    @property
+    def available(self) -> Optional[bool]:
+        """
+        Whether AI text analysis works, judged from real traffic: False if the analyzer
+        failed to initialize or the circuit breaker is not closed after consecutive
+        failed Vertex AI calls, None before there is any evidence.
+        """
+        if self.state == FAILED:
+            return False
+        if self.state == STARTING:
+            return None
+        with self.lock:
+            if not self.successes and not self.failures:
+                # Eager mode passed the availability probe; lazy mode has no evidence yet
+                return None if self.lazy else True
+        breaker = self.analyzer.retry_policy.breaker
+        return breaker.state == breaker.CLOSED
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return readiness information for the health endpoint.
+        """
+        with self.lock:
+            return {
+                'state': self.state,
+                'lazy': self.lazy,
+                'startup_seconds': self.startup_seconds,
+                'error': self.error,
+                'llm_successes': self.successes,
+                'llm_failures': self.failures,
+                'last_llm_success': self.last_success,
+                'last_llm_failure': self.last_failure
+            }
+
+
+def create_analyzer_loader() -> AnalyzerLoader:
+    """
+    Build the loader from LAZY_STARTUP and STARTUP_WAIT_SECONDS; call start() on it
+    after registering on_ready callbacks.
+    """
+    return AnalyzerLoader(
+        lazy=os.getenv("LAZY_STARTUP", "true").lower() == "true",
+        wait_timeout=float(os.getenv("STARTUP_WAIT_SECONDS", "10"))
+    )
@@ -1,7 +1,13 @@
-import threading
+import asyncio
+import os
 import time
-from flask import jsonify, request
-from functools import wraps
+from flask import Response, jsonify, request
+from functools import partial, wraps
+
+from admission_queue import PRIORITY_INTERACTIVE, AdmissionQueue, AsyncAdmissionQueue
+from concurrency_limit import create_concurrency_limit
+from limiter_backends import ADMITTED, BUSY, RATE_LIMITED, create_limiter_backend
+from metrics import REJECTIONS, STAGE_LIMITER, metrics
 
 
 class APILimiter:
@@ -9,49 +15,137 @@ class APILimiter:
     API limiter that restricts concurrent API calls and implements rate limiting
     """
 
-    def __init__(self, max_concurrent_calls=40):
-        # Maximum allowed concurrent API calls
-        self.max_concurrent_calls = max_concurrent_calls
-        # Counter for active API calls
-        self.active_calls = 0
-        # Lock for thread-safe operations
-        self.lock = threading.Lock()
-        # Dictionary to store request history by IP
-        self.rate_limits = {}  # IP -> [timestamp, timestamp, ...]
+    def __init__(self, max_concurrent_calls=40, backend=None, concurrency=None):
+        # Maximum allowed concurrent API calls; fixed, or adapted from LLM latency
+        # when CONCURRENCY_MODE is aimd or gradient
+        self.concurrency = concurrency or create_concurrency_limit(max_concurrent_calls)
+        # Per-IP request rates and active calls; shared across workers/instances
+        # when LIMITER_BACKEND is shared_memory or redis
+        self.backend = backend or create_limiter_backend()
+        # Requests waiting for a slot when all are taken
+        self.queue = self._create_queue(int(os.getenv("ADMISSION_QUEUE_MAX_DEPTH", "100")))
+
+    def _create_queue(self, max_depth):
+        return AdmissionQueue(max_depth=max_depth)
+
+    @property
+    def max_concurrent_calls(self):
+        """
+        Current limit on concurrent API calls
+        """
+        return self.concurrency.current
+
+    @property
+    def active_calls(self):
+        """
+        Number of API calls currently in progress
+        """
+        return self.backend.active_calls()
+
+    def observe_llm_call(self, rtt, success):
+        """
+        Feed the duration and outcome of an LLM attempt to the concurrency limit.
+        Registered as a RetryPolicy listener by the servers.
+        """
+        # Skip the in-flight count when it would cost a network round trip
+        in_flight = None if self.backend.networked else self.active_calls
+        self.concurrency.observe(rtt, success, in_flight)
 
-    def _is_rate_limited(self, ip, max_per_minute=30):
+    def _admit(self, ip, max_per_minute=30, weight=1):
         """
-        Check if an IP address exceeds the rate limit
+        Check the rate limit of an IP address and take a concurrency slot
 
         Args:
             ip: Client IP address
             max_per_minute: Maximum allowed requests per minute
+            weight: Number of requests this call counts as
 
         Returns:
-            True if rate limited, False otherwise
+            Tuple of (admission result, release token)
         """
-        now = time.time()
+        return self.backend.admit(ip, max_per_minute, weight, self.max_concurrent_calls)
 
-        # Clean up old records (older than one minute)
-        if ip in self.rate_limits:
-            self.rate_limits[ip] = [t for t in self.rate_limits[ip] if now - t < 60]
-        else:
-            self.rate_limits[ip] = []
+    def _service_time(self):
+        """
+        Expected duration of an admitted call, from the recent LLM round-trip times
+        """
+        return self.concurrency.short_rtt or 0.0
+
+    def _can_hand_off(self):
+        """
+        Check if a released slot may go to a queued request; not when the
+        concurrency limit has shrunk below the calls in progress
+        """
+        return self.backend.networked or self.active_calls <= self.max_concurrent_calls
 
-        # Check if limit reached
-        if len(self.rate_limits[ip]) >= max_per_minute:
-            return True
+    def _wait_for_slot(self, priority, max_queue_time):
+        """
+        Queue for a concurrency slot
 
-        # Add new timestamp to history
-        self.rate_limits[ip].append(now)
-        return False
+        Returns:
+            Release token, or None if the request should be rejected
+        """
+        try_acquire = partial(self.backend.acquire, self.max_concurrent_calls) if self.backend.shared else None
+        return self.queue.wait(priority, max_queue_time, self._service_time(), self.max_concurrent_calls,
+                               try_acquire)
 
-    def limit_api(self, max_calls_per_minute=30):
+    def _release_call(self, token):
+        """
+        Give the concurrency slot of a finished call to the next queued request, or back
+        """
+        if not (self._can_hand_off() and self.queue.hand_off(token)):
+            self.backend.release(token)
+
+    def try_acquire_slot(self):
+        """
+        Take an extra concurrency slot for work fanned out by an admitted request
+        (e.g. translation chunks), without waiting and without a rate limit check.
+        Never taken while requests are queued, so fan-out cannot starve them.
+
+        Returns:
+            Release token, or None if no slot is free
+        """
+        if len(self.queue):
+            return None
+        return self.backend.acquire(self.max_concurrent_calls)
+
+    def release_slot(self, token):
+        """
+        Give back a slot taken with try_acquire_slot
+        """
+        self._release_call(token)
+
+    async def atry_acquire_slot(self):
+        """
+        Async version of try_acquire_slot
+        """
+        return self.try_acquire_slot()
+
+    async def arelease_slot(self, token):
+        """
+        Async version of release_slot
+        """
+        self.release_slot(token)
+
+    @staticmethod
+    def _rejection(status):
+        """
+        Error body and status code of a rejected request
+        """
+        if status == RATE_LIMITED:
+            return {'error': 'Too many requests. Please try again later.', 'status': 429}, 429
+        return {'error': 'Server is busy. Please try again later.', 'status': 503}, 503
+
+    def limit_api(self, max_calls_per_minute=30, weight=None, priority=PRIORITY_INTERACTIVE, max_queue_time=1.0):
         """
         Decorator to limit API calls
 
         Args:
             max_calls_per_minute: Maximum requests per minute per IP
+            weight: Optional callable returning how many requests the current
+                    request counts as (e.g. the number of items in a batch)
+            priority: Priority class when waiting for a slot (PRIORITY_*)
+            max_queue_time: Longest time to wait for a slot before answering 503, in seconds
 
         Returns:
             Decorated function
@@ -65,29 +159,141 @@ class APILimiter:
                 if request.headers.get('X-Forwarded-For'):
                     ip = request.headers.get('X-Forwarded-For').split(',')[0].strip()
 
-                # Check rate limiting by IP
-                if self._is_rate_limited(ip, max_calls_per_minute):
-                    return jsonify({
-                        'error': 'Too many requests. Please try again later.',
-                        'status': 429
-                    }), 429
-
-                # Check system load
-                with self.lock:
-                    if self.active_calls >= self.max_concurrent_calls:
-                        return jsonify({
-                            'error': 'Server is busy. Please try again later.',
-                            'status': 503
-                        }), 503
-                    self.active_calls += 1
+                # Check rate limiting by IP and system load
+                started = time.perf_counter()
+                request_weight = max(1, weight()) if weight else 1
+                status, token = self._admit(ip, max_calls_per_minute, request_weight)
+                if status == BUSY:
+                    token = self._wait_for_slot(priority, max_queue_time)
+                    if token is not None:
+                        status = ADMITTED
+                metrics.observe_stage(STAGE_LIMITER, time.perf_counter() - started)
+                if status != ADMITTED:
+                    body, code = self._rejection(status)
+                    metrics.count(REJECTIONS, str(code))
+                    return jsonify(body), code
 
                 # Execute the function
+                release_on_close = False
+                try:
+                    result = func(*args, **kwargs)
+                    # Streamed responses keep their slot until the stream is closed
+                    if isinstance(result, Response) and result.is_streamed:
+                        result.call_on_close(partial(self._release_call, token))
+                        release_on_close = True
+                    return result
+                finally:
+                    if not release_on_close:
+                        self._release_call(token)
+
+            return wrapper
+
+        return decorator
+
+
+class AsyncAPILimiter(APILimiter):
+    """
+    API limiter for the asyncio (ASGI) server.
+
+    Backends that talk to the network (redis) are called from a worker thread
+    so the event loop is never blocked; streamed responses release their slot
+    when the stream ends.
+    """
+
+    def _create_queue(self, max_depth):
+        return AsyncAdmissionQueue(max_depth=max_depth)
+
+    async def _call_backend(self, func, *args):
+        """
+        Call a backend method, off the event loop if it does network I/O
+        """
+        if self.backend.networked:
+            return await asyncio.to_thread(func, *args)
+        return func(*args)
+
+    async def _await_slot(self, priority, max_queue_time):
+        """
+        Async version of _wait_for_slot
+        """
+        try_acquire = None
+        if self.backend.shared:
+            try_acquire = partial(self._call_backend, self.backend.acquire, self.max_concurrent_calls)
+        return await self.queue.wait(priority, max_queue_time, self._service_time(), self.max_concurrent_calls,
+                                     try_acquire, self._arelease_call)
+
+    async def _arelease_call(self, token):
+        """
+        Async version of _release_call
+        """
+        if not (self._can_hand_off() and self.queue.hand_off(token)):
+            await self._call_backend(self.backend.release, token)
+
+    async def atry_acquire_slot(self):
+        """
+        Async version of try_acquire_slot
+        """
+        if len(self.queue):
+            return None
+        return await self._call_backend(self.backend.acquire, self.max_concurrent_calls)
+
+    async def arelease_slot(self, token):
+        """
+        Async version of release_slot
+        """
+        await self._arelease_call(token)
+
+    def limit_api(self, max_calls_per_minute=30, weight=None, priority=PRIORITY_INTERACTIVE, max_queue_time=1.0):
+        """
+        Decorator to limit async Starlette endpoints
+
+        Args:
+            max_calls_per_minute: Maximum requests per minute per IP
+            weight: Optional async callable taking the request and returning how
+                    many requests it counts as
+            priority: Priority class when waiting for a slot (PRIORITY_*)
+            max_queue_time: Longest time to wait for a slot before answering 503, in seconds
+
+        Returns:
+            Decorated coroutine function
+        """
+        # Imported here so the Flask server does not depend on Starlette
+        from starlette.background import BackgroundTask
+        from starlette.responses import JSONResponse, StreamingResponse
+
+        def decorator(func):
+            @wraps(func)
+            async def wrapper(request):
+                # Get client IP address
+                ip = request.client.host if request.client else ''
+                if request.headers.get('X-Forwarded-For'):
+                    ip = request.headers.get('X-Forwarded-For').split(',')[0].strip()
+
+                # Check rate limiting by IP and system load
+                started = time.perf_counter()
+                request_weight = max(1, await weight(request)) if weight else 1
+                status, token = await self._call_backend(self._admit, ip, max_calls_per_minute, request_weight)
+                if status == BUSY:
+                    token = await self._await_slot(priority, max_queue_time)
+                    if token is not None:
+                        status = ADMITTED
+                metrics.observe_stage(STAGE_LIMITER, time.perf_counter() - started)
+                if status != ADMITTED:
+                    body, code = self._rejection(status)
+                    metrics.count(REJECTIONS, str(code))
+                    return JSONResponse(body, status_code=code)
+
+                # Execute the endpoint
+                release_on_close = False
                 try:
-                    return func(*args, **kwargs)
+                    result = await func(request)
+                    # Streamed responses keep their slot until the stream is sent
+                    if isinstance(result, StreamingResponse) and result.background is None:
+                        result.background = BackgroundTask(self._arelease_call, token)
+                        release_on_close = True
+                    return result
                 finally:
-                    # Decrease active calls counter
-                    with self.lock:
-                        self.active_calls -= 1
+                    if not release_on_close:
+                        await self._arelease_call(token)
 
             return wrapper
 
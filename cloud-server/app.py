@@ -1,24 +1,85 @@
-from flask import Flask, request, jsonify
-from langchain_vertex_analyzer import LangChainTextAnalyzer  #
+from flask import Flask, Response, request, jsonify, stream_with_context
+from analyzer_loader import create_analyzer_loader
 from flask_cors import CORS
 from api_limiter import initialize_api_limiter
+from admission_queue import PRIORITY_BACKGROUND, PRIORITY_BATCH, PRIORITY_INTERACTIVE
+from correction_sessions import parse_session_fields
+from metrics import CONTENT_TYPE, STAGE_PARSE, STAGE_RESPONSE, metrics
+from retry_policy import set_request_deadline
+import os
+import json
 import time
 import logging
 
 app = Flask(__name__)
 CORS(app)
 
-try:
-    text_analyzer = LangChainTextAnalyzer()
-    ai_analysis_available = text_analyzer.is_available()
-    logging.info(f"AI text analysis available: {ai_analysis_available}")
-except Exception as e:
-    logging.error(f"Failed to initialize LangChainTextAnalyzer: {str(e)}")
-    ai_analysis_available = False
-    text_analyzer = None
+# The analyzer (vertexai/langchain imports, model construction) is built by a
+# background warm-up unless LAZY_STARTUP=false; /health answers right away
+analyzer_loader = create_analyzer_loader()
 
-# Initialize API limiter with 40 max concurrent requests
-api_limiter = initialize_api_limiter(app, max_concurrent_calls=40)
+# Initialize API limiter; the concurrency limit starts at MAX_CONCURRENT_CALLS and
+# adapts to Vertex AI latency when CONCURRENCY_MODE is aimd or gradient
+MAX_CONCURRENT_CALLS = int(os.getenv("MAX_CONCURRENT_CALLS", "40"))
+api_limiter = initialize_api_limiter(app, max_concurrent_calls=MAX_CONCURRENT_CALLS)
+analyzer_loader.on_ready(lambda analyzer: analyzer.retry_policy.add_listener(api_limiter.observe_llm_call))
+# Extra chunk workers of long translations take their slots from the limiter
+analyzer_loader.on_ready(lambda analyzer: analyzer.set_chunk_limiter(api_limiter))
+analyzer_loader.start()
+
+# Longest time a request waits for a free slot before a 503, by priority class:
+# keystroke fixes go first and give up early, translation/rephrasing can wait longer
+INTERACTIVE_MAX_QUEUE_SECONDS = float(os.getenv("INTERACTIVE_MAX_QUEUE_SECONDS", "1"))
+BATCH_MAX_QUEUE_SECONDS = float(os.getenv("BATCH_MAX_QUEUE_SECONDS", "3"))
+BACKGROUND_MAX_QUEUE_SECONDS = float(os.getenv("BACKGROUND_MAX_QUEUE_SECONDS", "5"))
+
+# Time budget of a request, including LLM retries
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "20"))
+
+
+@app.before_request
+def start_request_deadline():
+    """
+    Start the deadline that bounds LLM retries for this request
+    """
+    set_request_deadline(REQUEST_DEADLINE_SECONDS)
+
+
+def parse_json():
+    """
+    Parse the JSON request body, recording the time spent in the parse stage
+    """
+    started = time.perf_counter()
+    data = request.get_json()
+    metrics.observe_stage(STAGE_PARSE, time.perf_counter() - started)
+    return data
+
+
+def json_response(body):
+    """
+    Serialize a successful JSON response, recording the time spent in the response stage
+    """
+    started = time.perf_counter()
+    response = jsonify(body)
+    metrics.observe_stage(STAGE_RESPONSE, time.perf_counter() - started)
+    return response
+
+
+def analysis_response(text_analyzer, text, session_id, prefix_hash):
+    """
+    Analyze a text, incrementally when the client sent a session id, and build the response
+    """
+    if session_id:
+        result = text_analyzer.analyze_and_correct_session(text, session_id, prefix_hash)
+    else:
+        result = text_analyzer.analyze_and_correct_text(text)
+    metrics.count_analysis(result['path'])
+
+    body = {'convertedText': result['corrected_text'], 'path': result['path']}
+    if session_id:
+        body['prefixHash'] = result['prefix_hash']
+        body['reusedChars'] = result['reused_chars']
+    return json_response(body)
 
 
 @app.route('/', methods=['GET', 'POST'])
@@ -33,49 +94,105 @@ def convert_text():
 
     # Handle POST request
     try:
-        data = request.get_json()
+        data = parse_json()
         text = data.get('text', '')
 
         if not text:
             return jsonify({'error': 'No text provided'}), 400
+        session_id, prefix_hash = parse_session_fields(data)
 
         # Use the AI analyzer to get corrected text
-        if ai_analysis_available and text_analyzer:
-            result = text_analyzer.analyze_and_correct_text(text)
-            return jsonify({'convertedText': result['corrected_text']})
+        text_analyzer = analyzer_loader.get()
+        if text_analyzer:
+            return analysis_response(text_analyzer, text, session_id, prefix_hash)
         else:
             return jsonify({'error': 'AI text analysis is not available'}), 503
 
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logging.error(f"Error in text analysis: {str(e)}")
         return jsonify({'error': 'Internal Server Error', 'message': str(e)}), 500
 
 
 @app.route('/api/convert', methods=['POST'])
-@api_limiter.limit_api(max_calls_per_minute=30)
+@api_limiter.limit_api(max_calls_per_minute=30, priority=PRIORITY_INTERACTIVE,
+                        max_queue_time=INTERACTIVE_MAX_QUEUE_SECONDS)
 def api_convert_text():
     """
     External API endpoint with rate limiting
     """
     try:
-        data = request.get_json()
+        data = parse_json()
         text = data.get('text', '')
 
         if not text:
             return jsonify({'error': 'No text provided'}), 400
+        session_id, prefix_hash = parse_session_fields(data)
 
         # Use the AI analyzer to get corrected text
-        if ai_analysis_available and text_analyzer:
-            result = text_analyzer.analyze_and_correct_text(text)
-            return jsonify({'convertedText': result['corrected_text']})
+        text_analyzer = analyzer_loader.get()
+        if text_analyzer:
+            return analysis_response(text_analyzer, text, session_id, prefix_hash)
         else:
             return jsonify({'error': 'AI text analysis is not available'}), 503
 
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logging.error(f"Error in text analysis: {str(e)}")
         return jsonify({'error': 'Internal Server Error', 'message': str(e)}), 500
 
 
+# Maximum number of texts accepted by the batch endpoint
+MAX_BATCH_ITEMS = 50
+
+
+def batch_item_count():
+    """
+    Rate limiter weight of a batch request: the number of texts it carries
+    """
+    data = request.get_json(silent=True) or {}
+    texts = data.get('texts')
+    return len(texts) if isinstance(texts, list) else 1
+
+
+@app.route('/api/convert/batch', methods=['POST'])
+@api_limiter.limit_api(max_calls_per_minute=30, weight=batch_item_count,
+                        priority=PRIORITY_BATCH, max_queue_time=BATCH_MAX_QUEUE_SECONDS)
+def api_convert_batch():
+    """
+    External API endpoint for correcting many texts in one request
+    """
+    try:
+        data = parse_json()
+        texts = data.get('texts')
+
+        if not isinstance(texts, list) or not texts:
+            return jsonify({'error': 'No texts provided'}), 400
+        if len(texts) > MAX_BATCH_ITEMS:
+            return jsonify({'error': f'Too many texts (maximum {MAX_BATCH_ITEMS})'}), 400
+        if not all(isinstance(text, str) for text in texts):
+            return jsonify({'error': 'All texts must be strings'}), 400
+
+        # Use the AI analyzer to get corrected texts
+        text_analyzer = analyzer_loader.get()
+        if text_analyzer:
+            results = text_analyzer.analyze_and_correct_batch(texts)
+            for result in results:
+                metrics.count_analysis(result['path'])
+            return json_response({'results': [
+                {'convertedText': result['corrected_text'], 'path': result['path']}
+                for result in results
+            ]})
+        else:
+            return jsonify({'error': 'AI text analysis is not available'}), 503
+
+    except Exception as e:
+        logging.error(f"Error in batch text analysis: {str(e)}")
+        return jsonify({'error': 'Internal Server Error', 'message': str(e)}), 500
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """
@@ -84,12 +201,35 @@ def health_check():
     status_info = {
         'status': 'healthy',
         'active_api_calls': api_limiter.active_calls,
-        'ai_analysis_available': ai_analysis_available,
+        'concurrency_limit': api_limiter.concurrency.stats(),
+        'admission_queue': api_limiter.queue.stats(),
+        'ai_analysis_available': analyzer_loader.available,
+        'readiness': analyzer_loader.stats(),
         'time': time.time()
     }
+    text_analyzer = analyzer_loader.analyzer
+    if text_analyzer:
+        status_info['result_cache'] = text_analyzer.result_cache.stats()
+        status_info['coalescing'] = text_analyzer.coalescer.stats()
+        status_info['retry_policy'] = text_analyzer.retry_policy.stats()
+        status_info['model_router'] = text_analyzer.router.stats()
+        status_info['prompts'] = text_analyzer.prompts.stats()
+        status_info['sessions'] = text_analyzer.sessions.stats()
+        if text_analyzer.word_memo is not None:
+            status_info['word_memo'] = text_analyzer.word_memo.stats()
+        if text_analyzer.hedger is not None:
+            status_info['hedging'] = text_analyzer.hedger.stats()
     return jsonify(status_info), 200
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """
+    Per-stage latency histograms and counters in the Prometheus text format
+    """
+    return Response(metrics.render(api_limiter, analyzer_loader.analyzer), content_type=CONTENT_TYPE)
+
+
 @app.after_request
 def after_request(response):
     """
@@ -100,23 +240,54 @@ def after_request(response):
     response.headers.add('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
     return response
 
+def wants_stream():
+    """
+    Check if the client asked for a streamed response (?stream=1 or Accept: text/event-stream)
+    """
+    return request.args.get('stream') == '1' or 'text/event-stream' in request.headers.get('Accept', '')
+
+
+def stream_events(chunks, result_key):
+    """
+    Stream text chunks as Server-Sent Events.
+
+    Each chunk is sent as {"delta": ...}; the last event carries the full text
+    under result_key together with "done": true.
+    """
+    def generate():
+        parts = []
+        for chunk in chunks:
+            parts.append(chunk)
+            yield f"data: {json.dumps({'delta': chunk}, ensure_ascii=False)}\n\n"
+        yield f"data: {json.dumps({result_key: ''.join(parts), 'done': True}, ensure_ascii=False)}\n\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/api/translate', methods=['POST'])
-@api_limiter.limit_api(max_calls_per_minute=30)
+@api_limiter.limit_api(max_calls_per_minute=30, priority=PRIORITY_BACKGROUND,
+                        max_queue_time=BACKGROUND_MAX_QUEUE_SECONDS)
 def api_translate_text():
     """
     API endpoint for translating text between Hebrew and English
     """
     try:
-        data = request.get_json()
+        data = parse_json()
         text = data.get('text', '')
 
         if not text:
             return jsonify({'error': 'No text provided'}), 400
 
         # Use the AI analyzer to translate text
-        if ai_analysis_available and text_analyzer:
+        text_analyzer = analyzer_loader.get()
+        if text_analyzer:
+            if wants_stream():
+                return stream_events(text_analyzer.stream_translation(text), 'translatedText')
             result = text_analyzer.translate_with_vertex(text)
-            return jsonify({'translatedText': result})
+            return json_response({'translatedText': result})
         else:
             return jsonify({'error': 'AI text analysis is not available'}), 503
 
@@ -125,22 +296,26 @@ def api_translate_text():
         return jsonify({'error': 'Internal Server Error', 'message': str(e)}), 500
 
 @app.route('/api/rephrase_to_prompt', methods=['POST'])
-@api_limiter.limit_api(max_calls_per_minute=30)
+@api_limiter.limit_api(max_calls_per_minute=30, priority=PRIORITY_BACKGROUND,
+                        max_queue_time=BACKGROUND_MAX_QUEUE_SECONDS)
 def api_rephrase_to_prompt():
     """
     API endpoint for rephrasing text into a ready-to-use prompt
     """
     try:
-        data = request.get_json()
+        data = parse_json()
         text = data.get('text', '')
 
         if not text:
             return jsonify({'error': 'No text provided'}), 400
 
         # Use AI analyzer for rephrasing
-        if ai_analysis_available and text_analyzer:
+        text_analyzer = analyzer_loader.get()
+        if text_analyzer:
+            if wants_stream():
+                return stream_events(text_analyzer.stream_rephrase(text), 'rephrasedText')
             result = text_analyzer.rephrase_to_prompt(text)
-            return jsonify({'rephrasedText': result})
+            return json_response({'rephrasedText': result})
         else:
             return jsonify({'error': 'AI text analysis is not available'}), 503
 
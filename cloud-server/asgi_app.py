@@ -0,0 +1,331 @@
+"""
+asgi_app.py - Async (ASGI) version of the API server.
+
+Serves the same routes and JSON contracts as app.py, but every LLM call is
+awaited through the model's ainvoke/astream interface, so one process holds
+many in-flight Vertex AI requests instead of one per worker.
+
+Run with:
+    uvicorn asgi_app:app --host 0.0.0.0 --port $PORT
+"""
+
+import os
+import json
+import logging
+import time
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from analyzer_loader import create_analyzer_loader
+from api_limiter import AsyncAPILimiter
+from admission_queue import PRIORITY_BACKGROUND, PRIORITY_BATCH, PRIORITY_INTERACTIVE
+from correction_sessions import parse_session_fields
+from metrics import CONTENT_TYPE, STAGE_PARSE, STAGE_RESPONSE, metrics
+from retry_policy import set_request_deadline
+
+# The analyzer (vertexai/langchain imports, model construction) is built by a
+# background warm-up unless LAZY_STARTUP=false; /health answers right away
+analyzer_loader = create_analyzer_loader()
+
+# Initialize API limiter; the concurrency limit starts at MAX_CONCURRENT_CALLS and
+# adapts to Vertex AI latency when CONCURRENCY_MODE is aimd or gradient
+MAX_CONCURRENT_CALLS = int(os.getenv("MAX_CONCURRENT_CALLS", "40"))
+api_limiter = AsyncAPILimiter(max_concurrent_calls=MAX_CONCURRENT_CALLS)
+analyzer_loader.on_ready(lambda analyzer: analyzer.retry_policy.add_listener(api_limiter.observe_llm_call))
+# Extra chunk workers of long translations take their slots from the limiter
+analyzer_loader.on_ready(lambda analyzer: analyzer.set_chunk_limiter(api_limiter))
+analyzer_loader.start()
+
+# Longest time a request waits for a free slot before a 503, by priority class:
+# keystroke fixes go first and give up early, translation/rephrasing can wait longer
+INTERACTIVE_MAX_QUEUE_SECONDS = float(os.getenv("INTERACTIVE_MAX_QUEUE_SECONDS", "1"))
+BATCH_MAX_QUEUE_SECONDS = float(os.getenv("BATCH_MAX_QUEUE_SECONDS", "3"))
+BACKGROUND_MAX_QUEUE_SECONDS = float(os.getenv("BACKGROUND_MAX_QUEUE_SECONDS", "5"))
+
+# Maximum number of texts accepted by the batch endpoint
+MAX_BATCH_ITEMS = 50
+
+# Time budget of a request, including LLM retries
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "20"))
+
+
+class RequestDeadlineMiddleware:
+    """
+    ASGI middleware starting the deadline that bounds LLM retries for each request
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            set_request_deadline(REQUEST_DEADLINE_SECONDS)
+        await self.app(scope, receive, send)
+
+
+async def read_json(request):
+    """
+    Parse the JSON request body, returning an empty dict when it is missing or invalid
+    """
+    started = time.perf_counter()
+    try:
+        data = await request.json()
+    except ValueError:
+        return {}
+    finally:
+        metrics.observe_stage(STAGE_PARSE, time.perf_counter() - started)
+    return data if isinstance(data, dict) else {}
+
+
+def json_response(body):
+    """
+    Serialize a successful JSON response, recording the time spent in the response stage
+    """
+    started = time.perf_counter()
+    response = JSONResponse(body)
+    metrics.observe_stage(STAGE_RESPONSE, time.perf_counter() - started)
+    return response
+
+
+async def batch_item_count(request):
+    """
+    Rate limiter weight of a batch request: the number of texts it carries
+    """
+    texts = (await read_json(request)).get('texts')
+    return len(texts) if isinstance(texts, list) else 1
+
+
+def wants_stream(request):
+    """
+    Check if the client asked for a streamed response (?stream=1 or Accept: text/event-stream)
+    """
+    return request.query_params.get('stream') == '1' or 'text/event-stream' in request.headers.get('Accept', '')
+
+
+def stream_events(chunks, result_key):
+    """
+    Stream async text chunks as Server-Sent Events, in the same format as app.py
+    """
+    async def generate():
+        parts = []
+        async for chunk in chunks:
+            parts.append(chunk)
+            yield f"data: {json.dumps({'delta': chunk}, ensure_ascii=False)}\n\n"
+        yield f"data: {json.dumps({result_key: ''.join(parts), 'done': True}, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        generate(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+async def analyze_text(request):
+    """
+    Shared body of the / (POST) and /api/convert endpoints
+    """
+    try:
+        data = await read_json(request)
+        text = data.get('text', '')
+
+        if not text:
+            return JSONResponse({'error': 'No text provided'}, status_code=400)
+        session_id, prefix_hash = parse_session_fields(data)
+
+        # Use the AI analyzer to get corrected text
+        text_analyzer = await analyzer_loader.aget()
+        if not text_analyzer:
+            return JSONResponse({'error': 'AI text analysis is not available'}, status_code=503)
+
+        # Incremental analysis when the client sent a session id
+        if session_id:
+            result = await text_analyzer.aanalyze_and_correct_session(text, session_id, prefix_hash)
+        else:
+            result = await text_analyzer.aanalyze_and_correct_text(text)
+        metrics.count_analysis(result['path'])
+
+        body = {'convertedText': result['corrected_text'], 'path': result['path']}
+        if session_id:
+            body['prefixHash'] = result['prefix_hash']
+            body['reusedChars'] = result['reused_chars']
+        return json_response(body)
+
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    except Exception as e:
+        logging.error(f"Error in text analysis: {str(e)}")
+        return JSONResponse({'error': 'Internal Server Error', 'message': str(e)}, status_code=500)
+
+
+async def convert_text(request):
+    """
+    API endpoint to convert text based on the new AI-powered analysis.
+    For POST: Analyzes and corrects the text
+    For GET: Returns a health check
+    """
+    if request.method == 'GET':
+        return JSONResponse({'status': 'healthy', 'message': 'Server is running'})
+    return await analyze_text(request)
+
+
+@api_limiter.limit_api(max_calls_per_minute=30, priority=PRIORITY_INTERACTIVE,
+                        max_queue_time=INTERACTIVE_MAX_QUEUE_SECONDS)
+async def api_convert_text(request):
+    """
+    External API endpoint with rate limiting
+    """
+    return await analyze_text(request)
+
+
+@api_limiter.limit_api(max_calls_per_minute=30, weight=batch_item_count,
+                        priority=PRIORITY_BATCH, max_queue_time=BATCH_MAX_QUEUE_SECONDS)
+async def api_convert_batch(request):
+    """
+    External API endpoint for correcting many texts in one request
+    """
+    try:
+        texts = (await read_json(request)).get('texts')
+
+        if not isinstance(texts, list) or not texts:
+            return JSONResponse({'error': 'No texts provided'}, status_code=400)
+        if len(texts) > MAX_BATCH_ITEMS:
+            return JSONResponse({'error': f'Too many texts (maximum {MAX_BATCH_ITEMS})'}, status_code=400)
+        if not all(isinstance(text, str) for text in texts):
+            return JSONResponse({'error': 'All texts must be strings'}, status_code=400)
+
+        text_analyzer = await analyzer_loader.aget()
+
+        if text_analyzer:
+            results = await text_analyzer.aanalyze_and_correct_batch(texts)
+            for result in results:
+                metrics.count_analysis(result['path'])
+            return json_response({'results': [
+                {'convertedText': result['corrected_text'], 'path': result['path']}
+                for result in results
+            ]})
+        else:
+            return JSONResponse({'error': 'AI text analysis is not available'}, status_code=503)
+
+    except Exception as e:
+        logging.error(f"Error in batch text analysis: {str(e)}")
+        return JSONResponse({'error': 'Internal Server Error', 'message': str(e)}, status_code=500)
+
+
+async def health_check(request):
+    """
+    Health check endpoint with system information
+    """
+    status_info = {
+        'status': 'healthy',
+        'active_api_calls': api_limiter.active_calls,
+        'concurrency_limit': api_limiter.concurrency.stats(),
+        'admission_queue': api_limiter.queue.stats(),
+        'ai_analysis_available': analyzer_loader.available,
+        'readiness': analyzer_loader.stats(),
+        'time': time.time()
+    }
+    text_analyzer = analyzer_loader.analyzer
+    if text_analyzer:
+        status_info['result_cache'] = text_analyzer.result_cache.stats()
+        status_info['coalescing'] = text_analyzer.async_coalescer.stats()
+        status_info['retry_policy'] = text_analyzer.retry_policy.stats()
+        status_info['model_router'] = text_analyzer.router.stats()
+        status_info['prompts'] = text_analyzer.prompts.stats()
+        status_info['sessions'] = text_analyzer.sessions.stats()
+        if text_analyzer.word_memo is not None:
+            status_info['word_memo'] = text_analyzer.word_memo.stats()
+        if text_analyzer.hedger is not None:
+            status_info['hedging'] = text_analyzer.hedger.stats()
+    return JSONResponse(status_info)
+
+
+async def metrics_endpoint(request):
+    """
+    Per-stage latency histograms and counters in the Prometheus text format
+    """
+    return Response(metrics.render(api_limiter, analyzer_loader.analyzer), media_type=CONTENT_TYPE)
+
+
+@api_limiter.limit_api(max_calls_per_minute=30, priority=PRIORITY_BACKGROUND,
+                        max_queue_time=BACKGROUND_MAX_QUEUE_SECONDS)
+async def api_translate_text(request):
+    """
+    API endpoint for translating text between Hebrew and English
+    """
+    try:
+        text = (await read_json(request)).get('text', '')
+
+        if not text:
+            return JSONResponse({'error': 'No text provided'}, status_code=400)
+
+        text_analyzer = await analyzer_loader.aget()
+
+        if text_analyzer:
+            if wants_stream(request):
+                return stream_events(text_analyzer.astream_translation(text), 'translatedText')
+            result = await text_analyzer.atranslate_with_vertex(text)
+            return json_response({'translatedText': result})
+        else:
+            return JSONResponse({'error': 'AI text analysis is not available'}, status_code=503)
+
+    except Exception as e:
+        logging.error(f"Error in text translation: {str(e)}")
+        return JSONResponse({'error': 'Internal Server Error', 'message': str(e)}, status_code=500)
+
+
+@api_limiter.limit_api(max_calls_per_minute=30, priority=PRIORITY_BACKGROUND,
+                        max_queue_time=BACKGROUND_MAX_QUEUE_SECONDS)
+async def api_rephrase_to_prompt(request):
+    """
+    API endpoint for rephrasing text into a ready-to-use prompt
+    """
+    try:
+        text = (await read_json(request)).get('text', '')
+
+        if not text:
+            return JSONResponse({'error': 'No text provided'}, status_code=400)
+
+        text_analyzer = await analyzer_loader.aget()
+
+        if text_analyzer:
+            if wants_stream(request):
+                return stream_events(text_analyzer.astream_rephrase(text), 'rephrasedText')
+            result = await text_analyzer.arephrase_to_prompt(text)
+            return json_response({'rephrasedText': result})
+        else:
+            return JSONResponse({'error': 'AI text analysis is not available'}, status_code=503)
+
+    except Exception as e:
+        logging.error(f"Error in text rephrasing: {str(e)}")
+        return JSONResponse({'error': 'Internal Server Error', 'message': str(e)}, status_code=500)
+
+
+app = Starlette(
+    routes=[
+        Route('/', convert_text, methods=['GET', 'POST']),
+        Route('/api/convert', api_convert_text, methods=['POST']),
+        Route('/api/convert/batch', api_convert_batch, methods=['POST']),
+        Route('/health', health_check, methods=['GET']),
+        Route('/metrics', metrics_endpoint, methods=['GET']),
+        Route('/api/translate', api_translate_text, methods=['POST']),
+        Route('/api/rephrase_to_prompt', api_rephrase_to_prompt, methods=['POST']),
+    ],
+    middleware=[
+        Middleware(RequestDeadlineMiddleware),
+        Middleware(
+            CORSMiddleware,
+            allow_origins=['*'],
+            allow_methods=['GET', 'POST', 'OPTIONS'],
+            allow_headers=['Content-Type', 'Authorization']
+        )
+    ]
+)
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(app, host='0.0.0.0', port=8080)
@@ -0,0 +1,391 @@
+"""
+bulk_correct.py - Offline bulk correction of large text corpora (chat logs,
+form dumps) without going through the HTTP server.
+
+Records are streamed from a JSONL or CSV file in windows of --window
+records, so memory use does not depend on the corpus size. For every window:
+    - keyboard-layout conversion (LanguageDetector) runs in a process pool
+    - the texts go through LangChainTextAnalyzer.analyze_and_correct_batch in
+      slices of BATCH_CHUNK_SIZE, at most --concurrency at a time; the word
+      index fast path and the result cache answer what they can, the rest is
+      packed into batch prompts
+    - results are appended to the output (JSONL, or CSV when it ends in .csv)
+      in input order, and a checkpoint next to the output records how many
+      input records are done and the output size at that point
+The conversion of the next window overlaps the model calls of the current one.
+
+An interrupted run continues with --resume: the output is truncated to the
+checkpointed size and the records already done are skipped. --local-only
+never calls the model: each text gets the word index's preferred candidate,
+or stays unchanged when the index cannot decide.
+
+Usage:
+    python bulk_correct.py INPUT OUTPUT [--format jsonl|csv] [--text-field text]
+        [--id-field id] [--processes N] [--concurrency 4] [--window 1000]
+        [--local-only] [--resume] [--report-interval 10]
+"""
+
+import argparse
+import csv
+import io
+import itertools
+import json
+import logging
+import math
+import os
+import signal
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from language_detector import LanguageDetector
+from model_router import estimate_tokens
+from word_index import load_word_index
+
+logger = logging.getLogger(__name__)
+
+CSV_COLUMNS = ["id", "text", "corrected_text", "path", "confidence", "error"]
+
+# Per-process state of the conversion workers
+_detector: Optional[LanguageDetector] = None
+_word_index = None
+_local_only = False
+_all_runs = False
+
+
+def _load_worker_state(local_only: bool, all_runs: bool) -> None:
+    global _detector, _word_index, _local_only, _all_runs
+    _detector = LanguageDetector()
+    _word_index = load_word_index() if local_only or all_runs else None
+    _local_only, _all_runs = local_only, all_runs
+
+
+def _init_worker(local_only: bool, all_runs: bool) -> None:
+    """
+    Build the detector (and the word index when needed) once per worker process.
+    """
+    # Ctrl+C is handled by the main process, which checkpoints and shuts the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _load_worker_state(local_only, all_runs)
+
+
+def convert_texts(texts: List[Optional[str]]) -> List[Tuple[Optional[str], Optional[str], float]]:
+    """
+    Convert a slice of texts in a worker process.
+
+    Returns:
+        One (converted text, word index choice or None, confidence) per text; the
+        choice is only computed for --local-only runs
+    """
+    converted = []
+    for text in texts:
+        if not text:
+            converted.append((text, None, 0.0))
+            continue
+        # Same conversion as LangChainTextAnalyzer.convert_layout
+        if _all_runs and _word_index is not None:
+            converted_text = _detector.convert_mistyped_runs(text, _word_index.choose_candidate)
+        else:
+            converted_text = _detector.convert_last_language(text)
+        chosen_text, confidence = (None, 0.0)
+        if _local_only and _word_index is not None:
+            chosen_text, confidence = _word_index.choose_candidate(text, converted_text)
+        converted.append((converted_text, chosen_text, confidence))
+    return converted
+
+
+def read_records(path: str, input_format: str, text_field: str,
+                 id_field: Optional[str]) -> Iterator[Tuple[Any, Optional[str], Optional[str]]]:
+    """
+    Stream the records of a JSONL or CSV file.
+
+    Yields:
+        Tuples of (record id, text or None, error or None); the id is the id field,
+        or the record number when there is none
+    """
+    with open(path, encoding="utf-8", newline="") as input_file:
+        if input_format == "csv":
+            rows = csv.DictReader(input_file)
+        else:
+            rows = (line for line in input_file if line.strip())
+
+        for number, row in enumerate(rows, start=1):
+            if input_format != "csv":
+                try:
+                    row = json.loads(row)
+                except ValueError as e:
+                    yield number, None, f"Invalid JSON: {str(e)}"
+                    continue
+                if not isinstance(row, dict):
+                    yield number, None, "Record is not a JSON object"
+                    continue
+
+            record_id = row.get(id_field, number) if id_field else number
+            text = row.get(text_field)
+            if not isinstance(text, str):
+                yield record_id, None, f"Missing or non-string field: {text_field}"
+            else:
+                yield record_id, text, None
+
+
+class ResultWriter:
+    """
+    Appends results to a JSONL or CSV file, tracking the byte offset for checkpoints
+    """
+
+    def __init__(self, path: str, resume_offset: Optional[int] = None):
+        self.csv = path.endswith(".csv")
+        if resume_offset is None:
+            self.file = open(path, "wb")
+        else:
+            self.file = open(path, "r+b")
+            self.file.truncate(resume_offset)
+            self.file.seek(resume_offset)
+        if self.csv and self.file.tell() == 0:
+            self._write_csv_row(CSV_COLUMNS)
+
+    def _write_csv_row(self, row: List[Any]) -> None:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(row)
+        self.file.write(buffer.getvalue().encode("utf-8"))
+
+    def write(self, result: Dict[str, Any]) -> None:
+        if self.csv:
+            self._write_csv_row([result.get(column, "") for column in CSV_COLUMNS])
+        else:
+            self.file.write((json.dumps(result, ensure_ascii=False) + "\n").encode("utf-8"))
+
+    def sync(self) -> int:
+        """
+        Flush the output to disk and return its size.
+        """
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def checkpoint_path(output_path: str) -> str:
+    return output_path + ".checkpoint"
+
+
+def load_checkpoint(output_path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(checkpoint_path(output_path), encoding="utf-8") as checkpoint_file:
+            return json.load(checkpoint_file)
+    except FileNotFoundError:
+        return None
+
+
+def save_checkpoint(output_path: str, checkpoint: Dict[str, Any]) -> None:
+    """
+    Write the checkpoint atomically, so a crash leaves the previous one intact.
+    """
+    path = checkpoint_path(output_path)
+    with open(path + ".tmp", "w", encoding="utf-8") as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+    os.replace(path + ".tmp", path)
+
+
+class ThroughputReport:
+    """
+    Items and estimated tokens per second, and results by path
+    """
+
+    def __init__(self, analyzer=None):
+        self.analyzer = analyzer
+        self.started = time.monotonic()
+        self.last_report = self.started
+        self.items = 0
+        self.tokens = 0
+        self.paths = Counter()
+
+    def add(self, text: Optional[str], result: Dict[str, Any]) -> None:
+        self.items += 1
+        self.tokens += estimate_tokens(text) if text else 0
+        self.paths[result.get("path", "error")] += 1
+
+    def line(self) -> str:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        paths = ", ".join(f"{path}={count}" for path, count in sorted(self.paths.items()))
+        line = (f"{self.items} items in {elapsed:.1f}s: {self.items / elapsed:.1f} items/s, "
+                f"{self.tokens / elapsed:.0f} tokens/s [{paths}]")
+        if self.analyzer is not None:
+            prompt_stats = [stats for versions in self.analyzer.prompts.stats().values()
+                            for stats in versions.values()]
+            calls = sum(stats['calls'] for stats in prompt_stats)
+            model_tokens = sum(stats['input_tokens'] + stats['output_tokens'] for stats in prompt_stats)
+            line += f"; model: {calls} calls, {model_tokens / elapsed:.0f} tokens/s"
+        return line
+
+    def maybe_report(self, interval: float) -> None:
+        if time.monotonic() - self.last_report >= interval:
+            self.last_report = time.monotonic()
+            print(self.line(), file=sys.stderr, flush=True)
+
+
+def windows(records: Iterator, size: int) -> Iterator[List]:
+    while True:
+        window = list(itertools.islice(records, size))
+        if not window:
+            return
+        yield window
+
+
+class BulkCorrector:
+    """
+    Runs the conversion pool and the model dispatcher over windows of records
+    """
+
+    def __init__(self, processes: int, concurrency: int, local_only: bool):
+        self.processes = processes
+        self.local_only = local_only
+        all_runs = os.getenv("CONVERT_ALL_RUNS", "false").lower() == "true"
+        if local_only or all_runs:
+            # Compile the index here once instead of in every worker at the same time
+            word_index = load_word_index()
+            if word_index is None:
+                logger.warning("Word index unavailable; only the last language segment is converted "
+                               "and --local-only leaves every text unchanged")
+            else:
+                word_index.close()
+
+        # processes=0 converts in this process (no pickling, useful for small inputs)
+        if processes > 0:
+            self.pool = ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                                            initargs=(local_only, all_runs))
+        else:
+            self.pool = None
+            _load_worker_state(local_only, all_runs)
+
+        self.analyzer = None
+        self.dispatcher = None
+        if not local_only:
+            # Imported here so --local-only runs without the model libraries
+            from langchain_vertex_analyzer import LangChainTextAnalyzer
+            self.analyzer = LangChainTextAnalyzer()
+            self.dispatcher = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bulk-llm")
+
+    def submit_conversion(self, texts: List[Optional[str]]):
+        """
+        Start converting a window; returns a callable waiting for the converted texts.
+        """
+        if self.pool is None:
+            converted = convert_texts(texts)
+            return lambda: converted
+        size = max(1, math.ceil(len(texts) / self.processes))
+        futures = [self.pool.submit(convert_texts, texts[start:start + size])
+                   for start in range(0, len(texts), size)]
+        return lambda: [item for future in futures for item in future.result()]
+
+    def correct(self, texts: List[Optional[str]], converted) -> List[Dict[str, Any]]:
+        """
+        Correct the texts of a window (None for records that failed to parse).
+        """
+        if self.local_only:
+            return [
+                {"corrected_text": chosen_text or text, "path": "local", "confidence": round(confidence, 3)}
+                for text, (_, chosen_text, confidence) in zip(texts, converted)
+            ]
+
+        positions = [position for position, text in enumerate(texts) if text is not None]
+        slice_size = self.analyzer.batch_chunk_size
+        slices = [positions[start:start + slice_size] for start in range(0, len(positions), slice_size)]
+        futures = [
+            self.dispatcher.submit(self.analyzer.analyze_and_correct_batch,
+                                   [texts[position] for position in batch],
+                                   [converted[position][0] for position in batch])
+            for batch in slices
+        ]
+        results: List[Dict[str, Any]] = [{} for _ in texts]
+        for batch, future in zip(slices, futures):
+            for position, result in zip(batch, future.result()):
+                results[position] = {"corrected_text": result["corrected_text"], "path": result["path"]}
+        return results
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+        if self.dispatcher is not None:
+            self.dispatcher.shutdown(cancel_futures=True)
+
+
+def run(args) -> int:
+    input_format = args.format or ("csv" if args.input.endswith(".csv") else "jsonl")
+    checkpoint = load_checkpoint(args.output) if args.resume else None
+    if args.resume and checkpoint is None:
+        print(f"No checkpoint for {args.output}, starting from the beginning", file=sys.stderr)
+    if checkpoint and checkpoint.get("complete"):
+        print(f"{args.output} is already complete ({checkpoint['records']} records)", file=sys.stderr)
+        return 0
+
+    done = checkpoint["records"] if checkpoint else 0
+    records = itertools.islice(read_records(args.input, input_format, args.text_field, args.id_field), done, None)
+    writer = ResultWriter(args.output, checkpoint["output_bytes"] if checkpoint else None)
+    corrector = BulkCorrector(args.processes, args.concurrency, args.local_only)
+    report = ThroughputReport(corrector.analyzer)
+    if done:
+        print(f"Resuming after {done} records", file=sys.stderr)
+
+    try:
+        window_iter = windows(records, args.window)
+        window = next(window_iter, None)
+        pending = corrector.submit_conversion([text for _, text, _ in window]) if window else None
+        while window is not None:
+            converted = pending()
+            # Convert the next window while the model works on this one
+            next_window = next(window_iter, None)
+            if next_window is not None:
+                pending = corrector.submit_conversion([text for _, text, _ in next_window])
+
+            texts = [text for _, text, _ in window]
+            for (record_id, text, error), result in zip(window, corrector.correct(texts, converted)):
+                output = {"id": record_id, "text": text}
+                output.update(result if error is None else {"error": error})
+                writer.write(output)
+                report.add(text, output)
+
+            done += len(window)
+            save_checkpoint(args.output, {"records": done, "output_bytes": writer.sync(), "input": args.input})
+            report.maybe_report(args.report_interval)
+            window = next_window
+
+        save_checkpoint(args.output, {"records": done, "output_bytes": writer.sync(), "input": args.input,
+                                      "complete": True})
+    except KeyboardInterrupt:
+        print(f"Interrupted after {done} records; continue with --resume", file=sys.stderr)
+        return 130
+    finally:
+        corrector.close()
+        writer.close()
+
+    print(report.line(), file=sys.stderr)
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL or CSV file of records")
+    parser.add_argument("output", help="Result file, JSONL or CSV (by extension)")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="Input format (default: from the extension)")
+    parser.add_argument("--text-field", default="text", help="Field or column holding the text")
+    parser.add_argument("--id-field", help="Field or column identifying a record (default: its number)")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1,
+                        help="Conversion worker processes; 0 converts in the main process")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent model batch calls")
+    parser.add_argument("--window", type=int, default=1000, help="Records read and checkpointed at a time")
+    parser.add_argument("--local-only", action="store_true", help="Never call the model")
+    parser.add_argument("--resume", action="store_true", help="Continue an interrupted run from its checkpoint")
+    parser.add_argument("--report-interval", type=float, default=10, help="Seconds between progress lines")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
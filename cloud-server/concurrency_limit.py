@@ -0,0 +1,133 @@
+"""
+concurrency_limit.py - Adaptive limit on concurrent API calls.
+
+The limit is learned from the round-trip time (RTT) and outcome of every LLM
+attempt, reported by RetryPolicy listeners:
+    - fixed: the configured limit; RTTs are only tracked for /health
+    - aimd: +1 per limit's worth of successful calls while the limit is in use,
+      multiplied by backoff_ratio on errors or when the RTT exceeds latency_threshold
+    - gradient: limit * (tolerance * baseline RTT / short-term RTT) + headroom,
+      a Vegas-style gradient - the limit shrinks as soon as Vertex AI queues
+      requests and grows back while latency stays near its baseline
+The adaptive limits always stay within [floor, ceiling].
+"""
+
+import math
+import os
+import threading
+from typing import Any, Dict, Optional
+
+MODES = ("fixed", "aimd", "gradient")
+
+
+class AdaptiveConcurrencyLimit:
+    """
+    Concurrency limit adjusted from observed LLM latency and errors
+    """
+
+    def __init__(self, initial=40, floor=5, ceiling=200, mode="fixed", backoff_ratio=0.9,
+                 latency_threshold=10.0, tolerance=1.5, smoothing=0.2, short_window=10, long_window=5000):
+        if mode not in MODES:
+            raise ValueError(f"Unknown concurrency limit mode: {mode}")
+        self.mode = mode
+        self.floor = floor
+        self.ceiling = max(floor, ceiling)
+        self.limit = float(initial if mode == "fixed" else min(self.ceiling, max(self.floor, initial)))
+        self.backoff_ratio = backoff_ratio
+        self.latency_threshold = latency_threshold
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        # Short-term RTT is a moving average; the baseline follows its minimum and
+        # drifts up slowly so it recovers if the model becomes slower for good
+        self._short_alpha = 2.0 / (short_window + 1)
+        self._baseline_drift = 1.0 + 1.0 / long_window
+        self.short_rtt: Optional[float] = None
+        self.baseline_rtt: Optional[float] = None
+        self.lock = threading.Lock()
+        # Counters
+        self.samples = 0
+        self.errors = 0
+        self.decreases = 0
+
+    @property
+    def current(self) -> int:
+        """
+        The limit to enforce now.
+        """
+        return int(self.limit)
+
+    def observe(self, rtt: float, success: bool, in_flight: Optional[int] = None) -> None:
+        """
+        Record one LLM attempt and adjust the limit.
+
+        Args:
+            rtt: Duration of the attempt in seconds
+            success: Whether the attempt succeeded
+            in_flight: Calls in progress when it finished; the limit only grows
+                       while at least half of it is in use
+        """
+        with self.lock:
+            self.samples += 1
+            if success:
+                self._update_rtt(rtt)
+            else:
+                self.errors += 1
+
+            if self.mode == "fixed":
+                return
+
+            used = in_flight is None or in_flight * 2 >= self.limit
+            if not success or (self.mode == "aimd" and rtt > self.latency_threshold):
+                self.limit *= self.backoff_ratio
+                self.decreases += 1
+            elif self.mode == "aimd":
+                if used:
+                    self.limit += 1.0 / self.limit
+            else:
+                # Gradient: < 1 once requests queue beyond the tolerated latency
+                gradient = max(0.5, min(1.0, self.tolerance * self.baseline_rtt / max(self.short_rtt, 1e-6)))
+                new_limit = self.limit * gradient + (math.sqrt(self.limit) if used else 0.0)
+                if new_limit < self.limit:
+                    self.decreases += 1
+                self.limit = (1 - self.smoothing) * self.limit + self.smoothing * new_limit
+
+            self.limit = min(self.ceiling, max(self.floor, self.limit))
+
+    def _update_rtt(self, rtt: float) -> None:
+        if self.short_rtt is None:
+            self.short_rtt = self.baseline_rtt = rtt
+            return
+        self.short_rtt += self._short_alpha * (rtt - self.short_rtt)
+        self.baseline_rtt = min(self.short_rtt, self.baseline_rtt * self._baseline_drift)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return the current limit and RTT estimates for the health endpoint.
+        """
+        with self.lock:
+            return {
+                'mode': self.mode,
+                'limit': self.current,
+                'floor': self.floor,
+                'ceiling': self.ceiling,
+                'short_rtt_ms': round(self.short_rtt * 1000, 1) if self.short_rtt is not None else None,
+                'baseline_rtt_ms': round(self.baseline_rtt * 1000, 1) if self.baseline_rtt is not None else None,
+                'samples': self.samples,
+                'errors': self.errors,
+                'decreases': self.decreases
+            }
+
+
+def create_concurrency_limit(initial=40):
+    """
+    Build the concurrency limit from the environment:
+    CONCURRENCY_MODE (fixed, aimd or gradient), CONCURRENCY_FLOOR, CONCURRENCY_CEILING
+    and CONCURRENCY_LATENCY_THRESHOLD (aimd only, seconds).
+    """
+    return AdaptiveConcurrencyLimit(
+        initial=initial,
+        floor=int(os.getenv("CONCURRENCY_FLOOR", "5")),
+        ceiling=int(os.getenv("CONCURRENCY_CEILING", "200")),
+        mode=os.getenv("CONCURRENCY_MODE", "fixed").lower(),
+        latency_threshold=float(os.getenv("CONCURRENCY_LATENCY_THRESHOLD", "10"))
+    )
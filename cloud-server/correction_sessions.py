@@ -0,0 +1,145 @@
+"""
+correction_sessions.py - Per-session state for incremental corrections.
+
+The extension resends the whole field on every conversion, although usually
+only the last words changed since the previous one. In session mode the
+client sends a session id and the hash of the text the server returned last
+time (prefixHash of the previous response). When the new text still starts
+with that corrected text, the prefix is reused as-is and only the tail is
+analyzed, so the prompt stays as small as the newly typed words however long
+the document grows.
+
+Session state is the last corrected text of each session, kept in a
+ResultCache bounded by entry count, total bytes and the time since the
+session's last correction (SESSION_MAX_ENTRIES, SESSION_MAX_BYTES,
+SESSION_TTL_SECONDS).
+"""
+
+import hashlib
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from result_cache import ResultCache
+
+# Longest accepted session id
+MAX_SESSION_ID_LENGTH = 128
+
+
+def prefix_hash(text: str) -> str:
+    """
+    Hash of a corrected text, as sent back by the client to reuse it.
+    """
+    return hashlib.sha256(text.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+def parse_session_fields(data: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Read the optional session fields of a /api/convert request.
+
+    Returns:
+        Tuple of (session id or None, prefix hash or None)
+
+    Raises:
+        ValueError: If a field has the wrong type or the session id is too long
+    """
+    session_id = data.get('session_id')
+    hash_value = data.get('prefix_hash')
+    if session_id is not None and (not isinstance(session_id, str) or len(session_id) > MAX_SESSION_ID_LENGTH):
+        raise ValueError(f"session_id must be a string of at most {MAX_SESSION_ID_LENGTH} characters")
+    if hash_value is not None and not isinstance(hash_value, str):
+        raise ValueError("prefix_hash must be a string")
+    return session_id or None, hash_value or None
+
+
+class CorrectionSessions:
+    """
+    Last corrected text of every active session, and the split of a new
+    request into a reusable prefix and the tail to analyze
+    """
+
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 64 * 1024 * 1024, ttl_seconds: float = 1800):
+        self.store = ResultCache(max_entries=max_entries, max_bytes=max_bytes, ttl_seconds=ttl_seconds)
+        self.lock = threading.Lock()
+        # Counters
+        self.requests = 0
+        self.reused = 0
+        self.reused_chars = 0
+        self.mismatches = 0
+
+    @staticmethod
+    def _key(session_id: str) -> Tuple[str, str, str]:
+        return "session", session_id, ""
+
+    def split(self, session_id: str, hash_value: Optional[str], text: str) -> Tuple[str, str]:
+        """
+        Split text into the part corrected by a previous request of the session and the rest.
+
+        The prefix is reused only when the client's hash matches the session's
+        last corrected text and text still starts with it. If the boundary falls
+        inside a word, the prefix is shortened to the last whitespace before it so
+        the tail starts with a whole word.
+
+        Returns:
+            Tuple of (reusable prefix, tail to analyze); the prefix is empty when
+            nothing can be reused
+        """
+        prefix = self.store.get(self._key(session_id)) if hash_value else None
+        reusable = prefix is not None and text.startswith(prefix) and prefix_hash(prefix) == hash_value
+
+        if reusable and len(text) > len(prefix) and not prefix[-1:].isspace() and not text[len(prefix)].isspace():
+            cut = len(prefix)
+            while cut and not prefix[cut - 1].isspace():
+                cut -= 1
+            prefix = prefix[:cut]
+            reusable = bool(prefix)
+
+        with self.lock:
+            self.requests += 1
+            if reusable:
+                self.reused += 1
+                self.reused_chars += len(prefix)
+            elif prefix is not None:
+                self.mismatches += 1
+
+        if not reusable:
+            return "", text
+        return prefix, text[len(prefix):]
+
+    def remember(self, session_id: str, corrected_text: str) -> str:
+        """
+        Store the corrected text of a session's latest request.
+
+        Returns:
+            Its hash, for the client's next request
+        """
+        self.store.set(self._key(session_id), corrected_text)
+        return prefix_hash(corrected_text)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return session counters for the health endpoint.
+        """
+        store = self.store.stats()
+        with self.lock:
+            return {
+                'sessions': store['entries'],
+                'bytes': store['bytes'],
+                'evictions': store['evictions'],
+                'expirations': store['expirations'],
+                'requests': self.requests,
+                'reused': self.reused,
+                'reused_chars': self.reused_chars,
+                'mismatches': self.mismatches
+            }
+
+
+def create_correction_sessions() -> CorrectionSessions:
+    """
+    Build the session store from environment variables.
+    """
+    return CorrectionSessions(
+        max_entries=int(os.getenv("SESSION_MAX_ENTRIES", "10000")),
+        max_bytes=int(os.getenv("SESSION_MAX_BYTES", str(64 * 1024 * 1024))),
+        ttl_seconds=float(os.getenv("SESSION_TTL_SECONDS", "1800"))
+    )
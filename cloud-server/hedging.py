@@ -0,0 +1,283 @@
+"""
+hedging.py - Hedged model calls to cut tail latency.
+
+A straggling Vertex AI response holds its request for as long as the model
+takes, although the same request sent again would most likely answer in a
+typical time. With hedging enabled (HEDGE_ENABLED=true), a model call that
+has not answered after the recent p90 latency of its operation
+(HEDGE_PERCENTILE) gets a second, identical request; the first successful
+answer wins. The loser is cancelled in async mode and ignored in blocking
+mode, where a model call cannot be interrupted.
+
+The threshold adapts per operation (analyze, batch, translate, rephrase) from
+the latencies of primary calls over a sliding window, and never drops below
+HEDGE_MIN_DELAY_MS; an operation is not hedged until it has HEDGE_MIN_SAMPLES
+latencies. A hedge budget (a token bucket like the retry budget) keeps hedges
+under HEDGE_BUDGET_RATIO of calls, so upstream load grows by at most that
+share even when Vertex AI slows down as a whole. Streaming calls are not
+hedged: their tokens are sent to the client as they arrive.
+
+Blocking calls run on a worker pool sized from the concurrency limit
+(MAX_CONCURRENT_CALLS) plus room for the hedges the budget allows. A call
+never waits in the pool's queue: when every worker is busy (ignored losers
+still hold theirs), it runs on the caller's thread without a hedge.
+"""
+
+import asyncio
+import contextvars
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from retry_policy import RetryBudget
+
+
+class LatencyTracker:
+    """
+    Sliding window of call latencies and the hedging threshold derived from it
+    """
+
+    def __init__(self, percentile: float = 90, window: int = 200, min_samples: int = 20,
+                 min_delay: float = 0.05, refresh_every: int = 10):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.refresh_every = refresh_every
+        self.latencies = deque(maxlen=window)
+        self.lock = threading.Lock()
+        self._since_refresh = 0
+        self._threshold: Optional[float] = None
+
+    def record(self, seconds: float) -> None:
+        with self.lock:
+            self.latencies.append(seconds)
+            self._since_refresh += 1
+            # Re-sorting the window on every call would cost more than the percentile moves
+            if self._since_refresh >= self.refresh_every and len(self.latencies) >= self.min_samples:
+                self._since_refresh = 0
+                latencies = sorted(self.latencies)
+                position = min(len(latencies) - 1, int(len(latencies) * self.percentile / 100))
+                self._threshold = max(self.min_delay, latencies[position])
+
+    def threshold(self) -> Optional[float]:
+        """
+        Seconds to wait before hedging, or None while there are too few samples.
+        """
+        return self._threshold
+
+
+class Hedger:
+    """
+    Runs model calls with a hedged second request after an adaptive delay
+    """
+
+    def __init__(self, percentile: float = 90, min_delay: float = 0.05, window: int = 200,
+                 min_samples: int = 20, budget: Optional[RetryBudget] = None, max_concurrent_calls: int = 40):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.window = window
+        self.min_samples = min_samples
+        self.budget = budget or RetryBudget(ratio=0.05)
+        # One worker per admitted call, plus the hedges the budget can release at once
+        self.max_threads = (max_concurrent_calls + math.ceil(self.budget.capacity)
+                            + math.ceil(max_concurrent_calls * self.budget.ratio))
+        self.lock = threading.Lock()
+        self.trackers: Dict[str, LatencyTracker] = {}
+        # Per operation: calls, hedged, hedge_wins, budget_denied, pool_saturated
+        self.counters: Dict[str, Dict[str, int]] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # Workers running a call, including ignored losers
+        self._busy_threads = 0
+
+    def _tracker(self, operation: str) -> LatencyTracker:
+        with self.lock:
+            tracker = self.trackers.get(operation)
+            if tracker is None:
+                tracker = self.trackers[operation] = LatencyTracker(
+                    self.percentile, self.window, self.min_samples, self.min_delay)
+                self.counters[operation] = {'calls': 0, 'hedged': 0, 'hedge_wins': 0, 'budget_denied': 0,
+                                            'pool_saturated': 0}
+            return tracker
+
+    def _count(self, operation: str, key: str) -> None:
+        with self.lock:
+            self.counters[operation][key] += 1
+
+    def _begin(self, operation: str):
+        """
+        Count a call and return its tracker and hedging delay (None: do not hedge).
+        """
+        tracker = self._tracker(operation)
+        self._count(operation, 'calls')
+        self.budget.deposit()
+        return tracker, tracker.threshold()
+
+    def _may_hedge(self, operation: str) -> bool:
+        if self.budget.try_withdraw():
+            return True
+        self._count(operation, 'budget_denied')
+        return False
+
+    def _try_submit(self, func: Callable[[], Any]):
+        """
+        Run func on a free worker thread.
+
+        Returns:
+            Its future, or None when every worker is busy; the call is never queued
+        """
+        with self.lock:
+            if self._busy_threads >= self.max_threads:
+                return None
+            self._busy_threads += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_threads, thread_name_prefix="hedge")
+
+        def run():
+            try:
+                return func()
+            finally:
+                with self.lock:
+                    self._busy_threads -= 1
+
+        # The request's context (deadline) follows the call into the worker thread
+        return self._executor.submit(contextvars.copy_context().run, run)
+
+    @staticmethod
+    def _timed(tracker: LatencyTracker, func: Callable[[], Any]) -> Callable[[], Any]:
+        """
+        Wrap func to record its latency when it succeeds, timed from when it starts running.
+        """
+        def timed():
+            started = time.monotonic()
+            result = func()
+            tracker.record(time.monotonic() - started)
+            return result
+        return timed
+
+    def call(self, operation: str, func: Callable[[], Any]) -> Any:
+        """
+        Run a blocking model call, hedging it if it is slower than the operation's threshold.
+
+        Args:
+            operation: Operation whose latencies set the threshold
+            func: Zero-argument callable performing the model call
+
+        Returns:
+            The first successful result
+
+        Raises:
+            Exception: The first call's error when every request sent failed
+        """
+        tracker, delay = self._begin(operation)
+        timed = self._timed(tracker, func)
+        if delay is None:
+            return timed()
+
+        # The primary runs in a worker thread so this one can stop waiting for it
+        primary = self._try_submit(timed)
+        if primary is None:
+            self._count(operation, 'pool_saturated')
+            return timed()
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._may_hedge(operation):
+            return primary.result()
+
+        hedge = self._try_submit(func)
+        if hedge is None:
+            self._count(operation, 'pool_saturated')
+            return primary.result()
+        self._count(operation, 'hedged')
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self._count(operation, 'hedge_wins')
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    async def acall(self, operation: str, afunc: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Async version of call; the losing request is cancelled.
+
+        Args:
+            afunc: Zero-argument callable returning a coroutine for the model call
+        """
+        tracker, delay = self._begin(operation)
+        started = time.monotonic()
+        if delay is None:
+            result = await afunc()
+            tracker.record(time.monotonic() - started)
+            return result
+
+        primary = asyncio.ensure_future(afunc())
+        primary.add_done_callback(
+            lambda task: not task.cancelled() and task.exception() is None
+            and tracker.record(time.monotonic() - started))
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done or not self._may_hedge(operation):
+                return await primary
+
+            hedge = asyncio.ensure_future(afunc())
+            tasks.append(hedge)
+            self._count(operation, 'hedged')
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._count(operation, 'hedge_wins')
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            # The loser, or both requests when the caller gave up (deadline)
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return per-operation hedging counters and thresholds for the health endpoint.
+        """
+        with self.lock:
+            counters = {operation: dict(values) for operation, values in self.counters.items()}
+            trackers = dict(self.trackers)
+        operations = {}
+        for operation, values in counters.items():
+            threshold = trackers[operation].threshold()
+            operations[operation] = dict(
+                values,
+                hedge_rate=round(values['hedged'] / values['calls'], 4) if values['calls'] else 0.0,
+                win_rate=round(values['hedge_wins'] / values['hedged'], 4) if values['hedged'] else 0.0,
+                threshold_ms=round(threshold * 1000, 1) if threshold is not None else None
+            )
+        return {'budget_tokens': round(self.budget.tokens, 2), 'operations': operations}
+
+
+def create_hedger() -> Optional[Hedger]:
+    """
+    Build the hedger from environment variables, or None unless HEDGE_ENABLED=true.
+    """
+    if os.getenv("HEDGE_ENABLED", "false").lower() != "true":
+        return None
+    return Hedger(
+        percentile=float(os.getenv("HEDGE_PERCENTILE", "90")),
+        min_delay=float(os.getenv("HEDGE_MIN_DELAY_MS", "50")) / 1000,
+        window=int(os.getenv("HEDGE_WINDOW", "200")),
+        min_samples=int(os.getenv("HEDGE_MIN_SAMPLES", "20")),
+        budget=RetryBudget(ratio=float(os.getenv("HEDGE_BUDGET_RATIO", "0.05")),
+                           capacity=float(os.getenv("HEDGE_BUDGET_CAPACITY", "10"))),
+        max_concurrent_calls=int(os.getenv("MAX_CONCURRENT_CALLS", "40"))
+    )
@@ -3,24 +3,66 @@ langchain_vertex_analyzer.py - Module for analyzing text using LangChain with Ve
 """
 
 import os
+import re
+import asyncio
+import contextvars
 import logging
 import time
-from typing import Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, Any, AsyncIterator, Iterator, List, Optional, Tuple
 from dotenv import load_dotenv
 load_dotenv()
 
-# Google Cloud imports
-import vertexai
-from langchain_google_vertexai import VertexAI
-from langchain.prompts import PromptTemplate
-
 # Import the existing detector
+from correction_sessions import create_correction_sessions
 from language_detector import LanguageDetector
+from llm_backends import create_llm
+from metrics import FALLBACKS, STAGE_CONVERT, STAGE_PROMPT, metrics
+from model_router import ANALYZE, BATCH, REPHRASE, TRANSLATE, create_model_router
+from prompt_registry import create_prompt_registry
+from word_index import load_word_index
+from word_memo import create_word_memo
+from result_cache import create_result_cache, make_cache_key
+from request_coalescer import AsyncRequestCoalescer, RequestCoalescer
+from hedging import create_hedger
+from retry_policy import CircuitBreaker, CircuitOpenError, LLMCallError, RetryBudget, RetryPolicy
+from text_chunker import split_into_chunks
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# One line of a batch analysis answer: "[3] CORRECTED: text"
+_BATCH_ANSWER_PATTERN = re.compile(r"^\s*\[(\d+)\]\s*CORRECTED:(.*)$", re.MULTILINE)
+
+
+class _StreamCleaner:
+    """
+    Strips surrounding whitespace from a streamed response on the fly:
+    leading whitespace is dropped and trailing whitespace is held back
+    until more text follows it
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._pending_whitespace = ""
+
+    def feed(self, chunk: str) -> str:
+        """
+        Add a raw chunk and return the cleaned piece that can be emitted now.
+        """
+        if not self.text:
+            chunk = chunk.lstrip()
+        stripped = chunk.rstrip()
+        piece = ""
+        if stripped:
+            piece = self._pending_whitespace + stripped
+            self._pending_whitespace = ""
+            self.text += piece
+        self._pending_whitespace += chunk[len(stripped):]
+        return piece
+
 class LangChainTextAnalyzer:
     """
     A class that uses LangChain with Vertex AI to analyze text
@@ -31,87 +73,62 @@ class LangChainTextAnalyzer:
         Initialize the analyzer with LangChain and Vertex AI.
         """
         try:
-            # Set project configuration from environment variables with fallbacks
-            project_id = os.getenv("PROJECT_ID", "project-id-placeholder")
-            location = os.getenv("REGION", "us-central1")
             model_name = os.getenv("MODEL_NAME", "gemini-2.0-flash")
+            self.model_name = model_name
 
-            # Detect if running in GCP environment
-            is_gcp_environment = os.getenv("GAE_ENV", "").startswith("standard") or \
-                               os.getenv("K_SERVICE", "") or \
-                               os.getenv("FUNCTION_NAME", "")
-
-            logger.info(f"Environment detection: Running in {'GCP' if is_gcp_environment else 'local'} environment")
-
-            # Credentials handling based on environment
-            if is_gcp_environment:
-                # In GCP, the service will use the attached service account automatically
-                logger.info("Using default GCP credentials")
-            else:
-                # Local development - use explicit credentials file
-                credentials_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
-                if credentials_path and os.path.exists(credentials_path):
-                    logger.info("Using credentials from environment variable")
-                else:
-                    logger.warning("No credentials found - service may fail")
-
-            # Initialize Vertex AI with proper error handling
-            try:
-                vertexai.init(project=project_id, location=location)
-                logger.info(f"Initialized Vertex AI with project ID and location: {location}")
-            except Exception as vertex_init_error:
-                logger.error(f"Failed to initialize Vertex AI: {str(vertex_init_error)}")
-                raise
-
-            # Initialize LangChain's Vertex AI model with retries
-            max_retries = 3
-            retry_count = 0
-            while retry_count < max_retries:
-                try:
-                    self.llm = VertexAI(model_name=model_name)
-                    logger.info(f"Created LangChain VertexAI model: {model_name}")
-                    break
-                except Exception as model_init_error:
-                    retry_count += 1
-                    if retry_count >= max_retries:
-                        logger.error(f"Failed to initialize Vertex AI model after {max_retries} attempts: {str(model_init_error)}")
-                        raise
-                    logger.warning(f"Retry {retry_count}/{max_retries} initializing model: {str(model_init_error)}")
-                    time.sleep(1)  # Short delay before retry
+            # Pool of models (Vertex AI, or the local fake when LLM_BACKEND=fake) and the routes
+            # choosing one of them and its output limits per request; MODEL_NAME is the default
+            self.router = create_model_router(model_name, create_llm)
+            self.llm = self.router.default_llm
 
             # Initialize the language detector for keyboard layout conversion
             self.detector = LanguageDetector()
 
-            # Create analysis prompt template
-            self.analysis_prompt_template = PromptTemplate(
-                input_variables=["original_text", "converted_text"],
-                template="""
-                You are a strict language assistant.  
-                You receive two versions of a sentence:
-                
-                Sentence 1: {original_text}  
-                Sentence 2: {converted_text}
-                
-                Important notes:
-                - One of them was typed in the wrong keyboard layout and was already converted.
-                - You do NOT need to detect or fix keyboard layout issues – they are already handled.
-                
-                Your task:
-                1. Choose the sentence that is more correct and meaningful in **its own original language** (Hebrew or English).
-                2. Correct only **spelling and grammar** mistakes in that sentence, without changing the language.
-                3. Do **not** translate between Hebrew and English.
-                4. Do **not** change the sentence structure or improve the writing.
-                5. Do **not** guess or invent meaning.
-                6. Do **not** add, remove, merge, or split any words.
-                7. For any word that is clearly incorrect or in the wrong language/layout in the chosen sentence, and cannot be corrected directly – copy the word from the same position in the other sentence and use it as-is. Replace only that word, without changing sentence structure or meaning.
-
-                Return your response in the following format:
-                CORRECTED: [the corrected version of the preferred sentence, without spelling mistakes]
-                """
+            # Local fast path: score layout candidates with the word index and skip the LLM when confident
+            self.fast_path_confidence = float(os.getenv("FAST_PATH_CONFIDENCE", "0.9"))
+            self.word_index = load_word_index() if os.getenv("LOCAL_FAST_PATH", "true").lower() == "true" else None
+            # Also convert earlier runs typed in the wrong layout, as judged by the word index
+            self.convert_all_runs = os.getenv("CONVERT_ALL_RUNS", "false").lower() == "true"
+
+            # Cache for successful LLM results (fallback results are never stored)
+            self.result_cache = create_result_cache()
+            # Per-word corrections learned from LLM results, served or only compared per WORD_MEMO_MODE
+            self.word_memo = create_word_memo()
+
+            # Concurrent identical LLM calls share a single upstream request
+            self.coalescer = RequestCoalescer()
+            self.async_coalescer = AsyncRequestCoalescer()
+
+            # Last corrected text per client session, so a resent document only has its new tail analyzed
+            self.sessions = create_correction_sessions()
+
+            # Retry policy shared by every LLM call: deadlines, retry budget, jittered backoff, circuit breaker
+            self.retry_policy = RetryPolicy(
+                max_attempts=int(os.getenv("RETRY_MAX_ATTEMPTS", "3")),
+                default_deadline=float(os.getenv("REQUEST_DEADLINE_SECONDS", "20")),
+                budget=RetryBudget(ratio=float(os.getenv("RETRY_BUDGET_RATIO", "0.1"))),
+                breaker=CircuitBreaker(
+                    failure_threshold=int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5")),
+                    reset_timeout=float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+                )
             )
+            # Every model attempt feeds the per-stage latency histograms of /metrics
+            self.retry_policy.add_listener(metrics.observe_llm_attempt)
+            # Optional hedging: a second identical request when an attempt is slower than its recent p90
+            self.hedger = create_hedger()
+
+            # Compiled prompts, with versions A/B-tested per PROMPT_VARIANTS and token accounting
+            self.prompts = create_prompt_registry()
 
-            # Create the LangChain using pipe operator
-            self.chain = self.analysis_prompt_template | self.llm
+            # Batch analysis: many sentence pairs packed into one prompt, one CORRECTED line per item
+            self.batch_chunk_size = int(os.getenv("BATCH_CHUNK_SIZE", "20"))
+
+            # Chunked translation: texts longer than TRANSLATE_CHUNK_CHARS (0 disables) are split on
+            # paragraph and sentence boundaries and the chunks translated concurrently
+            self.translate_chunk_chars = int(os.getenv("TRANSLATE_CHUNK_CHARS", "1500"))
+            self.translate_chunk_workers = max(1, int(os.getenv("TRANSLATE_CHUNK_WORKERS", "4")))
+            # API limiter the extra chunk workers take their concurrency slots from (set by the server)
+            self.chunk_limiter = None
 
             logger.info("LangChainTextAnalyzer successfully initialized")
         except Exception as e:
@@ -126,148 +143,545 @@ class LangChainTextAnalyzer:
             logger.warning("Empty text provided for analysis")
             return {
                 "corrected_text": text,
-                "reasoning": "Empty text provided"
+                "reasoning": "Empty text provided",
+                "path": "local"
             }
 
         try:
-            # Step 1: Convert the text using the existing detector
-            converted_text = self.detector.convert_last_language(text)
-            logger.debug("Text processing completed successfully")
+            # Step 1: Convert the text and answer locally when possible
+            converted_text, cache_key, local_result, model = self._prepare_analysis(text)
+            if local_result is not None:
+                return local_result
 
             # Step 2: Use LangChain with retry logic for API calls
-            max_retries = 3
-            retry_count = 0
-            response_text = None
+            prompt = self._prompt(self.prompts.render, ANALYZE, text,
+                                  original_text=text, converted_text=converted_text)
+            response_text = self.coalescer.run(cache_key, lambda: self._call_llm(
+                lambda: model.invoke(prompt),
+                "texts for analysis",
+                prompt
+            ))
+            return self._finish_analysis(text, converted_text, response_text, cache_key)
+
+        except CircuitOpenError:
+            return self._circuit_open_analysis(text, converted_text)
+        except LLMCallError as api_error:
+            # Fallback to original text after all retries fail
+            return {
+                "corrected_text": text,
+                "reasoning": f"API error after {api_error.attempts} attempts: {str(api_error.last_error)}",
+                "path": "fallback"
+            }
+        except Exception as e:
+            logger.error(f"Error in text analysis: {str(e)}")
+            # Fallback to original text in case of error
+            return {
+                "corrected_text": text,
+                "reasoning": f"Error during analysis: {str(e)}",
+                "path": "fallback"
+            }
 
-            while retry_count < max_retries:
-                try:
-                    logger.info(f"Attempt {retry_count+1}/{max_retries}: Sending texts to Vertex AI for analysis")
+    async def aanalyze_and_correct_text(self, text: str) -> Dict[str, Any]:
+        """
+        Async version of analyze_and_correct_text using the model's non-blocking ainvoke.
+        """
+        if not text:
+            logger.warning("Empty text provided for analysis")
+            return {
+                "corrected_text": text,
+                "reasoning": "Empty text provided",
+                "path": "local"
+            }
 
-                    # Add timeout handling for GCP environment
-                    response = self.chain.invoke(input={
-                        "original_text": text,
-                        "converted_text": converted_text
-                    })
+        try:
+            converted_text, cache_key, local_result, model = self._prepare_analysis(text)
+            if local_result is not None:
+                return local_result
+
+            prompt = self._prompt(self.prompts.render, ANALYZE, text,
+                                  original_text=text, converted_text=converted_text)
+            response_text = await self.async_coalescer.run(cache_key, lambda: self._acall_llm(
+                lambda: model.ainvoke(prompt),
+                "texts for analysis",
+                prompt
+            ))
+            return self._finish_analysis(text, converted_text, response_text, cache_key)
+
+        except CircuitOpenError:
+            return self._circuit_open_analysis(text, converted_text)
+        except LLMCallError as api_error:
+            return {
+                "corrected_text": text,
+                "reasoning": f"API error after {api_error.attempts} attempts: {str(api_error.last_error)}",
+                "path": "fallback"
+            }
+        except Exception as e:
+            logger.error(f"Error in text analysis: {str(e)}")
+            return {
+                "corrected_text": text,
+                "reasoning": f"Error during analysis: {str(e)}",
+                "path": "fallback"
+            }
 
-                    response_text = response
-                    logger.debug(f"Raw response from Vertex AI: {response_text}")
-                    break  # Success - exit retry loop
+    def analyze_and_correct_session(self, text: str, session_id: str, prefix_hash: Optional[str]) -> Dict[str, Any]:
+        """
+        Incremental analysis: reuse the session's previous correction for the unchanged
+        prefix of text and analyze only the tail typed after it.
 
-                except Exception as api_error:
-                    retry_count += 1
-                    logger.warning(f"API call failed (attempt {retry_count}/{max_retries}): {str(api_error)}")
-
-                    if retry_count >= max_retries:
-                        logger.error(f"All retries failed for Vertex AI analysis")
-                        # Fallback to original text after all retries fail
-                        return {
-                            "corrected_text": text,
-                            "reasoning": f"API error after {max_retries} attempts: {str(api_error)}"
-                        }
-
-                    # Exponential backoff before retry
-                    time.sleep(2 ** retry_count)  # 2, 4, 8 seconds
-
-            # Process the response if we got one
-            if response_text and "CORRECTED:" in response_text:
-                corrected_start = response_text.find("CORRECTED:") + len("CORRECTED:")
-                corrected_text = response_text[corrected_start:].strip()
-            else:
-                # Fallback to original text if no correction found
-                corrected_text = text
+        Args:
+            text: Full field content
+            session_id: Client session id
+            prefix_hash: Hash of the session's previous corrected text, from its last response
+
+        Returns:
+            Result dictionary with the full corrected text, plus "prefix_hash" for the
+            client's next request and "reused_chars"
+        """
+        prefix, tail = self.sessions.split(session_id, prefix_hash, text)
+        if not prefix:
+            return self._finish_session(session_id, "", tail, self.analyze_and_correct_text(text))
+
+        core = tail.strip()
+        if not core:
+            return self._finish_session(session_id, prefix, tail, {"corrected_text": text, "path": "session"})
+        return self._finish_session(session_id, prefix, tail, self.analyze_and_correct_text(core))
+
+    async def aanalyze_and_correct_session(self, text: str, session_id: str,
+                                           prefix_hash: Optional[str]) -> Dict[str, Any]:
+        """
+        Async version of analyze_and_correct_session.
+        """
+        prefix, tail = self.sessions.split(session_id, prefix_hash, text)
+        if not prefix:
+            return self._finish_session(session_id, "", tail, await self.aanalyze_and_correct_text(text))
+
+        core = tail.strip()
+        if not core:
+            return self._finish_session(session_id, prefix, tail, {"corrected_text": text, "path": "session"})
+        return self._finish_session(session_id, prefix, tail, await self.aanalyze_and_correct_text(core))
+
+    def _finish_session(self, session_id: str, prefix: str, tail: str, result: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Join the reused prefix and the corrected tail, keeping the whitespace around the
+        tail, and remember the result unless it is a fallback.
+        """
+        corrected_text = result["corrected_text"]
+        if prefix and result["path"] != "session":
+            core_start = len(tail) - len(tail.lstrip())
+            core_end = len(tail.rstrip())
+            corrected_text = prefix + tail[:core_start] + corrected_text + tail[core_end:]
+
+        if result["path"] == "fallback":
+            # Not corrected: keep the previous correction as the session's reusable prefix
+            hash_value = self.sessions.remember(session_id, prefix) if prefix else None
+        else:
+            hash_value = self.sessions.remember(session_id, corrected_text)
+        return dict(result, corrected_text=corrected_text, prefix_hash=hash_value, reused_chars=len(prefix))
+
+    def convert_layout(self, text: str) -> str:
+        """
+        Convert the mis-typed part of text to the other keyboard layout.
+
+        By default only the last language segment is converted, scanning back from
+        the end of the text. With CONVERT_ALL_RUNS (and the word index loaded) every
+        earlier segment the word index reads better converted is converted too.
+        """
+        if self.convert_all_runs and self.word_index is not None:
+            return self.detector.convert_mistyped_runs(text, self.word_index.choose_candidate)
+        return self.detector.convert_last_language(text)
+
+    def _prepare_analysis(self, text: str, converted_text: Optional[str] = None):
+        """
+        Convert the text (unless the caller already did) and try to answer without the LLM.
+
+        Returns:
+            Tuple of (converted text, cache key, local result or None when the LLM is needed,
+            routed model)
+        """
+        if converted_text is None:
+            started = time.perf_counter()
+            converted_text = self.convert_layout(text)
+            metrics.observe_stage(STAGE_CONVERT, time.perf_counter() - started)
+            logger.debug("Text processing completed successfully")
+
+        model = self.router.select(ANALYZE, text)
+        cache_key = self._cache_key(ANALYZE, model, text)
+        return converted_text, cache_key, self._local_analysis_result(text, converted_text, cache_key), model
 
+    def _finish_analysis(self, text: str, converted_text: str, response_text: str, cache_key) -> Dict[str, Any]:
+        """
+        Extract the CORRECTED: answer from the model response, cache it and learn its words.
+        """
+        logger.debug(f"Raw response from Vertex AI: {response_text}")
+
+        if response_text and "CORRECTED:" in response_text:
+            corrected_start = response_text.find("CORRECTED:") + len("CORRECTED:")
+            corrected_text = response_text[corrected_start:].strip()
+            self.result_cache.set(cache_key, corrected_text)
+            self._learn_words(text, converted_text, corrected_text)
             return {
                 "corrected_text": corrected_text,
+                "path": "llm"
             }
 
-        except Exception as e:
-            logger.error(f"Error in text analysis: {str(e)}")
-            # Fallback to original text in case of error
+        # Fallback to original text if no correction found
+        return {
+            "corrected_text": text,
+            "path": "fallback"
+        }
+
+    def _learn_words(self, text: str, converted_text: str, corrected_text: str) -> None:
+        """
+        Feed an LLM correction to the word memo; in shadow mode, first compare it
+        with the answer the memo would have given.
+        """
+        if self.word_memo is None:
+            return
+        if not self.word_memo.serving:
+            memo_text = self.word_memo.lookup(text, converted_text)
+            if memo_text is not None:
+                self.word_memo.compare(memo_text, corrected_text)
+        self.word_memo.learn(text, converted_text, corrected_text)
+
+    def _circuit_open_analysis(self, text: str, converted_text: str) -> Dict[str, Any]:
+        """
+        Local fallback while the circuit breaker is open: the word index's preferred
+        candidate at any confidence, otherwise the original text.
+        """
+        corrected_text = text
+        if self.word_index is not None:
+            chosen_text, _ = self.word_index.choose_candidate(text, converted_text)
+            corrected_text = chosen_text or text
+        return {
+            "corrected_text": corrected_text,
+            "reasoning": "Vertex AI is failing - circuit breaker open",
+            "path": "fallback"
+        }
+
+    def _local_analysis_result(self, text: str, converted_text: str, cache_key) -> Optional[Dict[str, Any]]:
+        """
+        Answer an analysis request without the LLM, from the word index fast path, the result
+        cache or (WORD_MEMO_MODE=on) the word memo.
+
+        Returns:
+            Result dictionary, or None when the LLM is needed
+        """
+        if self.word_index is not None:
+            chosen_text, confidence = self.word_index.choose_candidate(text, converted_text)
+            if chosen_text is not None and confidence >= self.fast_path_confidence:
+                logger.info(f"Local fast path used (confidence {confidence:.2f})")
+                return {
+                    "corrected_text": chosen_text,
+                    "path": "local"
+                }
+
+        cached_text = self.result_cache.get(cache_key)
+        if cached_text is not None:
             return {
-                "corrected_text": text,
-                "reasoning": f"Error during analysis: {str(e)}"
+                "corrected_text": cached_text,
+                "path": "cache"
             }
 
-    def translate_with_vertex(self, text: str) -> str:
+        if self.word_memo is not None and self.word_memo.serving:
+            memo_text = self.word_memo.lookup(text, converted_text)
+            if memo_text is not None:
+                return {
+                    "corrected_text": memo_text,
+                    "path": "memo"
+                }
+
+        return None
+
+    def analyze_and_correct_batch(self, texts: List[str],
+                                  converted_texts: Optional[List[str]] = None) -> List[Dict[str, Any]]:
         """
-        Translate text between Hebrew and English using Vertex AI with improved error handling for GCP.
+        Analyze and correct many texts, packing the ones that need the LLM into
+        chunked batch prompts instead of one call per text.
+
+        Args:
+            texts: Texts to correct
+            converted_texts: convert_layout of every text when the caller already
+                             computed it (e.g. in worker processes)
+
+        Returns:
+            One result dictionary per input text, in the same order
         """
-        if not text:
-            logger.warning("Empty text provided for translation")
-            return text
+        results, single, chunks = self._prepare_batch(texts, converted_texts)
 
-        try:
-            # Detect text language using existing detector
-            hebrew_chars = 0
-            english_chars = 0
-
-            for char in text:
-                lang = self.detector.detect_character_language(char)
-                if lang == "hebrew":
-                    hebrew_chars += 1
-                elif lang == "english":
-                    english_chars += 1
-
-            # Determine translation direction based on analysis
-            if hebrew_chars > english_chars:
-                target_language = "English"
-                source_language = "Hebrew"
+        for position in single:
+            results[position] = self.analyze_and_correct_text(texts[position])
+
+        for chunk in chunks:
+            items = self._batch_items(chunk)
+            model = self.router.select(BATCH, items)
+            prompt = self._prompt(self.prompts.render, BATCH, items, items=items)
+            try:
+                response_text = self._call_llm(
+                    lambda: model.invoke(prompt),
+                    f"{len(chunk)} texts for batch analysis",
+                    prompt
+                )
+            except LLMCallError:
+                response_text = ""
+
+            for position in self._finish_batch_chunk(chunk, response_text, results):
+                results[position] = self.analyze_and_correct_text(texts[position])
+
+        return results
+
+    async def aanalyze_and_correct_batch(self, texts: List[str]) -> List[Dict[str, Any]]:
+        """
+        Async version of analyze_and_correct_batch; chunks and fallbacks run concurrently.
+        """
+        results, single, chunks = self._prepare_batch(texts)
+
+        async def run_chunk(chunk):
+            items = self._batch_items(chunk)
+            model = self.router.select(BATCH, items)
+            prompt = self._prompt(self.prompts.render, BATCH, items, items=items)
+            try:
+                response_text = await self._acall_llm(
+                    lambda: model.ainvoke(prompt),
+                    f"{len(chunk)} texts for batch analysis",
+                    prompt
+                )
+            except LLMCallError:
+                response_text = ""
+            return self._finish_batch_chunk(chunk, response_text, results)
+
+        fallback_positions = list(single)
+        for positions in await asyncio.gather(*(run_chunk(chunk) for chunk in chunks)):
+            fallback_positions.extend(positions)
+
+        fallback_results = await asyncio.gather(
+            *(self.aanalyze_and_correct_text(texts[position]) for position in fallback_positions)
+        )
+        for position, result in zip(fallback_positions, fallback_results):
+            results[position] = result
+
+        return results
+
+    def _prepare_batch(self, texts: List[str], converted_texts: Optional[List[str]] = None):
+        """
+        Answer what can be answered locally and split the rest into chunks.
+
+        Returns:
+            Tuple of (results list with local answers filled in, positions that need
+            single analysis, chunks of (position, text, converted_text, cache_key))
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(texts)
+        single = []
+        pending = []
+
+        for position, text in enumerate(texts):
+            # Multi-line texts would break the one-line-per-item answer format
+            if not text or "\n" in text:
+                single.append(position)
+                continue
+
+            converted_text, cache_key, local_result, _ = self._prepare_analysis(
+                text, converted_texts[position] if converted_texts is not None else None)
+            if local_result is not None:
+                results[position] = local_result
             else:
-                target_language = "Hebrew"
-                source_language = "English"
+                pending.append((position, text, converted_text, cache_key))
 
-            translation_prompt = f"""
-            ROLE: You are a strict, rule-based translation engine.
+        chunks = [pending[start:start + self.batch_chunk_size]
+                  for start in range(0, len(pending), self.batch_chunk_size)]
+        return results, single, chunks
 
-            TASK: Correct spelling, grammar and punctuation errors in the input text, then translate the corrected text from {source_language} to {target_language}.
+    @staticmethod
+    def _batch_items(chunk) -> str:
+        """
+        Format a chunk of pending items as the numbered ITEMS section of the batch prompt.
+        """
+        return "\n".join(
+            f"[{number}]\nSentence 1: {text}\nSentence 2: {converted_text}"
+            for number, (_, text, converted_text, _) in enumerate(chunk, start=1)
+        )
 
-            RESTRICTIONS:
-            1. DO NOT add comments, explanations or metadata.
-            2. DO NOT repeat the input text in its original language.
-            3. DO NOT identify the language.
-            4. DO NOT include labels, titles or surrounding text.
-            5. DO NOT expand, omit or alter content beyond minimal corrections.
-            6. Preserve meaning, tone and all original formatting (bold, italics, lists, inline code).
-            7. Output plain text only – no markdown, quotes or code fences.
+    def _finish_batch_chunk(self, chunk, response_text: str, results) -> List[int]:
+        """
+        Parse one '[n] CORRECTED:' line per item into results, cache them and learn their words.
 
-            OUTPUT: The corrected and translated text only.
+        Returns:
+            Positions of items missing from the answer, to be analyzed one by one
+        """
+        corrections = {}
+        for match in _BATCH_ANSWER_PATTERN.finditer(response_text or ""):
+            corrections[int(match.group(1))] = match.group(2).strip()
+
+        missing = []
+        for number, (position, text, converted_text, cache_key) in enumerate(chunk, start=1):
+            corrected_text = corrections.get(number)
+            if corrected_text:
+                self.result_cache.set(cache_key, corrected_text)
+                self._learn_words(text, converted_text, corrected_text)
+                results[position] = {
+                    "corrected_text": corrected_text,
+                    "path": "llm"
+                }
+            else:
+                logger.warning(f"Batch item {number} not answered, falling back to single analysis")
+                missing.append(position)
+        return missing
 
-            INPUT TEXT:
-            {text}
-            """
+    def _build_translation_prompt(self, text: str, direction: Optional[Tuple[str, str]] = None) -> str:
+        """
+        Build the translation prompt, choosing the direction from the dominant script
+        unless a (source, target) direction is given.
+        """
+        source_language, target_language = direction or self._translation_direction(text)
+        return self.prompts.render(TRANSLATE, text, source_language=source_language,
+                                   target_language=target_language, text=text)
 
-            # Add retry logic for GCP environment
-            max_retries = 3
-            retry_count = 0
-            translated_text = None
+    def _translation_direction(self, text: str) -> Tuple[str, str]:
+        """
+        Return the (source, target) languages of a translation from the dominant script.
+        """
+        if self.detector.dominant_language(text) == "hebrew":
+            return "Hebrew", "English"
+        return "English", "Hebrew"
 
-            while retry_count < max_retries:
-                try:
-                    logger.info(f"Attempt {retry_count+1}/{max_retries}: Sending text to Vertex AI for translation")
-                    response = self.llm.invoke(translation_prompt)
+    def _build_rephrase_prompt(self, text: str) -> str:
+        """
+        Build the prompt asking the model to rephrase text into a ready-to-use prompt.
+        """
+        return self.prompts.render(REPHRASE, text, text=text)
 
-                    # Clean up the response
-                    translated_text = response.strip()
-                    break  # Success - exit retry loop
+    def translate_with_vertex(self, text: str) -> str:
+        """
+        Translate text between Hebrew and English using Vertex AI with improved error handling for GCP.
+        """
+        if self._chunked_translation(text):
+            return "".join(self._translate_chunks(text))
+        return self._generate("translate", text, self._build_translation_prompt, "text for translation")
 
-                except Exception as api_error:
-                    retry_count += 1
-                    logger.warning(f"Translation API call failed (attempt {retry_count}/{max_retries}): {str(api_error)}")
+    async def atranslate_with_vertex(self, text: str) -> str:
+        """
+        Async version of translate_with_vertex.
+        """
+        if self._chunked_translation(text):
+            return "".join([piece async for piece in self._atranslate_chunks(text)])
+        return await self._agenerate("translate", text, self._build_translation_prompt, "text for translation")
+
+    def set_chunk_limiter(self, limiter) -> None:
+        """
+        Make the extra workers of chunked translations take concurrency slots from an
+        APILimiter, on top of the slot of the request they serve.
+        """
+        self.chunk_limiter = limiter
 
-                    if retry_count >= max_retries:
-                        logger.error(f"All retries failed for translation")
-                        # Return original text if all retries fail
-                        return text
+    def _chunked_translation(self, text: str) -> bool:
+        return 0 < self.translate_chunk_chars < len(text)
 
-                    # Exponential backoff
-                    time.sleep(2 ** retry_count)
+    def _prepare_chunks(self, text: str):
+        """
+        Split a text for chunked translation.
 
-            return translated_text if translated_text else text
+        Every chunk is translated in the direction of the whole text; its cache key
+        includes that direction since a chunk alone could have another dominant script.
 
-        except Exception as e:
-            logger.error(f"Error in text translation: {str(e)}")
-            # Return the original text in case of error
-            return text
+        Returns:
+            Tuple of (chunks, separators without the surrounding whitespace of the text,
+            prompt builder, cache operation)
+        """
+        direction = self._translation_direction(text)
+        chunks, separators = split_into_chunks(text, self.translate_chunk_chars)
+        # Like single-shot results, the translation is stripped
+        separators[0] = separators[-1] = ""
+        build_prompt = partial(self._build_translation_prompt, direction=direction)
+        return chunks, separators, build_prompt, f"translate:{direction[0]}"
+
+    def _acquire_chunk_slots(self, count: int) -> List[Any]:
+        """
+        Take up to count extra concurrency slots for chunk workers, without waiting.
+        """
+        if self.chunk_limiter is None:
+            return [None] * count
+        tokens = []
+        while len(tokens) < count:
+            token = self.chunk_limiter.try_acquire_slot()
+            if token is None:
+                break
+            tokens.append(token)
+        return tokens
+
+    def _release_chunk_slots(self, tokens: List[Any]) -> None:
+        if self.chunk_limiter is not None:
+            for token in tokens:
+                self.chunk_limiter.release_slot(token)
+
+    async def _aacquire_chunk_slots(self, count: int) -> List[Any]:
+        """
+        Async version of _acquire_chunk_slots.
+        """
+        if self.chunk_limiter is None:
+            return [None] * count
+        tokens = []
+        while len(tokens) < count:
+            token = await self.chunk_limiter.atry_acquire_slot()
+            if token is None:
+                break
+            tokens.append(token)
+        return tokens
+
+    async def _arelease_chunk_slots(self, tokens: List[Any]) -> None:
+        if self.chunk_limiter is not None:
+            for token in tokens:
+                await self.chunk_limiter.arelease_slot(token)
+
+    def _translate_chunks(self, text: str) -> Iterator[str]:
+        """
+        Translate a long text chunk by chunk on a bounded worker pool.
+
+        The pool has one worker for the request's own concurrency slot plus one per extra
+        slot free in the API limiter, at most TRANSLATE_CHUNK_WORKERS. Each chunk has its
+        own cache entry and retries, and keeps its original text if it still fails, so a
+        failure costs one chunk instead of the whole document.
+
+        Yields:
+            Translated chunks and the original whitespace between them, in order
+        """
+        chunks, separators, build_prompt, cache_operation = self._prepare_chunks(text)
+        translate = partial(self._generate, "translate", build_prompt=build_prompt,
+                            description="chunk for translation", cache_operation=cache_operation)
+        tokens = self._acquire_chunk_slots(min(len(chunks), self.translate_chunk_workers) - 1)
+        pool = ThreadPoolExecutor(max_workers=len(tokens) + 1, thread_name_prefix="translate-chunk")
+        try:
+            # Each task runs in a copy of the request context, so it keeps the request deadline
+            futures = [pool.submit(contextvars.copy_context().run, translate, chunk) for chunk in chunks]
+            for future, separator in zip(futures, separators[1:]):
+                yield future.result()
+                if separator:
+                    yield separator
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+            self._release_chunk_slots(tokens)
+
+    async def _atranslate_chunks(self, text: str) -> AsyncIterator[str]:
+        """
+        Async version of _translate_chunks; a semaphore bounds the concurrent chunks.
+        """
+        chunks, separators, build_prompt, cache_operation = self._prepare_chunks(text)
+        tokens = await self._aacquire_chunk_slots(min(len(chunks), self.translate_chunk_workers) - 1)
+        semaphore = asyncio.Semaphore(len(tokens) + 1)
+
+        async def translate(chunk):
+            async with semaphore:
+                return await self._agenerate("translate", chunk, build_prompt, "chunk for translation",
+                                             cache_operation)
+
+        tasks = [asyncio.ensure_future(translate(chunk)) for chunk in chunks]
+        try:
+            for task, separator in zip(tasks, separators[1:]):
+                yield await task
+                if separator:
+                    yield separator
+        finally:
+            for task in tasks:
+                task.cancel()
+            await self._arelease_chunk_slots(tokens)
 
     def rephrase_to_prompt(self, text: str) -> str:
         """
@@ -279,51 +693,331 @@ class LangChainTextAnalyzer:
         Returns:
             Rephrased text as a ready-to-use prompt
         """
+        return self._generate("rephrase", text, self._build_rephrase_prompt, "text for rephrasing to prompt")
+
+    async def arephrase_to_prompt(self, text: str) -> str:
+        """
+        Async version of rephrase_to_prompt.
+        """
+        return await self._agenerate("rephrase", text, self._build_rephrase_prompt, "text for rephrasing to prompt")
+
+    def _generate(self, operation: str, text: str, build_prompt, description: str,
+                  cache_operation: Optional[str] = None) -> str:
+        """
+        Run a free-text generation (translation or rephrasing) with caching and retries.
+
+        Args:
+            cache_operation: Operation name in the cache key, when it must differ from operation
+
+        Returns:
+            The stripped model output, or the original text if the model fails
+        """
         if not text:
-            logger.warning("Empty text provided for rephrasing")
+            logger.warning(f"Empty text provided for {operation}")
             return text
 
+        model = self.router.select(operation, text)
+        cache_key = self._cache_key(operation, model, text, cache_operation)
+        cached_text = self.result_cache.get(cache_key)
+        if cached_text is not None:
+            return cached_text
+
         try:
-            # Create rephrasing prompt
-            rephrasing_prompt = f"""
-            You are “PromptRefiner”, a senior cross-LLM prompt engineer.
-            USER INPUT (original prompt to improve):
-
-            \"\"\"{text}\"\"\" 
-            
-
-            OBJECTIVE:
-            Rewrite the user input so that GPT-4-class or Claude-3-class models produce the most accurate, complete, and context-aware answer.
-
-            INSTRUCTIONS
-            Keep the rewritten prompt in the exact same language used in the original text.
-            
-            1. Preserve the original intent, but clarify goals, desired depth, and target audience.
-            2. Add any missing context or constraints that help the target model:  
-               - tone, answer format, length limit, domain perspective, examples, step-by-step reasoning, citation style, verification requests.
-            3. Eliminate ambiguity, filler, and duplicate ideas; keep language formal and professional unless instructed otherwise.
-            4. Do not mention these guidelines, your role, or any meta-text in the final result.
-            5. Output only the improved prompt, plain text, no labels, no commentary, no code fencing.
-            
-            
-            END OF INSTRUCTIONS
-            """
-
-            # Send prompt to Vertex AI
-            logger.info("Sending text to Vertex AI for rephrasing to prompt")
-            response = self.llm.invoke(rephrasing_prompt)
-
-            # Clean response
-            rephrased_text = response.strip()
-            logger.debug(f"Original text: '{text}', Rephrased prompt: '{rephrased_text}'")
-
-            return rephrased_text
+            prompt = self._prompt(build_prompt, text)
+            response = self.coalescer.run(cache_key, lambda: self._call_llm(
+                lambda: model.invoke(prompt), description, prompt
+            ))
+            return self._finish_generation(operation, text, response, cache_key)
 
         except Exception as e:
-            logger.error(f"Error in text rephrasing: {str(e)}")
-            # In case of error, return original text
+            logger.error(f"Error in text {operation}: {str(e)}")
+            # Return the original text in case of error
+            metrics.count(FALLBACKS, operation)
             return text
 
+    async def _agenerate(self, operation: str, text: str, build_prompt, description: str,
+                         cache_operation: Optional[str] = None) -> str:
+        """
+        Async version of _generate.
+        """
+        if not text:
+            logger.warning(f"Empty text provided for {operation}")
+            return text
+
+        model = self.router.select(operation, text)
+        cache_key = self._cache_key(operation, model, text, cache_operation)
+        cached_text = self.result_cache.get(cache_key)
+        if cached_text is not None:
+            return cached_text
+
+        try:
+            prompt = self._prompt(build_prompt, text)
+            response = await self.async_coalescer.run(cache_key, lambda: self._acall_llm(
+                lambda: model.ainvoke(prompt), description, prompt
+            ))
+            return self._finish_generation(operation, text, response, cache_key)
+
+        except Exception as e:
+            logger.error(f"Error in text {operation}: {str(e)}")
+            metrics.count(FALLBACKS, operation)
+            return text
+
+    def _finish_generation(self, operation: str, text: str, response: str, cache_key) -> str:
+        """
+        Clean up a generation response and cache it.
+        """
+        generated_text = response.strip()
+        logger.debug(f"Original text: '{text}', Generated text: '{generated_text}'")
+
+        if not generated_text:
+            metrics.count(FALLBACKS, operation)
+            return text
+
+        self.result_cache.set(cache_key, generated_text)
+        return generated_text
+
+    def _cache_key(self, operation: str, model, text: str, cache_operation: Optional[str] = None):
+        """
+        Cache key of a model answer for text, including the prompt version chosen for it.
+
+        Args:
+            operation: Operation, also the name of its prompt
+            model: Routed model answering it
+            cache_operation: Operation name in the cache key, when it must differ from operation
+        """
+        version = self.prompts.select(operation, text)
+        return make_cache_key(cache_operation or operation, model.model_name, text, version.version)
+
+    @staticmethod
+    def _prompt(build, *args, **kwargs) -> str:
+        """
+        Build a prompt, recording the time spent in the prompt stage.
+        """
+        started = time.perf_counter()
+        prompt = build(*args, **kwargs)
+        metrics.observe_stage(STAGE_PROMPT, time.perf_counter() - started)
+        return prompt
+
+    def _call_llm(self, call, description: str, prompt):
+        """
+        Invoke the model under the shared retry policy, hedging every attempt when enabled.
+
+        Args:
+            call: Zero-argument callable performing the model call
+            description: What is being sent, for log messages
+            prompt: The RenderedPrompt sent, whose version is credited with the
+                    call's latency and tokens
+
+        Returns:
+            The model response
+
+        Raises:
+            LLMCallError: If the call failed and may not be retried (CircuitOpenError
+                          when the circuit breaker short-circuited it)
+        """
+        if self.hedger is not None:
+            call = partial(self.hedger.call, prompt.version.name, call)
+        started = time.monotonic()
+        try:
+            response = self.retry_policy.call(call, description)
+        except CircuitOpenError:
+            raise
+        except LLMCallError:
+            prompt.record(time.monotonic() - started, None)
+            raise
+        prompt.record(time.monotonic() - started, response)
+        return response
+
+    async def _acall_llm(self, acall, description: str, prompt):
+        """
+        Async version of _call_llm; backoff uses asyncio.sleep so the event loop keeps serving.
+
+        Args:
+            acall: Zero-argument callable returning a coroutine for the model call
+        """
+        if self.hedger is not None:
+            acall = partial(self.hedger.acall, prompt.version.name, acall)
+        started = time.monotonic()
+        try:
+            response = await self.retry_policy.acall(acall, description)
+        except CircuitOpenError:
+            raise
+        except LLMCallError:
+            prompt.record(time.monotonic() - started, None)
+            raise
+        prompt.record(time.monotonic() - started, response)
+        return response
+
+    def stream_translation(self, text: str) -> Iterator[str]:
+        """
+        Stream the translation of a text as the model produces it.
+
+        Yields:
+            Text chunks whose concatenation equals translate_with_vertex's result; long
+            texts in chunked mode stream one translated chunk at a time
+        """
+        if self._chunked_translation(text):
+            return self._translate_chunks(text)
+        return self._stream_llm("translate", text, self._build_translation_prompt)
+
+    def stream_rephrase(self, text: str) -> Iterator[str]:
+        """
+        Stream the rephrased prompt as the model produces it.
+
+        Yields:
+            Text chunks whose concatenation equals rephrase_to_prompt's result
+        """
+        return self._stream_llm("rephrase", text, self._build_rephrase_prompt)
+
+    def astream_translation(self, text: str) -> AsyncIterator[str]:
+        """
+        Async version of stream_translation.
+        """
+        if self._chunked_translation(text):
+            return self._atranslate_chunks(text)
+        return self._astream_llm("translate", text, self._build_translation_prompt)
+
+    def astream_rephrase(self, text: str) -> AsyncIterator[str]:
+        """
+        Async version of stream_rephrase.
+        """
+        return self._astream_llm("rephrase", text, self._build_rephrase_prompt)
+
+    def _stream_llm(self, operation: str, text: str, build_prompt) -> Iterator[str]:
+        """
+        Stream an LLM response with the same cleanup as the blocking methods:
+        surrounding whitespace is stripped, cached results are replayed at once and
+        the original text is returned if the model fails before producing any output.
+        """
+        if not text:
+            logger.warning(f"Empty text provided for {operation} stream")
+            return
+
+        model = self.router.select(operation, text)
+        cache_key = self._cache_key(operation, model, text)
+        cached_text = self.result_cache.get(cache_key)
+        if cached_text is not None:
+            yield cached_text
+            return
+
+        prompt = self._prompt(build_prompt, text)
+        state = self.retry_policy.begin()
+        started = time.monotonic()
+
+        # Releases the circuit breaker's trial if the client goes away mid-stream (GeneratorExit/cancellation)
+        try:
+            while True:
+                cleaner = _StreamCleaner()
+                try:
+                    self.retry_policy.before_attempt(state)
+                except CircuitOpenError:
+                    metrics.count(FALLBACKS, operation)
+                    yield text
+                    return
+
+                try:
+                    logger.info(f"Attempt {state.attempts}/{state.max_attempts}: Streaming {operation} from Vertex AI")
+                    for chunk in model.stream(prompt):
+                        piece = cleaner.feed(chunk)
+                        if piece:
+                            yield piece
+                    self.retry_policy.record_success(state)
+                    break
+
+                except Exception as api_error:
+                    delay = self.retry_policy.on_failure(state, api_error)
+                    if cleaner.text:
+                        # Part of the answer is already on the wire and cannot be retried
+                        logger.error(f"Streaming {operation} failed mid-response: {str(api_error)}")
+                        prompt.record(time.monotonic() - started, None)
+                        return
+
+                    logger.warning(f"Streaming {operation} failed (attempt {state.attempts}/{state.max_attempts}): {str(api_error)}")
+                    if delay is None:
+                        logger.error(f"All retries failed for streaming {operation}")
+                        prompt.record(time.monotonic() - started, None)
+                        metrics.count(FALLBACKS, operation)
+                        yield text
+                        return
+
+                    time.sleep(delay)
+        finally:
+            self.retry_policy.end(state)
+
+        prompt.record(time.monotonic() - started, cleaner.text)
+        if not cleaner.text:
+            metrics.count(FALLBACKS, operation)
+            yield text
+            return
+
+        self.result_cache.set(cache_key, cleaner.text)
+
+    async def _astream_llm(self, operation: str, text: str, build_prompt) -> AsyncIterator[str]:
+        """
+        Async version of _stream_llm using the model's astream interface.
+        """
+        if not text:
+            logger.warning(f"Empty text provided for {operation} stream")
+            return
+
+        model = self.router.select(operation, text)
+        cache_key = self._cache_key(operation, model, text)
+        cached_text = self.result_cache.get(cache_key)
+        if cached_text is not None:
+            yield cached_text
+            return
+
+        prompt = self._prompt(build_prompt, text)
+        state = self.retry_policy.begin()
+        started = time.monotonic()
+
+        # Releases the circuit breaker's trial if the client goes away mid-stream (GeneratorExit/cancellation)
+        try:
+            while True:
+                cleaner = _StreamCleaner()
+                try:
+                    self.retry_policy.before_attempt(state)
+                except CircuitOpenError:
+                    metrics.count(FALLBACKS, operation)
+                    yield text
+                    return
+
+                try:
+                    logger.info(f"Attempt {state.attempts}/{state.max_attempts}: Streaming {operation} from Vertex AI")
+                    async for chunk in model.astream(prompt):
+                        piece = cleaner.feed(chunk)
+                        if piece:
+                            yield piece
+                    self.retry_policy.record_success(state)
+                    break
+
+                except Exception as api_error:
+                    delay = self.retry_policy.on_failure(state, api_error)
+                    if cleaner.text:
+                        logger.error(f"Streaming {operation} failed mid-response: {str(api_error)}")
+                        prompt.record(time.monotonic() - started, None)
+                        return
+
+                    logger.warning(f"Streaming {operation} failed (attempt {state.attempts}/{state.max_attempts}): {str(api_error)}")
+                    if delay is None:
+                        logger.error(f"All retries failed for streaming {operation}")
+                        prompt.record(time.monotonic() - started, None)
+                        metrics.count(FALLBACKS, operation)
+                        yield text
+                        return
+
+                    await asyncio.sleep(delay)
+        finally:
+            self.retry_policy.end(state)
+
+        prompt.record(time.monotonic() - started, cleaner.text)
+        if not cleaner.text:
+            metrics.count(FALLBACKS, operation)
+            yield text
+            return
+
+        self.result_cache.set(cache_key, cleaner.text)
+
     def is_available(self) -> bool:
         """
         Check if the LangChain with Vertex AI is available and working.
@@ -1,3 +1,42 @@
+import re
+from typing import Callable, List, Optional, Tuple
+
+# Hebrew block and the ASCII letters, as used by detect_character_language
+HEBREW_CHARS = "\u0590-\u05FF"
+ENGLISH_CHARS = "A-Za-z"
+
+# Matches the last-language segment of a *reversed* string in a single pass:
+# leading neutral characters, then the first letter (which decides the language),
+# then everything up to the first letter of the other language.
+_LAST_SEGMENT_PATTERN = re.compile(
+    f"[^{ENGLISH_CHARS}{HEBREW_CHARS}]*"
+    f"(?:(?P<hebrew>[{HEBREW_CHARS}])[^{ENGLISH_CHARS}]*"
+    f"|(?P<english>[{ENGLISH_CHARS}])[^{HEBREW_CHARS}]*)?"
+)
+
+# Script names of the spans returned by LanguageDetector.segment
+HEBREW = "hebrew"
+ENGLISH = "english"
+NEUTRAL = "neutral"
+
+# One script run per match: letters of one script together with the neutral
+# characters between them, or a run of neutral characters between scripts
+# (or at either end of the text).
+_RUN_PATTERN = re.compile(
+    f"(?P<{HEBREW}>[{HEBREW_CHARS}](?:[^{ENGLISH_CHARS}]*[{HEBREW_CHARS}])?)"
+    f"|(?P<{ENGLISH}>[{ENGLISH_CHARS}](?:[^{HEBREW_CHARS}]*[{ENGLISH_CHARS}])?)"
+    f"|(?P<{NEUTRAL}>[^{ENGLISH_CHARS}{HEBREW_CHARS}]+)"
+)
+
+# UTF-8 letter counting for dominant_language: U+0590-U+05BF are 0xD6 0x90-0xBF,
+# and every byte that is not an ASCII letter is deleted to count English letters
+_HEBREW_D6_PATTERN = re.compile(rb"\xd6[\x90-\xbf]")
+_NON_ENGLISH_BYTES = bytes(byte for byte in range(256) if not chr(byte).isascii() or not chr(byte).isalpha())
+
+# (start, end, script) spans covering a text in order
+Spans = List[Tuple[int, int, str]]
+
+
 class LanguageDetector:
     def __init__(self):
         # Explicit mapping from Hebrew to English
@@ -91,6 +130,12 @@ class LanguageDetector:
                 , "Z": "ז"
             }
 
+        # Translation tables compiled once, keyed by the source language
+        self._tables = {
+            "hebrew": str.maketrans(self.hebrew_to_english),
+            "english": str.maketrans(self.english_to_hebrew),
+        }
+
     def detect_character_language(self, char: str) -> str:
         """
         Detects the language of a single character.
@@ -101,43 +146,152 @@ class LanguageDetector:
             return 'english'
         return 'unknown'
 
-    def convert_last_language(self, text: str) -> str:
+    def segment(self, text: str) -> Spans:
+        """
+        Splits text into script runs in a single pass.
+
+        A Hebrew or English run spans from its first to its last letter, including
+        the neutral characters (spaces, digits, punctuation) between its letters.
+        Neutral runs only occur between runs of different scripts and at the ends
+        of the text, so there is one span per script change rather than per word.
+
+        Args:
+            text: Text to scan
+
+        Returns:
+            (start, end, script) spans covering text in order, where script is
+            'hebrew', 'english' or 'neutral'
+        """
+        return [(match.start(), match.end(), match.lastgroup) for match in _RUN_PATTERN.finditer(text)]
+
+    def language_segments(self, text: str, spans: Optional[Spans] = None) -> Spans:
+        """
+        Groups the spans into the segments convert_last_language works on: every
+        script run together with the neutral characters before it, and the last one
+        also with the neutral characters after it.
+
+        Args:
+            text: Text to scan
+            spans: segment(text), when the caller already has it
+
+        Returns:
+            (start, end, script) segments covering text in order, without neutral
+            ones; empty when the text contains no Hebrew or English letters
+        """
+        spans = self.segment(text) if spans is None else spans
+        segments = []
+        start = 0
+        for _, end, script in spans:
+            if script != NEUTRAL:
+                segments.append((start, end, script))
+                start = end
+        if segments:
+            segments[-1] = (segments[-1][0], len(text), segments[-1][2])
+        return segments
+
+    def dominant_language(self, text: str) -> Optional[str]:
+        """
+        Returns the script with more letters in text, or None when it has no letters.
+
+        The result is the same as counting detect_character_language over every
+        character, including a tie going to English, but the counting happens on the
+        UTF-8 bytes in C: English letters are the bytes left after deleting all
+        others, and every character of the Hebrew block starts with byte 0xD7, or 0xD6
+        followed by 0x90-0xBF (lead bytes never occur inside another character).
+        """
+        encoded = text.encode("utf-8", "surrogatepass")
+        hebrew_letters = encoded.count(b"\xd7") + len(_HEBREW_D6_PATTERN.findall(encoded))
+        english_letters = len(encoded.translate(None, _NON_ENGLISH_BYTES))
+        if not hebrew_letters and not english_letters:
+            return None
+        return HEBREW if hebrew_letters > english_letters else ENGLISH
+
+    def convert_last_language(self, text: str, spans: Optional[Spans] = None) -> str:
         """
         Converts the last segment of text written in a specific language.
         Starts from the last character and stops when encountering a different language.
+
+        Args:
+            text: Text to convert
+            spans: segment(text), when the caller already has it
         """
         if not text:
             return text
 
-        # Start from the last character and detect the last language
-        last_language = None
-        segment_to_convert = []
-        index = len(text) - 1
-
-        # Traverse backwards to find the last segment
-        while index >= 0:
-            char = text[index]
-            char_language = self.detect_character_language(char)
-
-            # Initialize the language if not set
-            if last_language is None and char_language in {"hebrew", "english"}:
-                last_language = char_language
-
-            # Stop collecting characters if the language changes
-            if last_language and char_language != last_language and char_language in {"hebrew", "english"}:
-                break
-
-            # Add character to the segment
-            segment_to_convert.insert(0, char)
-            index -= 1
-
-        # Convert the identified segment based on its language
-        if last_language == "hebrew":
-            converted_segment = [self.hebrew_to_english.get(char, char) for char in segment_to_convert]
-        elif last_language == "english":
-            converted_segment = [self.english_to_hebrew.get(char.lower(), char) for char in segment_to_convert]
-        else:
-            converted_segment = segment_to_convert
-
-        # Combine the converted segment with the rest of the text
-        return ''.join(text[:index + 1]) + ''.join(converted_segment)
+        language, start = self.find_last_segment(text, spans)
+        if language is None:
+            return text
+
+        return text[:start] + text[start:].translate(self._tables[language])
+
+    def convert_mistyped_runs(self, text: str, choose_candidate: Callable[[str, str], Tuple[Optional[str], float]],
+                              spans: Optional[Spans] = None) -> str:
+        """
+        Converts the last segment like convert_last_language, and every earlier
+        segment whose conversion choose_candidate prefers over the original.
+
+        Args:
+            text: Text to convert
+            choose_candidate: Function of (original, converted) returning the preferred
+                              one (or None when undecided) and a confidence, such as
+                              WordFrequencyIndex.choose_candidate
+            spans: segment(text), when the caller already has it
+
+        Returns:
+            Converted text
+        """
+        segments = self.language_segments(text, spans)
+        parts = []
+        for number, (start, end, script) in enumerate(segments, start=1):
+            original = text[start:end]
+            converted = original.translate(self._tables[script])
+            if number == len(segments) or choose_candidate(original, converted)[0] == converted:
+                parts.append(converted)
+            else:
+                parts.append(original)
+        return "".join(parts) if segments else text
+
+    def find_last_segment(self, text: str, spans: Optional[Spans] = None):
+        """
+        Finds the segment written in the last language used in the text.
+
+        Args:
+            text: Text to scan
+            spans: segment(text), when the caller already has it; without it only
+                   the end of the text is scanned
+
+        Returns:
+            Tuple of (language, start index) where language is 'hebrew', 'english'
+            or None when the text contains no Hebrew or English letters
+        """
+        if spans is not None:
+            for index in range(len(spans) - 1, -1, -1):
+                start, _, script = spans[index]
+                if script != NEUTRAL:
+                    if index and spans[index - 1][2] == NEUTRAL:
+                        start = spans[index - 1][0]
+                    return script, start
+            return None, len(text)
+
+        match = _LAST_SEGMENT_PATTERN.match(text[::-1])
+        language = match.lastgroup
+        if language is None:
+            return None, len(text)
+        return language, len(text) - match.end()
+
+    def convert_full(self, text: str, direction: str) -> str:
+        """
+        Converts the whole text from one keyboard layout to the other.
+
+        Args:
+            text: Text to convert
+            direction: 'hebrew_to_english' or 'english_to_hebrew'
+
+        Returns:
+            Converted text
+        """
+        if direction == "hebrew_to_english":
+            return text.translate(self._tables["hebrew"])
+        if direction == "english_to_hebrew":
+            return text.translate(self._tables["english"])
+        raise ValueError(f"Unknown conversion direction: {direction}")
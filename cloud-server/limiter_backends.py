@@ -0,0 +1,477 @@
+"""
+limiter_backends.py - State backends for APILimiter.
+
+A backend owns the per-client rate limit counters and the count of in-flight
+calls, and admits a request with a single operation:
+    - LocalLimiterBackend: process memory (one gunicorn worker)
+    - SharedMemoryLimiterBackend: an mmap'd file shared by all workers on a host
+    - RedisLimiterBackend: a Redis server shared by all instances; one atomic
+      script call (one round trip) per admitted request
+"""
+
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Admission results
+ADMITTED = "admitted"
+RATE_LIMITED = "rate_limited"
+BUSY = "busy"
+
+
+class SlidingWindowRateLimiter:
+    """
+    Constant-time, constant-memory-per-key rate limiter (sliding window counter).
+
+    Each key keeps only the counts of the current and previous fixed windows; the
+    request rate is estimated by weighting the previous window by how much of it
+    still overlaps the sliding window. Keys live in an LRU table capped at
+    max_keys, so memory stays bounded however many clients there are.
+    """
+
+    def __init__(self, window_seconds=60, max_keys=100000):
+        self.window_seconds = window_seconds
+        self.max_keys = max_keys
+        # key -> [window index, count in current window, count in previous window]
+        self.counters = OrderedDict()
+        # Lock for thread-safe operations
+        self.lock = threading.Lock()
+        self.evictions = 0
+
+    def hit(self, key, limit, weight=1, now=None):
+        """
+        Count a request of the given weight unless it would exceed the limit
+
+        Args:
+            key: Client key (e.g. IP address)
+            limit: Maximum allowed requests per window
+            weight: Number of requests this call counts as
+            now: Current time (defaults to time.time())
+
+        Returns:
+            True if the request is allowed, False if rate limited
+        """
+        now = time.time() if now is None else now
+        window, offset = divmod(now, self.window_seconds)
+
+        with self.lock:
+            counter = self.counters.get(key)
+            if counter is None:
+                counter = [window, 0, 0]
+                self.counters[key] = counter
+                if len(self.counters) > self.max_keys:
+                    self.counters.popitem(last=False)
+                    self.evictions += 1
+            else:
+                self.counters.move_to_end(key)
+                if counter[0] != window:
+                    # Roll the windows forward; after a gap of 2+ windows both are empty
+                    counter[2] = counter[1] if window - counter[0] == 1 else 0
+                    counter[1] = 0
+                    counter[0] = window
+
+            overlap = 1.0 - offset / self.window_seconds
+            estimated = counter[2] * overlap + counter[1]
+            if estimated + weight > limit:
+                return False
+
+            counter[1] += weight
+            return True
+
+    def __len__(self):
+        return len(self.counters)
+
+
+class LocalLimiterBackend:
+    """
+    Limiter state in process memory
+    """
+
+    networked = False
+    shared = False
+
+    def __init__(self, window_seconds=60, max_keys=100000):
+        self.rate_limits = SlidingWindowRateLimiter(window_seconds=window_seconds, max_keys=max_keys)
+        self._active_calls = 0
+        # Lock for thread-safe operations
+        self.lock = threading.Lock()
+
+    def admit(self, key, limit, weight, max_concurrent):
+        """
+        Check the rate limit of a key and take a concurrency slot.
+
+        Returns:
+            Tuple of (ADMITTED, RATE_LIMITED or BUSY, release token or None)
+        """
+        if not self.rate_limits.hit(key, limit, weight):
+            return RATE_LIMITED, None
+
+        token = self.acquire(max_concurrent)
+        return (ADMITTED, token) if token is not None else (BUSY, None)
+
+    def acquire(self, max_concurrent):
+        """
+        Take a concurrency slot without a rate limit check (for queued requests).
+
+        Returns:
+            Release token, or None if all slots are taken
+        """
+        with self.lock:
+            if self._active_calls >= max_concurrent:
+                return None
+            self._active_calls += 1
+        return True
+
+    def release(self, token):
+        with self.lock:
+            self._active_calls -= 1
+
+    def active_calls(self):
+        return self._active_calls
+
+
+class SharedMemoryLimiterBackend:
+    """
+    Limiter state in an mmap'd file shared by every worker process on the host.
+
+    Layout (little-endian):
+        header   magic (8 bytes), worker slot count, rate slot count, total active calls
+        workers  (pid int64, active calls int64) per worker slot
+        rates    (key hash uint64, window float64, current float64, previous float64) per rate slot
+
+    In-flight calls are counted per worker pid as well as in total, so slots held
+    by a crashed worker are reclaimed when the limit is reached. Rate counters live in a fixed-size open-addressing table: a key
+    is looked up over its whole probe sequence before it claims the first empty or
+    stale slot, and when the sequence is full the entry with the oldest window is
+    replaced.
+    Cross-process updates are serialized with flock, threads with a lock.
+    """
+
+    MAGIC = b"KFLIMIT1"
+    _HEADER = struct.Struct("<8sIIq")
+    _TOTAL = struct.Struct("<q")
+    _WORKER = struct.Struct("<qq")
+    _RATE = struct.Struct("<Qddd")
+    PROBES = 8
+    networked = False
+    shared = True
+
+    def __init__(self, path, window_seconds=60, rate_slots=65536, worker_slots=64):
+        self.path = path
+        self.window_seconds = window_seconds
+        self.rate_slots = rate_slots
+        self.worker_slots = worker_slots
+        self._workers_start = self._HEADER.size
+        self._rates_start = self._workers_start + worker_slots * self._WORKER.size
+        size = self._rates_start + rate_slots * self._RATE.size
+        # Lock for threads of this process (flock does not exclude them)
+        self.lock = threading.Lock()
+        # Worker slot of this process, found on first use (pid changes after fork)
+        self._worker_pid = None
+        self._worker_slot = None
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self._file_lock():
+            if os.fstat(self._fd).st_size != size:
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, size)
+            self._mmap = mmap.mmap(self._fd, size)
+            magic, workers, rates, _ = self._HEADER.unpack_from(self._mmap, 0)
+            if magic != self.MAGIC or workers != worker_slots or rates != rate_slots:
+                self._mmap[:] = bytes(size)
+                self._HEADER.pack_into(self._mmap, 0, self.MAGIC, worker_slots, rate_slots, 0)
+
+    def _file_lock(self):
+        backend = self
+
+        class _Lock:
+            def __enter__(self):
+                backend.lock.acquire()
+                fcntl.flock(backend._fd, fcntl.LOCK_EX)
+
+            def __exit__(self, *exc):
+                fcntl.flock(backend._fd, fcntl.LOCK_UN)
+                backend.lock.release()
+
+        return _Lock()
+
+    @staticmethod
+    def _key_hash(key):
+        # Stable across processes, unlike hash(); 0 marks an empty slot
+        return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little") or 1
+
+    def _hit(self, key, limit, weight, now):
+        key_hash = self._key_hash(key)
+        window, offset = divmod(now, self.window_seconds)
+
+        # The whole probe sequence is searched for the key first: claiming the first
+        # free or stale slot right away would give a key whose earlier slot went stale
+        # a second, fresh counter (and so a new window)
+        target = None
+        free = None
+        oldest = None
+        for probe in range(self.PROBES):
+            position = self._rates_start + ((key_hash + probe) % self.rate_slots) * self._RATE.size
+            slot_hash, slot_window, current, previous = self._RATE.unpack_from(self._mmap, position)
+            if slot_hash == key_hash:
+                target = (position, slot_window, current, previous)
+                break
+            if slot_hash == 0 or window - slot_window >= 2:
+                # Empty or stale slot
+                if free is None:
+                    free = position
+            elif oldest is None or slot_window < oldest[1]:
+                oldest = (position, slot_window)
+        if target is None:
+            target = (free if free is not None else oldest[0], window, 0.0, 0.0)
+
+        position, slot_window, current, previous = target
+        if slot_window != window:
+            previous = current if window - slot_window == 1 else 0.0
+            current = 0.0
+
+        estimated = previous * (1.0 - offset / self.window_seconds) + current
+        if estimated + weight > limit:
+            return False
+
+        self._RATE.pack_into(self._mmap, position, key_hash, window, current + weight, previous)
+        return True
+
+    def _worker_position(self):
+        """
+        Find this process's worker slot, claiming a free or dead one if needed.
+        """
+        pid = os.getpid()
+        if self._worker_pid == pid:
+            return self._worker_slot
+
+        free = None
+        for index in range(self.worker_slots):
+            position = self._workers_start + index * self._WORKER.size
+            slot_pid, _ = self._WORKER.unpack_from(self._mmap, position)
+            if slot_pid == pid:
+                free = position
+                break
+            if free is None and (slot_pid == 0 or not _pid_alive(slot_pid)):
+                free = position
+        if free is None:
+            raise RuntimeError("No free worker slot in shared limiter state")
+
+        _, count = self._WORKER.unpack_from(self._mmap, free)
+        self._WORKER.pack_into(self._mmap, free, pid, 0)
+        self._add_total(-count)
+        self._worker_pid, self._worker_slot = pid, free
+        return free
+
+    def _total(self):
+        return self._TOTAL.unpack_from(self._mmap, self._HEADER.size - self._TOTAL.size)[0]
+
+    def _add_total(self, delta):
+        self._TOTAL.pack_into(self._mmap, self._HEADER.size - self._TOTAL.size, max(0, self._total() + delta))
+
+    def _reclaim_dead_workers(self):
+        """
+        Drop the calls of worker processes that exited without releasing them.
+        """
+        for index in range(self.worker_slots):
+            position = self._workers_start + index * self._WORKER.size
+            slot_pid, count = self._WORKER.unpack_from(self._mmap, position)
+            if slot_pid and slot_pid != os.getpid() and not _pid_alive(slot_pid):
+                self._WORKER.pack_into(self._mmap, position, 0, 0)
+                self._add_total(-count)
+
+    def _add_call(self, delta):
+        position = self._worker_position()
+        pid, count = self._WORKER.unpack_from(self._mmap, position)
+        if count + delta < 0:
+            return
+        self._WORKER.pack_into(self._mmap, position, pid, count + delta)
+        self._add_total(delta)
+
+    def admit(self, key, limit, weight, max_concurrent):
+        """
+        Check the rate limit of a key and take a concurrency slot, atomically across workers.
+
+        Returns:
+            Tuple of (ADMITTED, RATE_LIMITED or BUSY, release token or None)
+        """
+        with self._file_lock():
+            if not self._hit(key, limit, weight, time.time()):
+                return RATE_LIMITED, None
+
+            if not self._acquire(max_concurrent):
+                return BUSY, None
+        return ADMITTED, True
+
+    def _acquire(self, max_concurrent):
+        if self._total() >= max_concurrent:
+            self._reclaim_dead_workers()
+            if self._total() >= max_concurrent:
+                return False
+        self._add_call(1)
+        return True
+
+    def acquire(self, max_concurrent):
+        """
+        Take a concurrency slot without a rate limit check (for queued requests).
+
+        Returns:
+            Release token, or None if all slots are taken
+        """
+        with self._file_lock():
+            return True if self._acquire(max_concurrent) else None
+
+    def release(self, token):
+        with self._file_lock():
+            self._add_call(-1)
+
+    def active_calls(self):
+        return self._total()
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+# Rate limit check and concurrency lease in one atomic script.
+# KEYS: rate counter hash, lease sorted set
+# ARGV: window index, window offset fraction, limit, weight, counter TTL,
+#       now, max concurrent, lease expiry, lease id
+# Returns 1 when admitted, 0 when rate limited, -1 when busy.
+ADMIT_SCRIPT = """
+local window = tonumber(ARGV[1])
+local data = redis.call('HMGET', KEYS[1], 'w', 'cur', 'prev')
+local current = tonumber(data[2]) or 0
+local previous = tonumber(data[3]) or 0
+local stored_window = tonumber(data[1])
+if stored_window == nil then
+    current = 0
+    previous = 0
+elseif stored_window ~= window then
+    if window - stored_window == 1 then previous = current else previous = 0 end
+    current = 0
+end
+local weight = tonumber(ARGV[4])
+if previous * (1 - tonumber(ARGV[2])) + current + weight > tonumber(ARGV[3]) then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'w', window, 'cur', current + weight, 'prev', previous)
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', ARGV[6])
+if redis.call('ZCARD', KEYS[2]) >= tonumber(ARGV[7]) then
+    return -1
+end
+redis.call('ZADD', KEYS[2], ARGV[8], ARGV[9])
+return 1
+"""
+
+# Concurrency lease only, for queued requests whose rate was already counted.
+# KEYS: lease sorted set
+# ARGV: now, max concurrent, lease expiry, lease id
+# Returns 1 when a lease was taken, 0 when busy.
+ACQUIRE_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[4])
+return 1
+"""
+
+
+class RedisLimiterBackend:
+    """
+    Limiter state in Redis, shared by every worker of every instance.
+
+    Admission is a single EVALSHA of ADMIT_SCRIPT; in-flight calls are leases in
+    a sorted set scored by expiry, so leases of crashed processes time out.
+    """
+
+    networked = True
+    shared = True
+
+    def __init__(self, url, window_seconds=60, lease_seconds=120, prefix="keyfixer:limiter"):
+        # Imported here so the redis package is only required for this backend
+        import redis
+
+        self.client = redis.Redis.from_url(url, socket_timeout=1.0)
+        self.window_seconds = window_seconds
+        self.lease_seconds = lease_seconds
+        self.prefix = prefix
+        self.leases_key = f"{prefix}:leases"
+        self._admit = self.client.register_script(ADMIT_SCRIPT)
+        self._acquire = self.client.register_script(ACQUIRE_SCRIPT)
+
+    def admit(self, key, limit, weight, max_concurrent):
+        """
+        Check the rate limit of a key and take a concurrency lease in one round trip.
+
+        Returns:
+            Tuple of (ADMITTED, RATE_LIMITED or BUSY, lease id or None)
+        """
+        now = time.time()
+        window, offset = divmod(now, self.window_seconds)
+        lease_id = uuid.uuid4().hex
+        result = int(self._admit(
+            keys=[f"{self.prefix}:rate:{key}", self.leases_key],
+            args=[int(window), offset / self.window_seconds, limit, weight, self.window_seconds * 2,
+                  now, max_concurrent, now + self.lease_seconds, lease_id]
+        ))
+        if result == 1:
+            return ADMITTED, lease_id
+        return (RATE_LIMITED if result == 0 else BUSY), None
+
+    def acquire(self, max_concurrent):
+        """
+        Take a concurrency lease without a rate limit check (for queued requests).
+
+        Returns:
+            Lease id, or None if all slots are taken
+        """
+        now = time.time()
+        lease_id = uuid.uuid4().hex
+        acquired = self._acquire(keys=[self.leases_key], args=[now, max_concurrent, now + self.lease_seconds, lease_id])
+        return lease_id if int(acquired) == 1 else None
+
+    def release(self, token):
+        self.client.zrem(self.leases_key, token)
+
+    def active_calls(self):
+        return self.client.zcount(self.leases_key, time.time(), "+inf")
+
+
+def create_limiter_backend():
+    """
+    Build the limiter backend selected by LIMITER_BACKEND (local, shared_memory or redis).
+    Falls back to the local backend if the shared one cannot be set up.
+    """
+    backend_name = os.getenv("LIMITER_BACKEND", "local").lower()
+    max_keys = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+
+    try:
+        if backend_name == "shared_memory":
+            default_path = os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(),
+                                        "keyfixer_limiter")
+            return SharedMemoryLimiterBackend(os.getenv("LIMITER_SHM_PATH", default_path), rate_slots=max_keys)
+        if backend_name == "redis":
+            return RedisLimiterBackend(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+    except Exception as e:
+        logger.error(f"Failed to initialize {backend_name} limiter backend, using local state: {str(e)}")
+
+    return LocalLimiterBackend(max_keys=max_keys)
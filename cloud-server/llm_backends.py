@@ -0,0 +1,239 @@
+"""
+llm_backends.py - Language model backends of the text analyzer.
+
+Every analyzer entry point calls the model through LangChain's LLM interface
+(invoke / ainvoke / stream / astream, and chains built with `prompt | llm`),
+so a backend is any LangChain LLM. LLM_BACKEND selects it:
+    - vertex (default): Vertex AI through langchain_google_vertexai
+    - fake: FakeLLM, a deterministic local model with configurable latency and
+      error rate, for load-testing the server without network or credentials
+"""
+
+import asyncio
+import logging
+import math
+import os
+import random
+import re
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+from pydantic import PrivateAttr
+
+logger = logging.getLogger(__name__)
+
+# Prompt sections recognized by the fake model
+_BATCH_ITEM_PATTERN = re.compile(r"^\s*\[(\d+)\]\s*\n\s*Sentence 1: (.*)\n\s*Sentence 2: (.*)$", re.MULTILINE)
+_SENTENCE_2_PATTERN = re.compile(r"Sentence 2: (.*?)\s*$", re.MULTILINE)
+_TRANSLATION_INPUT_PATTERN = re.compile(r"INPUT TEXT:\s*\n(.*)", re.DOTALL)
+_REPHRASE_INPUT_PATTERN = re.compile(r'"""(.*?)"""', re.DOTALL)
+
+
+class FakeLLMError(Exception):
+    """
+    Simulated model failure raised by FakeLLM
+    """
+
+
+class FakeLLM(LLM):
+    """
+    Deterministic stand-in for Vertex AI.
+
+    Answers follow the formats the analyzer parses: "CORRECTED: ..." for
+    analysis (the converted sentence), one "[n] CORRECTED: ..." line per batch
+    item, the input text for translation and a fixed wrapper for rephrasing.
+    Latencies are log-normal around latency_median_ms, plus ms_per_output_token
+    for every generated token, and a share error_rate of calls fail; both are
+    drawn from a generator seeded with `seed`, so a run with the same call
+    sequence behaves identically. Stop sequences and the max_output_tokens call
+    argument are honored (about 4 characters per token).
+    """
+
+    latency_median_ms: float = 300.0
+    latency_sigma: float = 0.5
+    error_rate: float = 0.0
+    seed: int = 0
+    # Generation time per output token, so long answers take longer like real models do
+    ms_per_output_token: float = 0.0
+    # Characters per streamed chunk
+    chunk_size: int = 8
+
+    _rng: random.Random = PrivateAttr()
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._rng = random.Random(self.seed)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def _draw(self, response: str):
+        """
+        Latency in seconds and whether the call fails, for the next call answering response.
+        """
+        with self._lock:
+            latency = self.latency_median_ms / 1000 * math.exp(self.latency_sigma * self._rng.gauss(0, 1))
+            fails = self._rng.random() < self.error_rate
+        latency += self.ms_per_output_token / 1000 * math.ceil(len(response) / 4)
+        return latency, fails
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> str:
+        response = self._respond(prompt, stop, kwargs)
+        latency, fails = self._draw(response)
+        time.sleep(latency)
+        if fails:
+            raise FakeLLMError("Simulated model error")
+        return response
+
+    async def _acall(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> str:
+        response = self._respond(prompt, stop, kwargs)
+        latency, fails = self._draw(response)
+        await asyncio.sleep(latency)
+        if fails:
+            raise FakeLLMError("Simulated model error")
+        return response
+
+    def _stream(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None,
+                **kwargs: Any) -> Iterator[GenerationChunk]:
+        response = self._respond(prompt, stop, kwargs)
+        latency, fails = self._draw(response)
+        chunks = self._chunks(response)
+        # Half of the latency before the first token, the rest spread over the chunks
+        time.sleep(latency / 2)
+        if fails:
+            raise FakeLLMError("Simulated model error")
+        for chunk in chunks:
+            time.sleep(latency / 2 / len(chunks))
+            yield GenerationChunk(text=chunk)
+
+    async def _astream(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None,
+                       **kwargs: Any) -> AsyncIterator[GenerationChunk]:
+        response = self._respond(prompt, stop, kwargs)
+        latency, fails = self._draw(response)
+        chunks = self._chunks(response)
+        await asyncio.sleep(latency / 2)
+        if fails:
+            raise FakeLLMError("Simulated model error")
+        for chunk in chunks:
+            await asyncio.sleep(latency / 2 / len(chunks))
+            yield GenerationChunk(text=chunk)
+
+    @staticmethod
+    def _respond(prompt: str, stop: Optional[List[str]], kwargs: Dict[str, Any]) -> str:
+        text = fake_response(prompt)
+        for sequence in stop or []:
+            text = text.split(sequence, 1)[0]
+        max_output_tokens = kwargs.get("max_output_tokens")
+        return text[:max_output_tokens * 4] if max_output_tokens else text
+
+    def _chunks(self, text: str) -> List[str]:
+        return [text[start:start + self.chunk_size] for start in range(0, len(text), self.chunk_size)] or [""]
+
+
+def fake_response(prompt: str) -> str:
+    """
+    Deterministic answer of the fake model to one of the analyzer's prompts.
+    """
+    if "ITEMS:" in prompt:
+        return "\n".join(
+            f"[{number}] CORRECTED: {converted.strip()}"
+            for number, _, converted in _BATCH_ITEM_PATTERN.findall(prompt)
+        )
+
+    match = _SENTENCE_2_PATTERN.search(prompt)
+    if match:
+        return f"CORRECTED: {match.group(1)}"
+
+    match = _TRANSLATION_INPUT_PATTERN.search(prompt)
+    if match:
+        return match.group(1).strip()
+
+    match = _REPHRASE_INPUT_PATTERN.search(prompt)
+    if match:
+        return f"Answer the following request accurately and step by step: {match.group(1).strip()}"
+
+    if "available" in prompt:
+        return "yes"
+    return "OK"
+
+
+def create_vertex_llm(model_name: str):
+    """
+    Initialize Vertex AI and build the LangChain VertexAI model, with retries.
+    """
+    # Imported here so the fake backend runs without the Google Cloud libraries
+    import vertexai
+    from langchain_google_vertexai import VertexAI
+
+    # Set project configuration from environment variables with fallbacks
+    project_id = os.getenv("PROJECT_ID", "project-id-placeholder")
+    location = os.getenv("REGION", "us-central1")
+
+    # Detect if running in GCP environment
+    is_gcp_environment = os.getenv("GAE_ENV", "").startswith("standard") or \
+                       os.getenv("K_SERVICE", "") or \
+                       os.getenv("FUNCTION_NAME", "")
+
+    logger.info(f"Environment detection: Running in {'GCP' if is_gcp_environment else 'local'} environment")
+
+    # Credentials handling based on environment
+    if is_gcp_environment:
+        # In GCP, the service will use the attached service account automatically
+        logger.info("Using default GCP credentials")
+    else:
+        # Local development - use explicit credentials file
+        credentials_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+        if credentials_path and os.path.exists(credentials_path):
+            logger.info("Using credentials from environment variable")
+        else:
+            logger.warning("No credentials found - service may fail")
+
+    # Initialize Vertex AI with proper error handling
+    try:
+        vertexai.init(project=project_id, location=location)
+        logger.info(f"Initialized Vertex AI with project ID and location: {location}")
+    except Exception as vertex_init_error:
+        logger.error(f"Failed to initialize Vertex AI: {str(vertex_init_error)}")
+        raise
+
+    # Initialize LangChain's Vertex AI model with retries
+    max_retries = 3
+    retry_count = 0
+    while True:
+        try:
+            llm = VertexAI(model_name=model_name)
+            logger.info(f"Created LangChain VertexAI model: {model_name}")
+            return llm
+        except Exception as model_init_error:
+            retry_count += 1
+            if retry_count >= max_retries:
+                logger.error(f"Failed to initialize Vertex AI model after {max_retries} attempts: {str(model_init_error)}")
+                raise
+            logger.warning(f"Retry {retry_count}/{max_retries} initializing model: {str(model_init_error)}")
+            time.sleep(1)  # Short delay before retry
+
+
+def create_llm(model_name: str):
+    """
+    Build the model selected by LLM_BACKEND (vertex or fake).
+    The fake is configured by FAKE_LLM_LATENCY_MS, FAKE_LLM_LATENCY_SIGMA,
+    FAKE_LLM_MS_PER_TOKEN, FAKE_LLM_ERROR_RATE and FAKE_LLM_SEED.
+    """
+    backend = os.getenv("LLM_BACKEND", "vertex").lower()
+    if backend == "fake":
+        logger.info("Using the local fake LLM backend")
+        return FakeLLM(
+            latency_median_ms=float(os.getenv("FAKE_LLM_LATENCY_MS", "300")),
+            latency_sigma=float(os.getenv("FAKE_LLM_LATENCY_SIGMA", "0.5")),
+            ms_per_output_token=float(os.getenv("FAKE_LLM_MS_PER_TOKEN", "0")),
+            error_rate=float(os.getenv("FAKE_LLM_ERROR_RATE", "0")),
+            seed=int(os.getenv("FAKE_LLM_SEED", "0"))
+        )
+    if backend != "vertex":
+        raise ValueError(f"Unknown LLM_BACKEND: {backend}")
+    return create_vertex_llm(model_name)
@@ -0,0 +1,277 @@
+"""
+metrics.py - Per-stage latency histograms and counters, exposed in the
+Prometheus text format on /metrics.
+
+Request handling is split into stages (JSON parsing, the API limiter including
+the admission queue, keyboard-layout conversion, prompt formatting, each model
+attempt, retry backoff sleeps and response serialization) whose durations are
+recorded inline with time.perf_counter(); one observation costs a bisect
+and three additions under a lock (benchmarks/bench_metrics.py measures it). Counters that the components already keep for
+/health (cache hits, retries, queue outcomes) are read at scrape time instead
+of being counted twice.
+
+Metrics are kept per process: with several gunicorn workers each scrape sees
+the worker that served it.
+"""
+
+import bisect
+import itertools
+import os
+import threading
+from typing import Any, Dict, Iterable, List
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Stages of a request
+STAGE_PARSE = "parse"
+STAGE_LIMITER = "limiter"
+STAGE_CONVERT = "convert"
+STAGE_PROMPT = "prompt"
+STAGE_LLM = "llm"
+STAGE_RETRY_SLEEP = "retry_sleep"
+STAGE_RESPONSE = "response"
+STAGES = (STAGE_PARSE, STAGE_LIMITER, STAGE_CONVERT, STAGE_PROMPT, STAGE_LLM, STAGE_RETRY_SLEEP, STAGE_RESPONSE)
+
+# From 10µs (local work) to 30s (slow model calls and long backoffs)
+STAGE_SECONDS_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                         0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Counters updated inline: name -> (label name, help text)
+REJECTIONS = "keyfixer_rejections_total"
+FALLBACKS = "keyfixer_fallbacks_total"
+ANALYSIS_RESULTS = "keyfixer_analysis_results_total"
+LLM_ATTEMPTS = "keyfixer_llm_attempts_total"
+COUNTERS = {
+    REJECTIONS: ("status", "Requests rejected by the API limiter (429 rate limited, 503 busy)"),
+    FALLBACKS: ("operation", "Requests answered with the original text because the model failed"),
+    ANALYSIS_RESULTS: ("path", "Analysis results by path (local, cache, memo, llm, session, fallback)"),
+    LLM_ATTEMPTS: ("outcome", "Model call attempts by outcome"),
+}
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram with cumulative counts, like a Prometheus histogram
+    """
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self) -> List[int]:
+        return list(itertools.accumulate(self.counts))
+
+    def snapshot(self) -> Dict[str, Any]:
+        cumulative = self.cumulative()
+        buckets = {str(bound): total for bound, total in zip(self.buckets, cumulative)}
+        buckets['+Inf'] = cumulative[-1]
+        return {'buckets': buckets, 'count': self.count, 'sum': round(self.sum, 3)}
+
+
+class Metrics:
+    """
+    Process-wide stage histograms and labelled counters
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.stages = {stage: Histogram(STAGE_SECONDS_BUCKETS) for stage in STAGES}
+        self.counters: Dict[str, Dict[str, int]] = {name: {} for name in COUNTERS}
+
+    def observe_stage(self, stage: str, seconds: float) -> None:
+        """
+        Record the duration of a request stage (STAGE_*).
+        """
+        if self.enabled:
+            # Histogram.observe inlined, with the bucket search outside the lock: this is the hot path
+            histogram = self.stages[stage]
+            index = bisect.bisect_left(histogram.buckets, seconds)
+            with self.lock:
+                histogram.counts[index] += 1
+                histogram.count += 1
+                histogram.sum += seconds
+
+    def count(self, name: str, label: str, amount: int = 1) -> None:
+        """
+        Increment one of the COUNTERS for a label value.
+        """
+        if self.enabled:
+            with self.lock:
+                values = self.counters[name]
+                values[label] = values.get(label, 0) + amount
+
+    def count_analysis(self, path: str) -> None:
+        """
+        Count an analysis result by path; fallback results also count as fallbacks.
+        """
+        self.count(ANALYSIS_RESULTS, path)
+        if path == "fallback":
+            self.count(FALLBACKS, "analyze")
+
+    def observe_llm_attempt(self, rtt: float, success: bool) -> None:
+        """
+        RetryPolicy listener recording every model attempt.
+        """
+        self.observe_stage(STAGE_LLM, rtt)
+        self.count(LLM_ATTEMPTS, "success" if success else "error")
+
+    def render(self, limiter=None, analyzer=None) -> str:
+        """
+        Render all metrics in the Prometheus text exposition format, adding the
+        counters and gauges kept by the API limiter and the analyzer.
+        """
+        lines: List[str] = []
+        with self.lock:
+            _header(lines, "keyfixer_stage_seconds", "histogram", "Time spent in each stage of a request")
+            for stage, histogram in self.stages.items():
+                _histogram(lines, "keyfixer_stage_seconds", histogram, f'stage="{stage}"')
+            for name, (label, help_text) in COUNTERS.items():
+                _header(lines, name, "counter", help_text)
+                for value, total in sorted(self.counters[name].items()):
+                    lines.append(f'{name}{{{label}="{value}"}} {total}')
+
+        if limiter is not None:
+            _samples(lines, "gauge", [
+                ("keyfixer_active_calls", "API calls in progress", limiter.active_calls),
+                ("keyfixer_concurrency_limit", "Current limit on concurrent API calls", limiter.max_concurrent_calls),
+            ])
+            queue = limiter.queue.stats()
+            _samples(lines, "gauge", [("keyfixer_admission_queue_depth", "Requests waiting for a slot", queue['depth'])])
+            _samples(lines, "counter", [
+                (f"keyfixer_admission_queue_{key}_total", f"Admission queue: {key.replace('_', ' ')}", queue[key])
+                for key in ('enqueued', 'admitted', 'handed_off', 'timed_out', 'rejected_full', 'rejected_deadline')
+            ])
+            _header(lines, "keyfixer_admission_wait_milliseconds", "histogram", "Time spent waiting in the admission queue")
+            _histogram(lines, "keyfixer_admission_wait_milliseconds", limiter.queue.wait_histogram)
+
+        if analyzer is not None:
+            cache = analyzer.result_cache.stats()
+            retry = analyzer.retry_policy.stats()
+            # Flask requests go through the sync coalescer, asgi_app ones through the async one
+            coalesced = (analyzer.coalescer.stats()['coalesced_waiters']
+                         + analyzer.async_coalescer.stats()['coalesced_waiters'])
+            _samples(lines, "counter", [
+                ("keyfixer_cache_hits_total", "Result cache hits", cache['hits']),
+                ("keyfixer_cache_misses_total", "Result cache misses", cache['misses']),
+                ("keyfixer_llm_calls_total", "Logical model calls (before retries)", retry['calls']),
+                ("keyfixer_llm_retries_total", "Model call retries", retry['retries']),
+                ("keyfixer_retry_budget_exhausted_total", "Retries refused by the retry budget", retry['budget_exhausted']),
+                ("keyfixer_retry_deadline_exceeded_total", "Retries refused by the request deadline",
+                 retry['deadline_exceeded']),
+                ("keyfixer_circuit_short_circuited_total", "Calls refused by the open circuit breaker",
+                 retry['short_circuited']),
+                ("keyfixer_coalesced_requests_total", "Requests that shared an identical in-flight model call",
+                 coalesced),
+            ])
+            _samples(lines, "gauge", [("keyfixer_cache_entries", "Result cache entries", cache['entries'])])
+
+            routes = analyzer.router.stats()
+            _header(lines, "keyfixer_route_latency_seconds", "summary",
+                    "Model call latency per route: quantiles over its recent calls, sum and count over all "
+                    "successful calls")
+            for route, stats in routes.items():
+                for quantile in (50, 95, 99):
+                    if stats[f'p{quantile}_ms'] is not None:
+                        lines.append(f'keyfixer_route_latency_seconds{{route="{route}",quantile="{quantile / 100}"}} '
+                                     f"{round(stats[f'p{quantile}_ms'] / 1000, 6)}")
+                lines.append(f'keyfixer_route_latency_seconds_sum{{route="{route}"}} {stats["latency_sum_seconds"]}')
+                lines.append(f'keyfixer_route_latency_seconds_count{{route="{route}"}} {stats["latency_count"]}')
+            _header(lines, "keyfixer_route_errors_total", "counter", "Failed model calls per route")
+            for route, stats in routes.items():
+                lines.append(f'keyfixer_route_errors_total{{route="{route}"}} {stats["errors"]}')
+
+            prompts = [(f'prompt="{name}",version="{version}"', stats)
+                       for name, versions in analyzer.prompts.stats().items()
+                       for version, stats in versions.items()]
+            for name, key, help_text in (
+                    ("keyfixer_prompt_calls_total", "calls", "Model calls per prompt version"),
+                    ("keyfixer_prompt_failures_total", "failures", "Failed model calls per prompt version"),
+                    ("keyfixer_prompt_input_tokens_total", "input_tokens", "Estimated prompt tokens per prompt version"),
+                    ("keyfixer_prompt_output_tokens_total", "output_tokens",
+                     "Estimated response tokens per prompt version")):
+                _header(lines, name, "counter", help_text)
+                lines.extend(f"{name}{{{labels}}} {stats[key]}" for labels, stats in prompts)
+            _header(lines, "keyfixer_prompt_latency_seconds", "summary",
+                    "Model call latency per prompt version, including retries: quantiles over its recent "
+                    "calls, sum and count over all answered calls")
+            for labels, stats in prompts:
+                for quantile in (50, 95, 99):
+                    if stats[f'p{quantile}_ms'] is not None:
+                        lines.append(f'keyfixer_prompt_latency_seconds{{{labels},quantile="{quantile / 100}"}} '
+                                     f"{round(stats[f'p{quantile}_ms'] / 1000, 6)}")
+                lines.append(f"keyfixer_prompt_latency_seconds_sum{{{labels}}} {stats['latency_sum_seconds']}")
+                lines.append(f"keyfixer_prompt_latency_seconds_count{{{labels}}} {stats['calls'] - stats['failures']}")
+
+            if analyzer.word_memo is not None:
+                memo = analyzer.word_memo.stats()
+                _samples(lines, "counter", [
+                    ("keyfixer_word_memo_lookups_total", "Texts looked up in the word memo", memo['lookups']),
+                    ("keyfixer_word_memo_hits_total", "Texts whose every word the word memo covered", memo['hits']),
+                    ("keyfixer_word_memo_shadow_compared_total",
+                     "Shadow-mode memo answers compared with the model's", memo['shadow_compared']),
+                    ("keyfixer_word_memo_shadow_agreed_total",
+                     "Shadow-mode memo answers with the same words as the model's", memo['shadow_agreed']),
+                ])
+                _samples(lines, "gauge", [("keyfixer_word_memo_entries", "Word pairs in the word memo", memo['entries'])])
+
+            if analyzer.hedger is not None:
+                hedging = analyzer.hedger.stats()['operations']
+                for name, key, kind, help_text in (
+                        ("keyfixer_hedge_calls_total", "calls", "counter", "Model attempts eligible for hedging"),
+                        ("keyfixer_hedges_total", "hedged", "counter", "Hedged second requests sent"),
+                        ("keyfixer_hedge_wins_total", "hedge_wins", "counter",
+                         "Hedged requests that answered before the first one"),
+                        ("keyfixer_hedge_budget_denied_total", "budget_denied", "counter",
+                         "Hedges not sent because the hedge budget was exhausted"),
+                        ("keyfixer_hedge_pool_saturated_total", "pool_saturated", "counter",
+                         "Attempts run without hedging because every hedging worker was busy"),
+                        ("keyfixer_hedge_rate", "hedge_rate", "gauge", "Share of attempts that were hedged"),
+                        ("keyfixer_hedge_win_rate", "win_rate", "gauge", "Share of hedges that won")):
+                    _header(lines, name, kind, help_text)
+                    lines.extend(f'{name}{{operation="{operation}"}} {stats[key]}'
+                                 for operation, stats in hedging.items())
+                _header(lines, "keyfixer_hedge_threshold_seconds", "gauge", "Current hedging delay per operation")
+                lines.extend(f'keyfixer_hedge_threshold_seconds{{operation="{operation}"}} '
+                             f"{stats['threshold_ms'] / 1000}"
+                             for operation, stats in hedging.items() if stats['threshold_ms'] is not None)
+
+        return "\n".join(lines) + "\n"
+
+
+def _header(lines: List[str], name: str, kind: str, help_text: str) -> None:
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+
+
+def _histogram(lines: List[str], name: str, histogram: Histogram, labels: str = "") -> None:
+    prefix = f"{labels}," if labels else ""
+    for bound, total in zip(histogram.buckets + ("+Inf",), histogram.cumulative()):
+        lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {total}')
+    suffix = f"{{{labels}}}" if labels else ""
+    lines.append(f"{name}_sum{suffix} {histogram.sum}")
+    lines.append(f"{name}_count{suffix} {histogram.count}")
+
+
+def _samples(lines: List[str], kind: str, samples: Iterable) -> None:
+    for name, help_text, value in samples:
+        _header(lines, name, kind, help_text)
+        lines.append(f"{name} {value}")
+
+
+def create_metrics() -> Metrics:
+    """
+    Build the process-wide metrics; METRICS_ENABLED=false turns recording off.
+    """
+    return Metrics(enabled=os.getenv("METRICS_ENABLED", "true").lower() == "true")
+
+
+# Shared by the servers, the API limiter, the retry policy and the analyzer
+metrics = create_metrics()
@@ -0,0 +1,345 @@
+"""
+model_router.py - Routes each LLM request to a model of a named pool.
+
+A keystroke fix of a few characters and a multi-paragraph rephrase do not need
+the same model or the same output budget. The router holds a pool of model
+clients (MODEL_POOL, e.g. "fast=gemini-2.0-flash-lite,large=gemini-2.5-pro";
+"default" is MODEL_NAME) and an ordered list of routes matched on the
+operation (analyze, batch, translate, rephrase), the input length and its
+script mix (hebrew, english, mixed, none). The first matching route decides
+the model and the generation limits:
+    - an output-token cap derived from the estimated input tokens, so a short
+      correction cannot turn into a long generation
+    - stop sequences; single-line inputs can stop at the first blank line
+Each route keeps latency statistics of its recent calls for /health and
+/metrics, so the table can be tuned from data. MODEL_ROUTES_PATH points to a
+JSON list of routes replacing the built-in table.
+"""
+
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+from language_detector import ENGLISH_CHARS, HEBREW_CHARS
+
+logger = logging.getLogger(__name__)
+
+# Operations
+ANALYZE = "analyze"
+BATCH = "batch"
+TRANSLATE = "translate"
+REPHRASE = "rephrase"
+
+# Script mixes
+SCRIPT_HEBREW = "hebrew"
+SCRIPT_ENGLISH = "english"
+SCRIPT_MIXED = "mixed"
+SCRIPT_NONE = "none"
+
+DEFAULT_MODEL = "default"
+
+# Share of the minority script above which a text counts as mixed
+MIXED_SCRIPT_SHARE = 0.2
+
+_HEBREW_PATTERN = re.compile(f"[{HEBREW_CHARS}]")
+_ENGLISH_PATTERN = re.compile(f"[{ENGLISH_CHARS}]")
+
+
+def _tokens(length: int, hebrew: int) -> int:
+    # Roughly 4 characters per token for English and punctuation, 2 for Hebrew
+    return math.ceil((length - hebrew) / 4 + hebrew / 2)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of model tokens of a text.
+    """
+    return _tokens(len(text), len(_HEBREW_PATTERN.findall(text)))
+
+
+def analyze_text_shape(text: str):
+    """
+    Estimate the token count and the script mix of a text.
+
+    Returns:
+        Tuple of (estimated tokens, SCRIPT_*)
+    """
+    hebrew = len(_HEBREW_PATTERN.findall(text))
+    english = len(_ENGLISH_PATTERN.findall(text))
+    tokens = _tokens(len(text), hebrew)
+
+    letters = hebrew + english
+    if not letters:
+        script = SCRIPT_NONE
+    elif min(hebrew, english) >= MIXED_SCRIPT_SHARE * letters:
+        script = SCRIPT_MIXED
+    else:
+        script = SCRIPT_HEBREW if hebrew > english else SCRIPT_ENGLISH
+    return tokens, script
+
+
+class RouteStats:
+    """
+    Call counts and a window of recent latencies of one route
+    """
+
+    def __init__(self, window: int = 1000):
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=window)
+        self.calls = 0
+        self.errors = 0
+        self.output_token_caps = 0
+        # Count and total latency of the successful calls, for the Prometheus summary
+        self.latency_count = 0
+        self.latency_sum = 0.0
+
+    def record(self, latency: float, success: bool, output_token_cap: int) -> None:
+        with self.lock:
+            self.calls += 1
+            self.output_token_caps += output_token_cap
+            if success:
+                self.latencies.append(latency)
+                self.latency_count += 1
+                self.latency_sum += latency
+            else:
+                self.errors += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            latencies = sorted(self.latencies)
+            calls, errors, caps = self.calls, self.errors, self.output_token_caps
+            latency_count, latency_sum = self.latency_count, self.latency_sum
+
+        def percentile(pct):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * pct / 100))] * 1000, 1)
+
+        return {
+            'calls': calls,
+            'errors': errors,
+            'p50_ms': percentile(50),
+            'p95_ms': percentile(95),
+            'p99_ms': percentile(99),
+            'latency_count': latency_count,
+            'latency_sum_seconds': round(latency_sum, 6),
+            'mean_output_token_cap': round(caps / calls, 1) if calls else None
+        }
+
+
+class Route:
+    """
+    One row of the routing table: what it matches and how the model is called
+    """
+
+    def __init__(self, name: str, model: str = DEFAULT_MODEL, operations: Optional[List[str]] = None,
+                 min_chars: int = 0, max_chars: Optional[int] = None, scripts: Optional[List[str]] = None,
+                 base_output_tokens: int = 64, output_tokens_per_input_token: float = 2.0,
+                 max_output_tokens: int = 2048, stop: Optional[List[str]] = None,
+                 single_line_stop: bool = False):
+        self.name = name
+        # Name of the model in the pool
+        self.model = model
+        # Matching: None matches anything
+        self.operations = set(operations) if operations else None
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.scripts = set(scripts) if scripts else None
+        # Output-token cap: base + ratio * estimated input tokens, at most max_output_tokens
+        self.base_output_tokens = base_output_tokens
+        self.output_tokens_per_input_token = output_tokens_per_input_token
+        self.max_output_tokens = max_output_tokens
+        self.stop = list(stop or [])
+        # Stop at the first blank line when the input is a single line
+        self.single_line_stop = single_line_stop
+        self.stats = RouteStats()
+
+    def matches(self, operation: str, length: int, script: str) -> bool:
+        return ((self.operations is None or operation in self.operations)
+                and length >= self.min_chars
+                and (self.max_chars is None or length <= self.max_chars)
+                and (self.scripts is None or script in self.scripts))
+
+    def output_token_cap(self, input_tokens: int) -> int:
+        cap = self.base_output_tokens + math.ceil(self.output_tokens_per_input_token * input_tokens)
+        return min(self.max_output_tokens, cap)
+
+    def stop_sequences(self, text: str) -> List[str]:
+        if self.single_line_stop and "\n" not in text:
+            return self.stop + ["\n\n"]
+        return self.stop
+
+
+class RoutedModel:
+    """
+    A pool model bound to the limits a route chose for one input; records the
+    latency of every call in the route's statistics
+    """
+
+    __slots__ = ('route', 'llm', 'model_name', 'kwargs')
+
+    def __init__(self, route: Route, llm, model_name: str, stop: List[str], max_output_tokens: int):
+        self.route = route
+        self.llm = llm
+        self.model_name = model_name
+        self.kwargs = {'max_output_tokens': max_output_tokens}
+        if stop:
+            self.kwargs['stop'] = stop
+
+    def _record(self, started: float, success: bool) -> None:
+        self.route.stats.record(time.monotonic() - started, success, self.kwargs['max_output_tokens'])
+
+    def invoke(self, prompt: str) -> str:
+        started = time.monotonic()
+        try:
+            response = self.llm.invoke(prompt, **self.kwargs)
+        except Exception:
+            self._record(started, False)
+            raise
+        self._record(started, True)
+        return response
+
+    async def ainvoke(self, prompt: str) -> str:
+        started = time.monotonic()
+        try:
+            response = await self.llm.ainvoke(prompt, **self.kwargs)
+        except Exception:
+            self._record(started, False)
+            raise
+        self._record(started, True)
+        return response
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        started = time.monotonic()
+        try:
+            yield from self.llm.stream(prompt, **self.kwargs)
+        except Exception:
+            self._record(started, False)
+            raise
+        self._record(started, True)
+
+    async def astream(self, prompt: str) -> AsyncIterator[str]:
+        started = time.monotonic()
+        try:
+            async for chunk in self.llm.astream(prompt, **self.kwargs):
+                yield chunk
+        except Exception:
+            self._record(started, False)
+            raise
+        self._record(started, True)
+
+
+class ModelRouter:
+    """
+    Chooses a pool model and generation limits for each request
+    """
+
+    def __init__(self, models: Dict[str, Any], model_names: Dict[str, str], routes: List[Route]):
+        if DEFAULT_MODEL not in models:
+            raise ValueError(f"Model pool has no '{DEFAULT_MODEL}' model")
+        # Pool name -> model client, and pool name -> model name (for cache keys and stats)
+        self.models = models
+        self.model_names = model_names
+        self.routes = routes
+        for route in routes:
+            if route.model not in models:
+                logger.warning(f"Route {route.name} uses unknown model '{route.model}', using '{DEFAULT_MODEL}'")
+                route.model = DEFAULT_MODEL
+        # Used when no route matches
+        self.fallback_route = Route("default")
+
+    @property
+    def default_llm(self):
+        return self.models[DEFAULT_MODEL]
+
+    def select(self, operation: str, text: str) -> RoutedModel:
+        """
+        Pick the first route matching the operation, length and script mix of text.
+        """
+        tokens, script = analyze_text_shape(text)
+        route = next((route for route in self.routes if route.matches(operation, len(text), script)),
+                     self.fallback_route)
+        return RoutedModel(route, self.models[route.model], self.model_names[route.model],
+                           route.stop_sequences(text), route.output_token_cap(tokens))
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return per-route statistics for the health endpoint.
+        """
+        return {
+            route.name: dict(model=self.model_names[route.model], **route.stats.snapshot())
+            for route in self.routes + [self.fallback_route]
+        }
+
+
+def default_routes() -> List[Route]:
+    """
+    Built-in routing table; routes whose model is not in the pool use the default model.
+    """
+    return [
+        # Keystroke fixes: short single-script input, answer is "CORRECTED: " plus the same text
+        Route("analyze-short", model="fast", operations=[ANALYZE], max_chars=64,
+              scripts=[SCRIPT_HEBREW, SCRIPT_ENGLISH], base_output_tokens=16,
+              output_tokens_per_input_token=1.5, max_output_tokens=256, single_line_stop=True),
+        Route("analyze", operations=[ANALYZE], base_output_tokens=16, output_tokens_per_input_token=1.5,
+              max_output_tokens=1024, single_line_stop=True),
+        # The batch ITEMS section holds both versions of every sentence; one answer line per item
+        Route("batch", operations=[BATCH], base_output_tokens=32, output_tokens_per_input_token=1.0,
+              max_output_tokens=8192),
+        Route("translate", operations=[TRANSLATE], base_output_tokens=32, output_tokens_per_input_token=2.5,
+              max_output_tokens=4096, single_line_stop=True),
+        # Rephrasing expands the input into a full prompt
+        Route("rephrase-long", model="large", operations=[REPHRASE], min_chars=400, base_output_tokens=256,
+              output_tokens_per_input_token=4.0, max_output_tokens=4096),
+        Route("rephrase", operations=[REPHRASE], base_output_tokens=256, output_tokens_per_input_token=4.0,
+              max_output_tokens=2048),
+    ]
+
+
+def load_routes(path: str) -> List[Route]:
+    """
+    Load a routing table from a JSON list of Route keyword arguments.
+    """
+    with open(path, encoding="utf-8") as routes_file:
+        specs = json.load(routes_file)
+    try:
+        return [Route(**spec) for spec in specs]
+    except TypeError as e:
+        raise ValueError(f"Invalid route in {path}: {str(e)}")
+
+
+def parse_model_pool(spec: str, default_model_name: str) -> Dict[str, str]:
+    """
+    Parse MODEL_POOL ("fast=model-a,large=model-b") into pool name -> model name.
+    """
+    pool = {DEFAULT_MODEL: default_model_name}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, model_name = entry.partition("=")
+        if not model_name:
+            raise ValueError(f"Invalid MODEL_POOL entry: {entry}")
+        pool[name.strip()] = model_name.strip()
+    return pool
+
+
+def create_model_router(default_model_name: str, create_llm: Callable[[str], Any]) -> ModelRouter:
+    """
+    Build the router from MODEL_POOL and MODEL_ROUTES_PATH; one client is created per distinct model name.
+    """
+    model_names = parse_model_pool(os.getenv("MODEL_POOL", ""), default_model_name)
+    clients: Dict[str, Any] = {}
+    models = {}
+    for name, model_name in model_names.items():
+        if model_name not in clients:
+            clients[model_name] = create_llm(model_name)
+        models[name] = clients[model_name]
+
+    routes_path = os.getenv("MODEL_ROUTES_PATH")
+    routes = load_routes(routes_path) if routes_path else default_routes()
+    logger.info(f"Model router: {len(routes)} routes over models {sorted(set(model_names.values()))}")
+    return ModelRouter(models, model_names, routes)
@@ -0,0 +1,389 @@
+"""
+prompt_registry.py - Compiled, versioned prompts with per-prompt token accounting.
+
+Every prompt the analyzer sends is registered under its operation (analyze,
+batch, translate, rephrase) and a version. Templates are compiled once at
+startup: the source indentation and trailing spaces are stripped, runs of
+spaces collapsed and blank lines squeezed, so no request formats or sends
+layout whitespace. The placeholders are checked against the prompt's first
+version and the tokens of the fixed text are counted once; formatting a
+prompt is a single str.format_map call plus a token estimate of the values.
+
+Several versions of a prompt can serve side by side for an A/B comparison.
+PROMPT_VARIANTS weighs them, e.g. "analyze.v1=50,analyze.v2=50"; versions
+of a listed prompt that are not listed get no traffic, and prompts not
+listed use v1 only. The version is chosen from a hash of the input, so a
+text always gets the same prompt and cached results stay consistent. Each
+version counts its calls, failures, estimated input and output tokens and
+keeps a latency window for /health and /metrics. PROMPTS_PATH points to a
+JSON list of additional versions ({"name", "version", "template"}).
+
+A version must keep the answer format of its prompt: responses are parsed
+the same way whichever version produced them (CORRECTED: extraction, one
+"[n] CORRECTED:" line per batch item).
+"""
+
+import bisect
+import json
+import logging
+import os
+import string
+import threading
+import zlib
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from model_router import ANALYZE, BATCH, REPHRASE, TRANSLATE, estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VERSION = "v1"
+
+
+def normalize_whitespace(template: str) -> str:
+    """
+    Strip the layout whitespace of a template: surrounding blank lines, the
+    indentation and trailing spaces of every line, runs of spaces inside a
+    line and runs of blank lines.
+    """
+    lines: List[str] = []
+    for line in template.strip().splitlines():
+        line = " ".join(line.split())
+        if line or lines[-1]:
+            lines.append(line)
+    return "\n".join(lines)
+
+
+class PromptStats:
+    """
+    Call counts, token totals and a window of recent latencies of one prompt version
+    """
+
+    def __init__(self, window: int = 1000):
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=window)
+        self.calls = 0
+        self.failures = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        # Total latency of the answered calls, for the Prometheus summary's _sum
+        self.latency_sum = 0.0
+
+    def record(self, latency: float, input_tokens: int, output_tokens: Optional[int]) -> None:
+        with self.lock:
+            self.calls += 1
+            self.input_tokens += input_tokens
+            if output_tokens is None:
+                self.failures += 1
+            else:
+                self.output_tokens += output_tokens
+                self.latencies.append(latency)
+                self.latency_sum += latency
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            latencies = sorted(self.latencies)
+            calls, failures = self.calls, self.failures
+            input_tokens, output_tokens = self.input_tokens, self.output_tokens
+            latency_sum = self.latency_sum
+
+        def percentile(pct):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * pct / 100))] * 1000, 1)
+
+        answered = calls - failures
+        return {
+            'calls': calls,
+            'failures': failures,
+            'input_tokens': input_tokens,
+            'output_tokens': output_tokens,
+            'mean_input_tokens': round(input_tokens / calls, 1) if calls else None,
+            'mean_output_tokens': round(output_tokens / answered, 1) if answered else None,
+            'p50_ms': percentile(50),
+            'p95_ms': percentile(95),
+            'p99_ms': percentile(99),
+            'latency_sum_seconds': round(latency_sum, 6)
+        }
+
+
+class PromptVersion:
+    """
+    One compiled version of a prompt
+    """
+
+    def __init__(self, name: str, version: str, template: str, weight: int = 0):
+        self.name = name
+        self.version = version
+        self.template = normalize_whitespace(template)
+        parsed = list(string.Formatter().parse(self.template))
+        self.fields = tuple(dict.fromkeys(field for _, field, _, _ in parsed if field is not None))
+        if "" in self.fields or any(not field.isidentifier() for field in self.fields):
+            raise ValueError(f"Prompt {name}.{version} has positional or indexed placeholders")
+        # Tokens of the fixed text, counted once; each render adds the tokens of its values
+        self.template_tokens = estimate_tokens("".join(literal for literal, _, _, _ in parsed))
+        # Share of the prompt's traffic, relative to the weights of its other versions
+        self.weight = weight
+        self.stats = PromptStats()
+
+    def render(self, values: Dict[str, str]) -> "RenderedPrompt":
+        text = self.template.format_map(values)
+        input_tokens = self.template_tokens + sum(estimate_tokens(values[field]) for field in self.fields)
+        return RenderedPrompt(text, self, input_tokens)
+
+
+class RenderedPrompt(str):
+    """
+    A formatted prompt that remembers the version it came from, so the model
+    call made with it can be accounted to that version
+    """
+
+    def __new__(cls, text: str, version: PromptVersion, input_tokens: int):
+        prompt = super().__new__(cls, text)
+        prompt.version = version
+        prompt.input_tokens = input_tokens
+        return prompt
+
+    def record(self, latency: float, response: Optional[str]) -> None:
+        """
+        Account one model call made with this prompt; response is None when the call failed.
+        """
+        output_tokens = estimate_tokens(response) if response is not None else None
+        self.version.stats.record(latency, self.input_tokens, output_tokens)
+
+
+class PromptRegistry:
+    """
+    The versions of every prompt and the weighted choice between them
+    """
+
+    def __init__(self, versions: List[PromptVersion]):
+        self.prompts: Dict[str, Dict[str, PromptVersion]] = {}
+        # Prompt name -> (cumulative weights, versions with traffic)
+        self._active: Dict[str, Any] = {}
+        for version in versions:
+            self.add(version)
+
+    def add(self, version: PromptVersion) -> None:
+        """
+        Register a version, replacing an existing one with the same name and version.
+        """
+        versions = self.prompts.setdefault(version.name, {})
+        first = next(iter(versions.values()), None)
+        if first is not None and first.version != version.version and set(first.fields) != set(version.fields):
+            raise ValueError(f"Prompt {version.name}.{version.version} has placeholders {sorted(version.fields)}, "
+                             f"expected {sorted(first.fields)}")
+        versions[version.version] = version
+        self._activate(version.name)
+
+    def set_weights(self, weights: Dict[str, Dict[str, int]]) -> None:
+        """
+        Set the traffic weights of the versions of the given prompts; versions
+        of these prompts missing from weights get no traffic.
+        """
+        for name, version_weights in weights.items():
+            versions = self.prompts.get(name)
+            if versions is None:
+                raise ValueError(f"Unknown prompt: {name}")
+            unknown = set(version_weights) - set(versions)
+            if unknown:
+                raise ValueError(f"Unknown versions of prompt {name}: {sorted(unknown)}")
+            for version in versions.values():
+                version.weight = version_weights.get(version.version, 0)
+            self._activate(name)
+            logger.info(f"Prompt {name} versions: " + ", ".join(
+                f"{version.version}={version.weight}" for version in versions.values()))
+
+    def _activate(self, name: str) -> None:
+        active = [version for version in self.prompts[name].values() if version.weight > 0]
+        if not active:
+            raise ValueError(f"Prompt {name} has no version with traffic")
+        cumulative = []
+        total = 0
+        for version in active:
+            total += version.weight
+            cumulative.append(total)
+        self._active[name] = (cumulative, active)
+
+    def select(self, name: str, key: str) -> PromptVersion:
+        """
+        Choose the version of a prompt for an input; the same key always gets the same version.
+        """
+        cumulative, active = self._active[name]
+        if len(active) == 1:
+            return active[0]
+        bucket = zlib.crc32(key.encode("utf-8", "surrogatepass")) % cumulative[-1]
+        return active[bisect.bisect_right(cumulative, bucket)]
+
+    def render(self, name: str, key: str, **values: str) -> RenderedPrompt:
+        """
+        Format the version of a prompt chosen for key.
+
+        Args:
+            name: Prompt name (the operation)
+            key: Input the version is chosen from, normally the user text
+            values: Placeholder values
+
+        Returns:
+            The prompt text, accounted to its version when the model call is recorded
+        """
+        return self.select(name, key).render(values)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return per-version statistics for the health endpoint.
+        """
+        return {
+            name: {
+                version.version: dict(weight=version.weight, **version.stats.snapshot())
+                for version in versions.values()
+            }
+            for name, versions in self.prompts.items()
+        }
+
+
+def default_prompts() -> List[PromptVersion]:
+    """
+    Built-in prompts; every v1 takes all traffic until PROMPT_VARIANTS says otherwise.
+    """
+    return [
+        PromptVersion(ANALYZE, DEFAULT_VERSION, weight=100, template="""
+            You are a strict language assistant.
+            You receive two versions of a sentence:
+
+            Sentence 1: {original_text}
+            Sentence 2: {converted_text}
+
+            Important notes:
+            - One of them was typed in the wrong keyboard layout and was already converted.
+            - You do NOT need to detect or fix keyboard layout issues – they are already handled.
+
+            Your task:
+            1. Choose the sentence that is more correct and meaningful in **its own original language** (Hebrew or English).
+            2. Correct only **spelling and grammar** mistakes in that sentence, without changing the language.
+            3. Do **not** translate between Hebrew and English.
+            4. Do **not** change the sentence structure or improve the writing.
+            5. Do **not** guess or invent meaning.
+            6. Do **not** add, remove, merge, or split any words.
+            7. For any word that is clearly incorrect or in the wrong language/layout in the chosen sentence, and cannot be corrected directly – copy the word from the same position in the other sentence and use it as-is. Replace only that word, without changing sentence structure or meaning.
+
+            Return your response in the following format:
+            CORRECTED: [the corrected version of the preferred sentence, without spelling mistakes]
+            """),
+        # Same rules in about half the tokens
+        PromptVersion(ANALYZE, "v2", template="""
+            Two versions of one sentence; one was typed in the wrong keyboard layout and is already converted.
+            Sentence 1: {original_text}
+            Sentence 2: {converted_text}
+
+            Pick the version that is correct and meaningful in its own language (Hebrew or English) and fix only its spelling and grammar.
+            Do not translate, restructure, improve, guess, or add, remove, merge or split words.
+            A word that cannot be fixed is replaced by the word at the same position in the other version.
+
+            Answer in exactly this format:
+            CORRECTED: [the corrected sentence]
+            """),
+        PromptVersion(BATCH, DEFAULT_VERSION, weight=100, template="""
+            You are a strict language assistant.
+            You receive numbered items. Each item has two versions of a sentence:
+            Sentence 1 and Sentence 2.
+
+            Important notes:
+            - In each item, one of them was typed in the wrong keyboard layout and was already converted.
+            - You do NOT need to detect or fix keyboard layout issues – they are already handled.
+
+            Your task, for every item independently:
+            1. Choose the sentence that is more correct and meaningful in **its own original language** (Hebrew or English).
+            2. Correct only **spelling and grammar** mistakes in that sentence, without changing the language.
+            3. Do **not** translate between Hebrew and English.
+            4. Do **not** change the sentence structure or improve the writing.
+            5. Do **not** guess or invent meaning.
+            6. Do **not** add, remove, merge, or split any words.
+            7. For any word that is clearly incorrect or in the wrong language/layout in the chosen sentence, and cannot be corrected directly – copy the word from the same position in the other sentence and use it as-is. Replace only that word, without changing sentence structure or meaning.
+
+            ITEMS:
+            {items}
+
+            Return exactly one line per item, in the same order, in the following format:
+            [item number] CORRECTED: [the corrected version of the preferred sentence, without spelling mistakes]
+            """),
+        PromptVersion(TRANSLATE, DEFAULT_VERSION, weight=100, template="""
+            ROLE: You are a strict, rule-based translation engine.
+
+            TASK: Correct spelling, grammar and punctuation errors in the input text, then translate the corrected text from {source_language} to {target_language}.
+
+            RESTRICTIONS:
+            1. DO NOT add comments, explanations or metadata.
+            2. DO NOT repeat the input text in its original language.
+            3. DO NOT identify the language.
+            4. DO NOT include labels, titles or surrounding text.
+            5. DO NOT expand, omit or alter content beyond minimal corrections.
+            6. Preserve meaning, tone and all original formatting (bold, italics, lists, inline code).
+            7. Output plain text only – no markdown, quotes or code fences.
+
+            OUTPUT: The corrected and translated text only.
+
+            INPUT TEXT:
+            {text}
+            """),
+        PromptVersion(REPHRASE, DEFAULT_VERSION, weight=100, template="""
+            You are “PromptRefiner”, a senior cross-LLM prompt engineer.
+            USER INPUT (original prompt to improve):
+
+            \"\"\"{text}\"\"\"
+
+            OBJECTIVE:
+            Rewrite the user input so that GPT-4-class or Claude-3-class models produce the most accurate, complete, and context-aware answer.
+
+            INSTRUCTIONS
+            Keep the rewritten prompt in the exact same language used in the original text.
+
+            1. Preserve the original intent, but clarify goals, desired depth, and target audience.
+            2. Add any missing context or constraints that help the target model:
+               - tone, answer format, length limit, domain perspective, examples, step-by-step reasoning, citation style, verification requests.
+            3. Eliminate ambiguity, filler, and duplicate ideas; keep language formal and professional unless instructed otherwise.
+            4. Do not mention these guidelines, your role, or any meta-text in the final result.
+            5. Output only the improved prompt, plain text, no labels, no commentary, no code fencing.
+
+            END OF INSTRUCTIONS
+            """),
+    ]
+
+
+def load_prompts(path: str) -> List[PromptVersion]:
+    """
+    Load additional prompt versions from a JSON list of PromptVersion keyword arguments.
+    """
+    with open(path, encoding="utf-8") as prompts_file:
+        specs = json.load(prompts_file)
+    try:
+        return [PromptVersion(**spec) for spec in specs]
+    except TypeError as e:
+        raise ValueError(f"Invalid prompt in {path}: {str(e)}")
+
+
+def parse_prompt_variants(spec: str) -> Dict[str, Dict[str, int]]:
+    """
+    Parse PROMPT_VARIANTS ("analyze.v1=50,analyze.v2=50") into prompt -> version -> weight.
+    """
+    weights: Dict[str, Dict[str, int]] = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        key, _, weight = entry.partition("=")
+        name, _, version = key.strip().partition(".")
+        if not version or not weight.strip().isdigit():
+            raise ValueError(f"Invalid PROMPT_VARIANTS entry: {entry}")
+        weights.setdefault(name, {})[version] = int(weight)
+    return weights
+
+
+def create_prompt_registry() -> PromptRegistry:
+    """
+    Build the registry from the built-in prompts, PROMPTS_PATH and PROMPT_VARIANTS.
+    """
+    registry = PromptRegistry(default_prompts())
+    prompts_path = os.getenv("PROMPTS_PATH")
+    if prompts_path:
+        for version in load_prompts(prompts_path):
+            registry.add(version)
+    registry.set_weights(parse_prompt_variants(os.getenv("PROMPT_VARIANTS", "")))
+    return registry
@@ -0,0 +1,147 @@
+"""
+request_coalescer.py - Single-flight deduplication of concurrent identical calls,
+for threads (RequestCoalescer) and asyncio tasks (AsyncRequestCoalescer).
+"""
+
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class _Call:
+    """
+    A call in flight that other callers can wait on
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class RequestCoalescer:
+    """
+    Runs one call per key at a time; concurrent callers with the same key
+    wait for the leader and receive its result (or its exception)
+    """
+
+    def __init__(self):
+        # Calls currently in flight by key
+        self._calls: Dict[Hashable, _Call] = {}
+        # Lock for thread-safe operations
+        self.lock = threading.Lock()
+        # Counters
+        self.leaders = 0
+        self.coalesced = 0
+        self.max_waiters = 0
+
+    def run(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        """
+        Execute func for the key, or wait for the identical call already in flight.
+
+        Args:
+            key: Identity of the call (e.g. the result cache key)
+            func: Zero-argument callable performing the actual work
+
+        Returns:
+            The result of func, shared by every caller of the same flight
+        """
+        with self.lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.coalesced += 1
+                self.max_waiters = max(self.max_waiters, call.waiters)
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Return coalescing counters for the health endpoint.
+        """
+        with self.lock:
+            return {
+                'in_flight': len(self._calls),
+                'leaders': self.leaders,
+                'coalesced_waiters': self.coalesced,
+                'max_waiters': self.max_waiters
+            }
+
+
+class AsyncRequestCoalescer:
+    """
+    asyncio version of RequestCoalescer: concurrent coroutines with the same key
+    await the leader's result instead of starting their own call
+    """
+
+    def __init__(self):
+        # Futures of calls currently in flight by key
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        # Counters
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def run(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Await func() for the key, or the identical call already in flight.
+
+        Args:
+            key: Identity of the call (e.g. the result cache key)
+            func: Zero-argument callable returning the coroutine doing the work
+
+        Returns:
+            The result of the call, shared by every caller of the same flight
+        """
+        future = self._calls.get(key)
+        if future is not None:
+            self.coalesced += 1
+            # Shield so a cancelled waiter does not cancel the leader's call
+            return await asyncio.shield(future)
+
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        self.leaders += 1
+        try:
+            result = await func()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            del self._calls[key]
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Return coalescing counters for the health endpoint.
+        """
+        return {
+            'in_flight': len(self._calls),
+            'leaders': self.leaders,
+            'coalesced_waiters': self.coalesced
+        }
@@ -0,0 +1,358 @@
+"""
+result_cache.py - Bounded LRU + TTL cache for LLM results, with an optional
+SQLite backend shared by every worker process on the node.
+"""
+
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(operation: str, model_name: str, text: str,
+                   prompt_version: Optional[str] = None) -> Tuple[str, str, str]:
+    """
+    Build a cache key from the operation, model and normalized input text.
+
+    Surrounding whitespace is ignored because every LLM result is stripped anyway.
+    The prompt version, when given, is part of the operation ("analyze.v2"), so each
+    version of an A/B-tested prompt serves only its own answers.
+    """
+    if prompt_version:
+        operation = f"{operation}.{prompt_version}"
+    return operation, model_name, unicodedata.normalize("NFC", text).strip()
+
+
+class ResultCache:
+    """
+    Thread-safe in-memory cache bounded by entry count, total bytes and entry age
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=16 * 1024 * 1024, ttl_seconds=3600, backend=None):
+        # Optional persistent backend consulted on misses and written through on set
+        self.backend = backend
+        # Limits
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        # key -> (expires_at, size, value), least recently used first
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        # Lock for thread-safe operations
+        self.lock = threading.Lock()
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def _entry_size(key: Tuple[str, str, str], value: str) -> int:
+        return sum(len(part.encode("utf-8")) for part in key) + len(value.encode("utf-8"))
+
+    def get(self, key: Tuple[str, str, str]) -> Optional[str]:
+        """
+        Return the cached value for a key, or None on a miss.
+        """
+        with self.lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, size, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+
+                del self._entries[key]
+                self._total_bytes -= size
+                self.expirations += 1
+
+            if self.backend is None:
+                self.misses += 1
+                return None
+
+        value = self.backend.get(key)
+        with self.lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        self._store(key, value)
+        return value
+
+    def set(self, key: Tuple[str, str, str], value: str) -> None:
+        """
+        Store a value, evicting least recently used entries to stay within the limits.
+        """
+        self._store(key, value)
+        if self.backend is not None:
+            self.backend.set(key, value)
+
+    def _store(self, key: Tuple[str, str, str], value: str) -> None:
+        size = self._entry_size(key, value)
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._total_bytes -= previous[1]
+
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, size, value)
+            self._total_bytes += size
+
+            while len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self.lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return cache counters for the health endpoint.
+        """
+        with self.lock:
+            stats = {
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+        if self.backend is not None:
+            stats['persistent'] = self.backend.stats()
+        return stats
+
+
+class SQLiteResultStore:
+    """
+    Persistent cache backend in a SQLite database in WAL mode.
+
+    WAL lets every gunicorn worker on the node read concurrently while one writes,
+    so a result computed by any worker is reused by all of them and survives restarts.
+    """
+
+    # Run size-based compaction after this many writes from this process
+    COMPACT_EVERY = 200
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024, ttl_seconds=24 * 3600):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        # One connection per thread; sqlite3 connections must not be shared
+        self._local = threading.local()
+        self.lock = threading.Lock()
+        self.writes_since_compaction = 0
+        self.compactions = 0
+        self.errors = 0
+
+        connection = self._connection()
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                operation TEXT NOT NULL,
+                model_name TEXT NOT NULL,
+                input_text TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                stored_at REAL NOT NULL,
+                PRIMARY KEY (operation, model_name, input_text)
+            )
+        """)
+        connection.execute("CREATE INDEX IF NOT EXISTS results_stored_at ON results (stored_at)")
+        connection.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5.0)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key: Tuple[str, str, str]) -> Optional[str]:
+        """
+        Return the stored value for a key, or None when missing, expired or on error.
+        """
+        try:
+            row = self._connection().execute(
+                "SELECT value FROM results WHERE operation = ? AND model_name = ? AND input_text = ? AND stored_at > ?",
+                (*key, time.time() - self.ttl_seconds)
+            ).fetchone()
+            return row[0] if row else None
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning(f"Persistent cache read failed: {str(e)}")
+            return None
+
+    def set(self, key: Tuple[str, str, str], value: str) -> None:
+        """
+        Store a value; compaction runs periodically to keep the database within max_bytes.
+        """
+        size = ResultCache._entry_size(key, value)
+        try:
+            connection = self._connection()
+            connection.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                (*key, value, size, time.time())
+            )
+            connection.commit()
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning(f"Persistent cache write failed: {str(e)}")
+            return
+
+        with self.lock:
+            self.writes_since_compaction += 1
+            compact = self.writes_since_compaction >= self.COMPACT_EVERY
+            if compact:
+                self.writes_since_compaction = 0
+        if compact:
+            self.compact()
+
+    def compact(self) -> None:
+        """
+        Drop expired rows, then the oldest rows until the stored bytes are under 90% of max_bytes.
+        """
+        try:
+            connection = self._connection()
+            connection.execute("DELETE FROM results WHERE stored_at <= ?", (time.time() - self.ttl_seconds,))
+            total_bytes = connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+            if total_bytes > self.max_bytes:
+                excess = total_bytes - int(self.max_bytes * 0.9)
+                cutoff = connection.execute("""
+                    SELECT stored_at FROM (
+                        SELECT stored_at, SUM(size) OVER (ORDER BY stored_at) AS running
+                        FROM results
+                    ) WHERE running >= ? ORDER BY stored_at LIMIT 1
+                """, (excess,)).fetchone()
+                if cutoff:
+                    connection.execute("DELETE FROM results WHERE stored_at <= ?", cutoff)
+            connection.commit()
+            connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self.compactions += 1
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning(f"Persistent cache compaction failed: {str(e)}")
+
+    def load_snapshot(self, path: str) -> int:
+        """
+        Warm the store from a JSONL snapshot of {operation, model_name, input_text, value} records.
+        Existing rows are kept.
+
+        Returns:
+            Number of records read from the snapshot
+        """
+        now = time.time()
+        rows = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                key = make_cache_key(record["operation"], record["model_name"], record["input_text"])
+                rows.append((*key, record["value"], ResultCache._entry_size(key, record["value"]), now))
+
+        connection = self._connection()
+        connection.executemany("INSERT OR IGNORE INTO results VALUES (?, ?, ?, ?, ?, ?)", rows)
+        connection.commit()
+        return len(rows)
+
+    def save_snapshot(self, path: str) -> int:
+        """
+        Write every live row to a JSONL snapshot file.
+
+        Returns:
+            Number of records written
+        """
+        count = 0
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for operation, model_name, input_text, value in self._connection().execute(
+                "SELECT operation, model_name, input_text, value FROM results WHERE stored_at > ?",
+                (time.time() - self.ttl_seconds,)
+            ):
+                f.write(json.dumps({
+                    "operation": operation,
+                    "model_name": model_name,
+                    "input_text": input_text,
+                    "value": value
+                }, ensure_ascii=False) + "\n")
+                count += 1
+        os.replace(tmp_path, path)
+        return count
+
+    def stats(self) -> Dict[str, int]:
+        try:
+            entries, total_bytes = self._connection().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results"
+            ).fetchone()
+        except sqlite3.Error:
+            entries, total_bytes = -1, -1
+        return {
+            'entries': entries,
+            'bytes': total_bytes,
+            'compactions': self.compactions,
+            'errors': self.errors
+        }
+
+
+def _save_snapshot_on_exit(backend: SQLiteResultStore, path: str) -> None:
+    """
+    Write the persistent store to its snapshot when the process exits; errors are only logged.
+    """
+    try:
+        saved = backend.save_snapshot(path)
+        logger.info(f"Saved {saved} persistent result cache records to snapshot")
+    except Exception as e:
+        logger.error(f"Persistent result cache snapshot failed: {str(e)}")
+
+
+def create_result_cache() -> ResultCache:
+    """
+    Build the analyzer's result cache from environment variables.
+
+    RESULT_CACHE_DB_PATH enables the persistent SQLite backend and
+    RESULT_CACHE_SNAPSHOT_PATH warms it at startup; with
+    RESULT_CACHE_SNAPSHOT_ON_EXIT=true the snapshot is also rewritten when the
+    process exits, so it carries over to a node with a fresh database.
+    """
+    backend = None
+    db_path = os.getenv("RESULT_CACHE_DB_PATH")
+    if db_path:
+        try:
+            backend = SQLiteResultStore(
+                db_path,
+                max_bytes=int(os.getenv("RESULT_CACHE_DB_MAX_BYTES", str(256 * 1024 * 1024))),
+                ttl_seconds=float(os.getenv("RESULT_CACHE_DB_TTL_SECONDS", str(24 * 3600)))
+            )
+            snapshot_path = os.getenv("RESULT_CACHE_SNAPSHOT_PATH")
+            if snapshot_path and os.path.exists(snapshot_path):
+                loaded = backend.load_snapshot(snapshot_path)
+                logger.info(f"Warmed persistent result cache with {loaded} records from snapshot")
+            if snapshot_path and os.getenv("RESULT_CACHE_SNAPSHOT_ON_EXIT", "false").lower() == "true":
+                # Every worker writes its own temporary file and replaces the snapshot atomically
+                atexit.register(_save_snapshot_on_exit, backend, snapshot_path)
+        except Exception as e:
+            logger.error(f"Persistent result cache disabled: {str(e)}")
+            backend = None
+
+    return ResultCache(
+        max_entries=int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "10000")),
+        max_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", str(16 * 1024 * 1024))),
+        ttl_seconds=float(os.getenv("RESULT_CACHE_TTL_SECONDS", "3600")),
+        backend=backend
+    )
@@ -0,0 +1,365 @@
+"""
+retry_policy.py - Shared retry policy for LLM calls.
+
+Combines four mechanisms so that retries help during short blips without
+amplifying an upstream brownout:
+    - per-request deadlines: no retry is started if it would end past the deadline
+    - a process-wide retry budget (token bucket): retries stay under a share of traffic
+    - jittered exponential backoff
+    - a circuit breaker that fails fast while Vertex AI keeps failing
+"""
+
+import asyncio
+import contextvars
+import logging
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from metrics import STAGE_RETRY_SLEEP, metrics
+
+logger = logging.getLogger(__name__)
+
+# Absolute deadline (time.monotonic()) of the request being served, if any
+_request_deadline: contextvars.ContextVar = contextvars.ContextVar("request_deadline", default=None)
+
+
+def set_request_deadline(seconds: float) -> None:
+    """
+    Set the deadline of the current request, `seconds` from now.
+    Called once per request by the web servers.
+    """
+    _request_deadline.set(time.monotonic() + seconds)
+
+
+def get_request_deadline() -> Optional[float]:
+    """
+    Return the absolute deadline of the current request, or None if none was set.
+    """
+    return _request_deadline.get()
+
+
+class LLMCallError(Exception):
+    """
+    Raised when an LLM call still fails after all retry attempts
+    """
+
+    def __init__(self, attempts: int, last_error: Exception):
+        super().__init__(f"LLM call failed after {attempts} attempts: {str(last_error)}")
+        self.attempts = attempts
+        self.last_error = last_error
+
+
+class CircuitOpenError(LLMCallError):
+    """
+    Raised without calling the model while the circuit breaker is open
+    """
+
+    def __init__(self):
+        Exception.__init__(self, "Circuit breaker open - Vertex AI calls are short-circuited")
+        self.attempts = 0
+        self.last_error = self
+
+
+class RetryBudget:
+    """
+    Token bucket limiting retries to a share of first attempts.
+
+    Every first attempt deposits `ratio` tokens and every retry withdraws one,
+    so over time retries stay at or below `ratio` of traffic; `capacity` allows
+    short bursts of retries after a quiet period.
+    """
+
+    def __init__(self, ratio=0.1, capacity=10.0):
+        self.ratio = ratio
+        self.capacity = capacity
+        self.tokens = capacity
+        self.lock = threading.Lock()
+
+    def deposit(self) -> None:
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + self.ratio)
+
+    def try_withdraw(self) -> bool:
+        with self.lock:
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return True
+            return False
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls for
+    `reset_timeout` seconds, then lets a single trial call through (half-open)
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def acquire(self) -> Optional[bool]:
+        """
+        Check if a call may go through now.
+
+        Returns:
+            None if the call is rejected, True if it is the half-open trial call
+            (whose outcome, or release_trial, decides the next state), else False
+        """
+        with self.lock:
+            if self.state == self.CLOSED:
+                return False
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self.trial_in_flight = False
+            if self.state == self.HALF_OPEN and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return None
+
+    def allow(self) -> bool:
+        """
+        Check if a call may go through now.
+        """
+        return self.acquire() is not None
+
+    def release_trial(self) -> None:
+        """
+        Give up the half-open trial without an outcome (the client went away or the
+        call was cancelled), so the next call becomes the trial.
+        """
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                self.trial_in_flight = False
+
+    def record_success(self) -> None:
+        with self.lock:
+            if self.state != self.CLOSED:
+                logger.info("Circuit breaker closed - Vertex AI calls succeed again")
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self.trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(f"Circuit breaker opened after {self.consecutive_failures} consecutive failures")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self.trial_in_flight = False
+
+
+class RetryState:
+    """
+    Progress of one logical call through the retry policy
+    """
+
+    def __init__(self, max_attempts: int, deadline: float):
+        self.max_attempts = max_attempts
+        self.deadline = deadline
+        self.attempts = 0
+        # The current attempt is the circuit breaker's half-open trial and has no outcome yet
+        self.trial = False
+        self.attempt_started = 0.0
+
+
+class RetryPolicy:
+    """
+    Retry policy shared by every LLM entry point of the analyzer
+    """
+
+    def __init__(self, max_attempts=3, base_delay=1.0, max_delay=8.0, default_deadline=20.0,
+                 budget: Optional[RetryBudget] = None, breaker: Optional[CircuitBreaker] = None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.default_deadline = default_deadline
+        self.budget = budget or RetryBudget()
+        self.breaker = breaker or CircuitBreaker()
+        self.lock = threading.Lock()
+        # Callbacks receiving (rtt, success) for every attempt
+        self.listeners = []
+        # Counters
+        self.calls = 0
+        self.retries = 0
+        self.budget_exhausted = 0
+        self.deadline_exceeded = 0
+        self.short_circuited = 0
+
+    def add_listener(self, callback: Callable[[float, bool], None]) -> None:
+        """
+        Register a callback called with (rtt in seconds, success) after every attempt,
+        e.g. the adaptive concurrency limit of the API limiter.
+        """
+        self.listeners.append(callback)
+
+    def _notify(self, state: RetryState, success: bool) -> None:
+        rtt = time.monotonic() - state.attempt_started
+        for callback in self.listeners:
+            try:
+                callback(rtt, success)
+            except Exception as e:
+                logger.error(f"Retry policy listener failed: {str(e)}")
+
+    def begin(self, max_attempts: Optional[int] = None) -> RetryState:
+        """
+        Start a logical call, using the current request's deadline when set.
+        """
+        deadline = get_request_deadline() or time.monotonic() + self.default_deadline
+        with self.lock:
+            self.calls += 1
+        self.budget.deposit()
+        return RetryState(max_attempts or self.max_attempts, deadline)
+
+    def before_attempt(self, state: RetryState) -> None:
+        """
+        Register an attempt, or raise CircuitOpenError if the breaker rejects it.
+        """
+        trial = self.breaker.acquire()
+        if trial is None:
+            with self.lock:
+                self.short_circuited += 1
+            raise CircuitOpenError()
+        state.trial = trial
+        state.attempts += 1
+        state.attempt_started = time.monotonic()
+
+    def record_success(self, state: RetryState) -> None:
+        state.trial = False
+        self.breaker.record_success()
+        self._notify(state, True)
+
+    def end(self, state: RetryState) -> None:
+        """
+        Finish a logical call; must run however it ends (in a finally). An attempt
+        left without an outcome (GeneratorExit of an abandoned stream, task
+        cancellation, KeyboardInterrupt) releases the breaker's half-open trial,
+        which would otherwise block every later call.
+        """
+        if state.trial:
+            state.trial = False
+            self.breaker.release_trial()
+
+    def on_failure(self, state: RetryState, error: Exception) -> Optional[float]:
+        """
+        Record a failed attempt and decide whether to retry.
+
+        Returns:
+            Backoff delay in seconds before the next attempt, or None to give up
+        """
+        state.trial = False
+        self.breaker.record_failure()
+        self._notify(state, False)
+
+        if state.attempts >= state.max_attempts:
+            return None
+
+        # Full jitter: uniform in [0, base * 2^attempt], capped
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** state.attempts))
+        if time.monotonic() + delay >= state.deadline:
+            with self.lock:
+                self.deadline_exceeded += 1
+            logger.warning("Not retrying - request deadline would be exceeded")
+            return None
+
+        if not self.budget.try_withdraw():
+            with self.lock:
+                self.budget_exhausted += 1
+            logger.warning("Not retrying - retry budget exhausted")
+            return None
+
+        with self.lock:
+            self.retries += 1
+        metrics.observe_stage(STAGE_RETRY_SLEEP, delay)
+        return delay
+
+    def remaining(self, state: RetryState) -> float:
+        """
+        Seconds left before the deadline of the call.
+        """
+        return max(0.0, state.deadline - time.monotonic())
+
+    def call(self, func: Callable[[], Any], description: str, max_attempts: Optional[int] = None) -> Any:
+        """
+        Run a blocking model call under the policy.
+
+        Args:
+            func: Zero-argument callable performing the model call
+            description: What is being sent, for log messages
+            max_attempts: Override of the maximum number of attempts
+
+        Raises:
+            LLMCallError: If the call failed and may not be retried
+            CircuitOpenError: If the circuit breaker is open
+        """
+        state = self.begin(max_attempts)
+        try:
+            while True:
+                self.before_attempt(state)
+                try:
+                    logger.info(f"Attempt {state.attempts}/{state.max_attempts}: Sending {description} to Vertex AI")
+                    result = func()
+                    self.record_success(state)
+                    return result
+
+                except Exception as api_error:
+                    logger.warning(f"API call failed (attempt {state.attempts}/{state.max_attempts}): {str(api_error)}")
+                    delay = self.on_failure(state, api_error)
+                    if delay is None:
+                        logger.error(f"All retries failed for {description}")
+                        raise LLMCallError(state.attempts, api_error)
+                    time.sleep(delay)
+        finally:
+            self.end(state)
+
+    async def acall(self, afunc: Callable[[], Awaitable[Any]], description: str,
+                    max_attempts: Optional[int] = None) -> Any:
+        """
+        Async version of call; each attempt is also bounded by the remaining deadline.
+        """
+        state = self.begin(max_attempts)
+        try:
+            while True:
+                self.before_attempt(state)
+                try:
+                    logger.info(f"Attempt {state.attempts}/{state.max_attempts}: Sending {description} to Vertex AI")
+                    result = await asyncio.wait_for(afunc(), timeout=self.remaining(state))
+                    self.record_success(state)
+                    return result
+
+                except Exception as api_error:
+                    logger.warning(f"API call failed (attempt {state.attempts}/{state.max_attempts}): {str(api_error)}")
+                    delay = self.on_failure(state, api_error)
+                    if delay is None:
+                        logger.error(f"All retries failed for {description}")
+                        raise LLMCallError(state.attempts, api_error)
+                    await asyncio.sleep(delay)
+        finally:
+            self.end(state)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return policy counters for the health endpoint.
+        """
+        with self.lock:
+            return {
+                'calls': self.calls,
+                'retries': self.retries,
+                'budget_exhausted': self.budget_exhausted,
+                'deadline_exceeded': self.deadline_exceeded,
+                'short_circuited': self.short_circuited,
+                'budget_tokens': round(self.budget.tokens, 2),
+                'circuit_state': self.breaker.state
+            }
@@ -0,0 +1,38 @@
+"""
+Shared fixtures of the cloud-server tests.
+
+The server modules import each other by their flat names, as when run from
+cloud-server/, so that directory is put on the import path.
+
+Usage (from cloud-server/):
+    python -m pytest -q tests
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+@pytest.fixture
+def fake_env(monkeypatch):
+    """
+    Environment of an analyzer on the instant fake model, with nothing persisted
+    and no optional layer answering in place of the model.
+    """
+    for name, value in {
+        "LLM_BACKEND": "fake",
+        "FAKE_LLM_LATENCY_MS": "0",
+        "FAKE_LLM_LATENCY_SIGMA": "0",
+        "FAKE_LLM_ERROR_RATE": "0",
+        "LOCAL_FAST_PATH": "false",
+        "WORD_MEMO_MODE": "off",
+        "HEDGE_ENABLED": "false",
+        "RETRY_MAX_ATTEMPTS": "2",
+    }.items():
+        monkeypatch.setenv(name, value)
+    for name in ("RESULT_CACHE_DB_PATH", "RESULT_CACHE_SNAPSHOT_PATH", "PROMPT_VARIANTS", "PROMPTS_PATH",
+                 "MODEL_POOL", "MODEL_ROUTES_PATH"):
+        monkeypatch.delenv(name, raising=False)
@@ -0,0 +1,74 @@
+"""
+End-to-end tests of the analyzer on the fake model (LLM_BACKEND=fake), which answers
+instantly and deterministically without network or credentials.
+"""
+
+import asyncio
+
+import pytest
+
+langchain_vertex_analyzer = pytest.importorskip("langchain_vertex_analyzer")
+
+
+@pytest.fixture
+def make_analyzer(fake_env, monkeypatch):
+    def make(**env):
+        for name, value in env.items():
+            monkeypatch.setenv(name, value)
+        return langchain_vertex_analyzer.LangChainTextAnalyzer()
+    return make
+
+
+def test_analysis_goes_to_the_model_then_the_cache(make_analyzer):
+    analyzer = make_analyzer()
+    result = analyzer.analyze_and_correct_text("hello akuo")
+    # The fake model answers with the layout-converted text
+    assert (result["corrected_text"], result["path"]) == ("יקךךם שלום", "llm")
+    assert analyzer.analyze_and_correct_text("hello akuo")["path"] == "cache"
+    # Surrounding whitespace does not change the key
+    assert analyzer.analyze_and_correct_text(" hello akuo\n")["path"] == "cache"
+    assert asyncio.run(analyzer.aanalyze_and_correct_text("hello akuo"))["path"] == "cache"
+
+
+def test_prompt_versions_keep_separate_cache_entries(make_analyzer):
+    analyzer = make_analyzer()
+    assert analyzer.analyze_and_correct_text("hello akuo")["path"] == "llm"
+    # Moving the text's traffic to another version must not serve v1's answer
+    analyzer.prompts.set_weights({"analyze": {"v2": 1}})
+    assert analyzer.analyze_and_correct_text("hello akuo")["path"] == "llm"
+    assert analyzer.analyze_and_correct_text("hello akuo")["path"] == "cache"
+    analyzer.prompts.set_weights({"analyze": {"v1": 1}})
+    assert analyzer.analyze_and_correct_text("hello akuo")["path"] == "cache"
+    versions = analyzer.prompts.stats()["analyze"]
+    assert (versions["v1"]["calls"], versions["v2"]["calls"]) == (1, 1)
+
+
+def test_batch_keeps_input_order(make_analyzer):
+    analyzer = make_analyzer(BATCH_CHUNK_SIZE="2")
+    texts = ["akuo", "hello", "יקךךם", "akuo"]
+    results = analyzer.analyze_and_correct_batch(texts)
+    assert [result["corrected_text"] for result in results] == [analyzer.convert_layout(text) for text in texts]
+    assert analyzer.analyze_and_correct_text("hello")["path"] == "cache"
+
+
+def test_breaker_opens_on_model_errors(make_analyzer):
+    analyzer = make_analyzer(FAKE_LLM_ERROR_RATE="1", RETRY_MAX_ATTEMPTS="1", CIRCUIT_FAILURE_THRESHOLD="2",
+                             CIRCUIT_RESET_SECONDS="60")
+    first = analyzer.analyze_and_correct_text("akuo")
+    assert first["path"] == "fallback" and first["corrected_text"] == "akuo"
+    analyzer.analyze_and_correct_text("kfkf")
+    assert analyzer.retry_policy.breaker.state == "open"
+
+    result = analyzer.analyze_and_correct_text("hello")
+    assert result["path"] == "fallback"
+    assert "circuit breaker open" in result["reasoning"]
+    # Failed answers are never cached
+    assert analyzer.result_cache.stats()['entries'] == 0
+
+
+def test_chunked_translation_keeps_layout(make_analyzer):
+    analyzer = make_analyzer(TRANSLATE_CHUNK_CHARS="20", TRANSLATE_CHUNK_WORKERS="3")
+    text = "  First sentence here. Second one follows.\n\nA new paragraph\n  - with a list item.\n"
+    # The fake model translates every chunk to itself, so the layout is all that changes
+    assert analyzer.translate_with_vertex(text) == text.strip()
+    assert asyncio.run(analyzer.atranslate_with_vertex(text)) == text.strip()
@@ -0,0 +1,59 @@
+"""
+Tests of the hedger's worker pool: its size, hedging a slow call and running inline when saturated.
+"""
+
+import threading
+
+import pytest
+
+from hedging import Hedger
+from retry_policy import RetryBudget
+
+
+@pytest.fixture
+def hedger():
+    # 2 calls + 1 burst hedge + ceil(2 * 0.5) hedges = 4 workers
+    hedger = Hedger(budget=RetryBudget(ratio=0.5, capacity=1), max_concurrent_calls=2)
+    # Hedge after 10ms without waiting for a latency window to fill
+    hedger._tracker("analyze")._threshold = 0.01
+    yield hedger
+    if hedger._executor is not None:
+        hedger._executor.shutdown(wait=True)
+
+
+def test_pool_is_sized_from_the_concurrency_limit():
+    assert Hedger(budget=RetryBudget(ratio=0.05, capacity=10), max_concurrent_calls=40).max_threads == 52
+
+
+def test_slow_call_is_hedged(hedger):
+    release = threading.Event()
+    calls = []
+
+    def call():
+        calls.append(None)
+        if len(calls) == 1:
+            # The primary straggles until the hedge has answered
+            release.wait(5)
+            return "primary"
+        return "hedge"
+
+    assert hedger.call("analyze", call) == "hedge"
+    release.set()
+    stats = hedger.stats()['operations']['analyze']
+    assert (stats['hedged'], stats['hedge_wins'], stats['pool_saturated']) == (1, 1, 0)
+
+
+def test_saturated_pool_runs_the_call_inline_without_hedging(hedger):
+    release = threading.Event()
+    busy = [hedger._try_submit(lambda: release.wait(5)) for _ in range(hedger.max_threads)]
+    assert all(busy) and hedger._try_submit(lambda: None) is None
+
+    caller = threading.current_thread()
+    try:
+        assert hedger.call("analyze", lambda: threading.current_thread() is caller)
+    finally:
+        release.set()
+    stats = hedger.stats()['operations']['analyze']
+    assert (stats['hedged'], stats['pool_saturated']) == (0, 1)
+    # The inline call's latency still feeds the threshold
+    assert len(hedger.trackers["analyze"].latencies) == 1
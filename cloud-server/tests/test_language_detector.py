@@ -0,0 +1,119 @@
+"""
+Tests of the script-run segmenter against the per-character loops it replaced.
+"""
+
+import random
+
+import pytest
+
+from language_detector import ENGLISH, HEBREW, NEUTRAL, LanguageDetector
+
+# Hebrew and English letters, Hebrew points, neighbouring Armenian and Arabic letters,
+# an accented Latin letter, spaces, digits and layout punctuation
+ALPHABET = "abcXYZשלוםתְֿ׀օ֏؀é ,.;:/'?!-1\n"
+
+
+@pytest.fixture(scope="module")
+def detector():
+    return LanguageDetector()
+
+
+def random_texts(count, max_length=40):
+    rng = random.Random(0)
+    for _ in range(count):
+        yield "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, max_length)))
+
+
+def convert_last_language_per_character(detector, text):
+    """
+    convert_last_language as it was before the segmenter: a backwards per-character scan.
+    """
+    last_language = None
+    segment = []
+    index = len(text) - 1
+    while index >= 0:
+        char_language = detector.detect_character_language(text[index])
+        if last_language is None and char_language in {"hebrew", "english"}:
+            last_language = char_language
+        if last_language and char_language != last_language and char_language in {"hebrew", "english"}:
+            break
+        segment.insert(0, text[index])
+        index -= 1
+
+    if last_language == "hebrew":
+        segment = [detector.hebrew_to_english.get(char, char) for char in segment]
+    elif last_language == "english":
+        segment = [detector.english_to_hebrew.get(char.lower(), char) for char in segment]
+    return text[:index + 1] + "".join(segment)
+
+
+def dominant_language_per_character(detector, text):
+    """
+    The translate direction as it was before the segmenter (English on a tie).
+    """
+    hebrew = sum(1 for char in text if detector.detect_character_language(char) == "hebrew")
+    english = sum(1 for char in text if detector.detect_character_language(char) == "english")
+    return HEBREW if hebrew > english else ENGLISH
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("", ""),
+    ("hello", "יקךךם"),
+    ("שלום", "akuo"),
+    ("שלום akuo", "שלום שלום"),
+    ("hello akuo?", "יקךךם שלום?"),
+    ("123 !?", "123 !?"),
+])
+def test_convert_last_language(detector, text, expected):
+    assert detector.convert_last_language(text) == expected
+    assert detector.convert_last_language(text, detector.segment(text)) == expected
+
+
+def test_convert_last_language_matches_per_character_scan(detector):
+    for text in random_texts(5000):
+        expected = convert_last_language_per_character(detector, text)
+        assert detector.convert_last_language(text) == expected, text
+        assert detector.convert_last_language(text, detector.segment(text)) == expected, text
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("", None),
+    ("123 ...", None),
+    ("ab שלו", HEBREW),
+    ("abc שלו", ENGLISH),
+    ("שלום, world!", ENGLISH),
+    # Points are in the Hebrew block and count like letters, as they always did
+    ("שָׁלוֹם, world!", HEBREW),
+])
+def test_dominant_language(detector, text, expected):
+    assert detector.dominant_language(text) == expected
+
+
+def test_dominant_language_matches_per_character_count(detector):
+    for text in random_texts(5000):
+        assert (detector.dominant_language(text) or ENGLISH) == dominant_language_per_character(detector, text), text
+
+
+def test_segment_covers_text_in_order(detector):
+    for text in random_texts(2000):
+        spans = detector.segment(text)
+        assert "".join(text[start:end] for start, end, _ in spans) == text
+        assert all(previous[1] == following[0] for previous, following in zip(spans, spans[1:]))
+        scripts = [script for _, _, script in spans]
+        # One span per script change: neighbouring spans never share a script
+        assert all(previous != following for previous, following in zip(scripts, scripts[1:]))
+        assert set(scripts) <= {HEBREW, ENGLISH, NEUTRAL}
+
+
+def test_convert_mistyped_runs(detector):
+    def prefer_converted(original, converted):
+        return converted, 1.0
+
+    def undecided(original, converted):
+        return None, 0.0
+
+    text = "akuo שלום akuo"
+    assert detector.convert_mistyped_runs(text, prefer_converted) == "שלום akuo שלום"
+    # Without a preference only the last run is converted, like convert_last_language
+    assert detector.convert_mistyped_runs(text, undecided) == detector.convert_last_language(text)
+    assert detector.convert_mistyped_runs("123", prefer_converted) == "123"
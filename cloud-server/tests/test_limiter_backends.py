@@ -0,0 +1,151 @@
+"""
+Tests of the sliding-window rate limiter and the local and shared-memory limiter backends.
+"""
+
+import itertools
+
+import pytest
+
+import limiter_backends
+from limiter_backends import (ADMITTED, BUSY, RATE_LIMITED, LocalLimiterBackend, SharedMemoryLimiterBackend,
+                              SlidingWindowRateLimiter)
+
+
+def test_sliding_window_allows_limit_per_window():
+    limiter = SlidingWindowRateLimiter(window_seconds=60)
+    assert all(limiter.hit("client", 5, now=0) for _ in range(5))
+    assert not limiter.hit("client", 5, now=1)
+    # Other keys have their own counters
+    assert limiter.hit("other", 5, now=1)
+
+
+def test_sliding_window_weights_previous_window_by_overlap():
+    limiter = SlidingWindowRateLimiter(window_seconds=60)
+    for _ in range(10):
+        assert limiter.hit("client", 10, now=59)
+
+    # 15 seconds into the next window, 3/4 of the previous count still applies
+    assert limiter.hit("client", 10, now=75)
+    assert limiter.hit("client", 10, now=75)
+    assert not limiter.hit("client", 10, now=75)
+    # Half way through only half of it does, next to the 2 hits of this window
+    assert all(limiter.hit("client", 10, now=90) for _ in range(3))
+    assert not limiter.hit("client", 10, now=90)
+
+
+def test_sliding_window_forgets_after_two_windows():
+    limiter = SlidingWindowRateLimiter(window_seconds=60)
+    for _ in range(10):
+        limiter.hit("client", 10, now=0)
+    assert not limiter.hit("client", 10, now=1)
+    assert all(limiter.hit("client", 10, now=120) for _ in range(10))
+
+
+def test_sliding_window_counts_weight():
+    limiter = SlidingWindowRateLimiter(window_seconds=60)
+    assert limiter.hit("client", 10, weight=8, now=0)
+    assert not limiter.hit("client", 10, weight=3, now=0)
+    # A rejected hit is not counted
+    assert limiter.hit("client", 10, weight=2, now=0)
+
+
+def test_sliding_window_evicts_least_recently_used_keys():
+    limiter = SlidingWindowRateLimiter(window_seconds=60, max_keys=2)
+    limiter.hit("a", 1, now=0)
+    limiter.hit("b", 1, now=0)
+    assert not limiter.hit("a", 1, now=0)
+    limiter.hit("c", 1, now=0)
+    assert len(limiter) == 2
+    assert limiter.evictions == 1
+    # "b" was evicted and starts over, "a" was used more recently and is still limited
+    assert limiter.hit("b", 1, now=0)
+    assert not limiter.hit("c", 1, now=0)
+
+
+def test_local_backend_admission():
+    backend = LocalLimiterBackend(window_seconds=60)
+    status, token = backend.admit("client", 2, 1, max_concurrent=1)
+    assert status == ADMITTED
+    assert backend.admit("client", 2, 1, max_concurrent=1) == (BUSY, None)
+    assert backend.admit("client", 2, 1, max_concurrent=1) == (RATE_LIMITED, None)
+
+    backend.release(token)
+    assert backend.active_calls() == 0
+    assert backend.acquire(1) is not None
+    assert backend.acquire(1) is None
+
+
+def colliding_keys(rate_slots, count):
+    """
+    Return count keys whose hashes start their probe sequences at the same slot.
+    """
+    by_slot = {}
+    for number in itertools.count():
+        key = f"client-{number}"
+        keys = by_slot.setdefault(SharedMemoryLimiterBackend._key_hash(key) % rate_slots, [])
+        keys.append(key)
+        if len(keys) == count:
+            return keys
+
+
+@pytest.fixture
+def shared_backend(tmp_path):
+    backend = SharedMemoryLimiterBackend(str(tmp_path / "limiter"), window_seconds=60, rate_slots=16, worker_slots=4)
+    yield backend
+    backend._mmap.close()
+
+
+def test_shared_backend_colliding_keys_keep_separate_counters(shared_backend):
+    first, second, third = colliding_keys(shared_backend.rate_slots, 3)
+    assert all(shared_backend._hit(first, 3, 1, now=0) for _ in range(3))
+    assert not shared_backend._hit(first, 3, 1, now=0)
+    # The colliding keys probe on to the next slots
+    assert all(shared_backend._hit(second, 3, 1, now=0) for _ in range(3))
+    assert shared_backend._hit(third, 3, 1, now=0)
+    assert not shared_backend._hit(first, 3, 1, now=1)
+    assert not shared_backend._hit(second, 3, 1, now=1)
+
+
+def test_shared_backend_finds_key_past_a_stale_slot(shared_backend):
+    earlier, later = colliding_keys(shared_backend.rate_slots, 2)
+    # "earlier" takes the first slot of the sequence, so "later" lives in the second
+    assert shared_backend._hit(earlier, 10, 1, now=0)
+    assert all(shared_backend._hit(later, 10, 1, now=100) for _ in range(10))
+
+    # Two windows on, the first slot is stale while "later" still has its previous window;
+    # claiming the stale slot would give it a fresh counter
+    assert not shared_backend._hit(later, 10, 1, now=125)
+    assert shared_backend._hit(earlier, 10, 1, now=125)
+    assert not shared_backend._hit(later, 10, 1, now=125)
+
+
+def test_shared_backend_replaces_oldest_slot_when_sequence_is_full(shared_backend, monkeypatch):
+    monkeypatch.setattr(SharedMemoryLimiterBackend, "PROBES", 2)
+    oldest, newer, newest = colliding_keys(shared_backend.rate_slots, 3)
+    assert shared_backend._hit(oldest, 1, 1, now=0)
+    assert shared_backend._hit(newer, 1, 1, now=60)
+    assert shared_backend._hit(newest, 1, 1, now=61)
+    # "oldest" lost its slot to "newest" and starts over, "newer" kept its counter
+    assert shared_backend._hit(oldest, 1, 1, now=62)
+    assert not shared_backend._hit(newer, 1, 1, now=62)
+
+
+def test_shared_backend_state_is_shared_between_instances(tmp_path, monkeypatch):
+    path = str(tmp_path / "limiter")
+    first = SharedMemoryLimiterBackend(path, window_seconds=60, rate_slots=16, worker_slots=4)
+    second = SharedMemoryLimiterBackend(path, window_seconds=60, rate_slots=16, worker_slots=4)
+    monkeypatch.setattr(limiter_backends.time, "time", lambda: 0.0)
+    try:
+        status, token = first.admit("client", 2, 1, max_concurrent=1)
+        assert status == ADMITTED
+        assert second.admit("client", 2, 1, max_concurrent=1) == (BUSY, None)
+        assert second.admit("client", 2, 1, max_concurrent=1) == (RATE_LIMITED, None)
+        assert second.active_calls() == 1
+
+        first.release(token)
+        assert second.active_calls() == 0
+        assert second.acquire(1) is not None
+        assert first.acquire(1) is None
+    finally:
+        first._mmap.close()
+        second._mmap.close()
@@ -0,0 +1,141 @@
+"""
+Tests of the result cache's TTL and LRU eviction and of its SQLite backend.
+"""
+
+import time
+import types
+
+import pytest
+
+import result_cache
+from result_cache import ResultCache, SQLiteResultStore, create_result_cache, make_cache_key
+
+
+class Clock:
+    """
+    Stand-in for time.monotonic and time.time that only moves when told to
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(result_cache, "time", types.SimpleNamespace(monotonic=clock, time=clock, sleep=time.sleep))
+    return clock
+
+
+def key(text):
+    return make_cache_key("convert", "model", text)
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = ResultCache(ttl_seconds=10)
+    cache.set(key("a"), "A")
+    clock.now += 9.9
+    assert cache.get(key("a")) == "A"
+    clock.now += 0.1
+    assert cache.get(key("a")) is None
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['expirations'], stats['entries'], stats['bytes']) == (1, 1, 1, 0, 0)
+
+
+def test_set_renews_ttl(clock):
+    cache = ResultCache(ttl_seconds=10)
+    cache.set(key("a"), "A")
+    clock.now += 8
+    cache.set(key("a"), "B")
+    clock.now += 8
+    assert cache.get(key("a")) == "B"
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = ResultCache(max_entries=2)
+    cache.set(key("a"), "A")
+    cache.set(key("b"), "B")
+    # Reading "a" makes "b" the least recently used
+    assert cache.get(key("a")) == "A"
+    cache.set(key("c"), "C")
+    assert cache.get(key("b")) is None
+    assert cache.get(key("a")) == "A"
+    assert cache.get(key("c")) == "C"
+    assert cache.stats()['evictions'] == 1
+
+
+def test_byte_limit_evicts_and_skips_oversized_values(clock):
+    size = ResultCache._entry_size(key("a"), "x" * 10)
+    cache = ResultCache(max_bytes=2 * size)
+    cache.set(key("a"), "x" * 10)
+    cache.set(key("b"), "x" * 10)
+    cache.set(key("c"), "x" * 10)
+    assert cache.get(key("a")) is None
+    assert cache.stats()['bytes'] == 2 * size
+
+    cache.set(key("d"), "x" * (2 * size))
+    assert cache.get(key("d")) is None
+    assert cache.get(key("b")) == "x" * 10
+
+
+def test_keys_are_normalized():
+    # Decomposed and precomposed accents, and surrounding whitespace, give the same key
+    assert make_cache_key("convert", "model", " cafe\u0301\n") == make_cache_key("convert", "model", "caf\u00e9")
+    # Each prompt version has its own entries
+    assert make_cache_key("convert", "model", "a", "v2") != make_cache_key("convert", "model", "a", "v1")
+
+
+def test_sqlite_backend_fills_memory_misses(tmp_path):
+    path = str(tmp_path / "cache.db")
+    ResultCache(backend=SQLiteResultStore(path)).set(key("a"), "A")
+    # Another worker with an empty memory cache reads through to the database
+    other = ResultCache(backend=SQLiteResultStore(path))
+    assert other.get(key("a")) == "A"
+    assert other.stats()['entries'] == 1
+
+
+def test_sqlite_backend_ttl_and_compaction(tmp_path, clock):
+    store = SQLiteResultStore(str(tmp_path / "cache.db"), max_bytes=10 ** 6, ttl_seconds=10)
+    store.set(key("a"), "A")
+    clock.now += 10
+    assert store.get(key("a")) is None
+    store.set(key("b"), "B")
+    store.compact()
+    assert store.stats()['entries'] == 1
+
+
+def test_sqlite_snapshot_round_trip(tmp_path):
+    source = SQLiteResultStore(str(tmp_path / "source.db"))
+    source.set(key("שלום"), "akuo")
+    source.set(key("b"), "B")
+    snapshot = str(tmp_path / "snapshot.jsonl")
+    assert source.save_snapshot(snapshot) == 2
+
+    target = SQLiteResultStore(str(tmp_path / "target.db"))
+    target.set(key("b"), "kept")
+    assert target.load_snapshot(snapshot) == 2
+    assert target.get(key("שלום")) == "akuo"
+    # Existing rows win over the snapshot
+    assert target.get(key("b")) == "kept"
+
+
+def test_snapshot_is_written_on_exit(tmp_path, monkeypatch):
+    exit_hooks = []
+    monkeypatch.setattr(result_cache.atexit, "register", lambda func, *args: exit_hooks.append((func, args)))
+    snapshot = tmp_path / "snapshot.jsonl"
+    monkeypatch.setenv("RESULT_CACHE_DB_PATH", str(tmp_path / "cache.db"))
+    monkeypatch.setenv("RESULT_CACHE_SNAPSHOT_PATH", str(snapshot))
+    monkeypatch.setenv("RESULT_CACHE_SNAPSHOT_ON_EXIT", "true")
+
+    create_result_cache().set(key("a"), "A")
+    assert not snapshot.exists()
+    for func, args in exit_hooks:
+        func(*args)
+    assert len(snapshot.read_text(encoding="utf-8").splitlines()) == 1
+
+    # The next process on a fresh database starts warm
+    monkeypatch.setenv("RESULT_CACHE_DB_PATH", str(tmp_path / "fresh.db"))
+    assert create_result_cache().get(key("a")) == "A"
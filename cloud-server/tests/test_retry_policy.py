@@ -0,0 +1,209 @@
+"""
+Tests of the circuit breaker state machine and the retry policy around it.
+"""
+
+import asyncio
+import time
+import types
+
+import pytest
+
+import retry_policy
+from retry_policy import CircuitBreaker, CircuitOpenError, LLMCallError, RetryBudget, RetryPolicy
+
+
+class Clock:
+    """
+    Stand-in for the retry policy's time.monotonic that only moves when told to
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    # Only the policy's view of time; the event loop keeps the real clock
+    monkeypatch.setattr(retry_policy, "time", types.SimpleNamespace(monotonic=clock, sleep=time.sleep))
+    return clock
+
+
+def open_breaker(breaker):
+    for _ in range(breaker.failure_threshold):
+        assert breaker.acquire() is False
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    # A success in between resets the count
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.acquire() is None
+    assert not breaker.allow()
+
+
+def test_breaker_half_open_trial_closes_on_success(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+    open_breaker(breaker)
+    clock.now += 9.9
+    assert breaker.acquire() is None
+
+    clock.now += 0.1
+    assert breaker.acquire() is True
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # Only a single trial at a time
+    assert breaker.acquire() is None
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.acquire() is False
+
+
+def test_breaker_half_open_trial_failure_reopens(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+    open_breaker(breaker)
+    clock.now += 10
+    assert breaker.acquire() is True
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    # The reset timeout starts over from the failed trial
+    clock.now += 5
+    assert breaker.acquire() is None
+    clock.now += 5
+    assert breaker.acquire() is True
+
+
+def test_breaker_release_trial_lets_next_call_be_the_trial(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+    open_breaker(breaker)
+    clock.now += 10
+    assert breaker.acquire() is True
+    breaker.release_trial()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.acquire() is True
+
+    # Releasing outside the half-open state changes nothing
+    breaker.record_success()
+    breaker.release_trial()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_retry_budget_limits_retries_to_ratio():
+    budget = RetryBudget(ratio=0.25, capacity=1)
+    assert budget.try_withdraw()
+    assert not budget.try_withdraw()
+    for _ in range(3):
+        budget.deposit()
+    assert not budget.try_withdraw()
+    budget.deposit()
+    assert budget.try_withdraw()
+
+
+def make_policy(**breaker_args):
+    return RetryPolicy(max_attempts=3, base_delay=0.0, max_delay=0.0, default_deadline=5.0,
+                       budget=RetryBudget(ratio=1.0, capacity=10),
+                       breaker=CircuitBreaker(**breaker_args))
+
+
+def test_call_retries_until_success():
+    policy = make_policy()
+    outcomes = [ValueError("first"), ValueError("second"), "answer"]
+
+    def func():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    assert policy.call(func, "test") == "answer"
+    assert policy.stats()['retries'] == 2
+    assert policy.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_call_gives_up_after_max_attempts():
+    policy = make_policy()
+    calls = []
+
+    def func():
+        calls.append(1)
+        raise ValueError("down")
+
+    with pytest.raises(LLMCallError) as error:
+        policy.call(func, "test")
+    assert error.value.attempts == 3
+    assert len(calls) == 3
+
+
+def test_call_short_circuits_while_open():
+    policy = make_policy(failure_threshold=1, reset_timeout=60)
+    with pytest.raises(LLMCallError):
+        policy.call(lambda: 1 / 0, "test", max_attempts=1)
+    with pytest.raises(CircuitOpenError):
+        policy.call(lambda: "never called", "test")
+    assert policy.stats()['short_circuited'] == 1
+
+
+def half_open_policy(clock):
+    policy = make_policy(failure_threshold=1, reset_timeout=10)
+    with pytest.raises(LLMCallError):
+        policy.call(lambda: 1 / 0, "test", max_attempts=1)
+    clock.now += 10
+    return policy
+
+
+def test_abandoned_attempt_releases_trial(clock):
+    policy = half_open_policy(clock)
+
+    def stream():
+        state = policy.begin()
+        try:
+            policy.before_attempt(state)
+            yield "first token"
+            yield "second token"
+            policy.record_success(state)
+        finally:
+            policy.end(state)
+
+    tokens = stream()
+    assert next(tokens) == "first token"
+    assert policy.breaker.trial_in_flight
+    # The client goes away mid-stream
+    tokens.close()
+    assert not policy.breaker.trial_in_flight
+    assert policy.call(lambda: "trial", "test") == "trial"
+    assert policy.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_cancelled_async_attempt_releases_trial(clock):
+    policy = half_open_policy(clock)
+
+    async def scenario():
+        started = asyncio.Event()
+
+        async def slow():
+            started.set()
+            await asyncio.sleep(60)
+
+        task = asyncio.ensure_future(policy.acall(slow, "test"))
+        await started.wait()
+        assert policy.breaker.trial_in_flight
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    assert not policy.breaker.trial_in_flight
+    assert policy.breaker.acquire() is True
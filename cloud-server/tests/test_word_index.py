@@ -0,0 +1,52 @@
+"""
+Tests of the memory-mapped word-frequency index and its candidate scoring.
+"""
+
+import math
+
+import pytest
+
+from word_index import WordFrequencyIndex, build_index
+
+
+@pytest.fixture
+def index(tmp_path):
+    path = str(tmp_path / "words.bin")
+    build_index([("the", 1000), ("hello", 100), ("world", 100), ("zyzzyva", 1), ("שלום", 100), ("Hello", 50)], path)
+    index = WordFrequencyIndex(path)
+    yield index
+    index.close()
+
+
+def test_lookup(index):
+    assert len(index) == 5
+    assert index.frequency("HELLO") == 100
+    assert index.frequency("שלום") == 100
+    assert index.frequency("missing") == 0
+    assert "world" in index and "worlds" not in index
+
+
+def test_word_score_is_weighted_by_frequency(index):
+    assert index.reference_frequency == 100
+    assert index.word_score("the") == index.word_score("hello") == 1.0
+    assert index.word_score("zyzzyva") == pytest.approx(math.log(2) / math.log(101))
+    assert index.word_score("missing") == 0.0
+    # Single letters are ignored
+    assert index.score("hello world a") == 1.0
+    assert index.score("hello zyzzyva") < index.score("hello world")
+
+
+def test_choose_candidate(index):
+    assert index.choose_candidate("hello world", "יקךךם 'םרךג") == ("hello world", 1.0)
+    assert index.choose_candidate("akuo", "שלום") == ("שלום", 1.0)
+    # A rare-word match loses to common words
+    assert index.choose_candidate("zyzzyva", "hello")[0] == "hello"
+    assert index.choose_candidate("qqq", "xxx") == (None, 0.0)
+    assert index.choose_candidate("same", "same") == (None, 0.0)
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "other.bin"
+    path.write_bytes(b"\0" * 64)
+    with pytest.raises(ValueError):
+        WordFrequencyIndex(str(path))
@@ -0,0 +1,59 @@
+"""
+text_chunker.py - Splits long texts into chunks on paragraph, line and
+sentence boundaries for chunked translation.
+
+The whitespace between chunks is kept aside verbatim and put back between
+the translated chunks as they are sent, so paragraphs, line breaks, list
+layout and indentation of the input survive even though every chunk is
+translated on its own. A chunk never cuts a sentence: a sentence longer than the chunk
+size becomes a chunk by itself.
+"""
+
+import re
+from typing import List, Tuple
+
+# Paragraph and line breaks (with the whitespace around them), and the spaces after a sentence end
+_BOUNDARY_PATTERN = re.compile(r"(\s*\n\s*|(?<=[.!?…])[ \t]+)")
+
+
+def split_into_chunks(text: str, max_chars: int) -> Tuple[List[str], List[str]]:
+    """
+    Split text into chunks of at most max_chars characters where possible.
+
+    Chunks are packed greedily with whole sentences and lines. A paragraph
+    break closes the current chunk once it is at least half full, so chunks
+    tend to hold whole paragraphs.
+
+    Args:
+        text: Text to split
+        max_chars: Preferred maximum chunk length
+
+    Returns:
+        Tuple of (chunks, separators) with len(separators) == len(chunks) + 1 and
+        text == separators[0] + chunks[0] + separators[1] + ... + chunks[-1] + separators[-1]
+    """
+    body = text.strip()
+    leading = text[:len(text) - len(text.lstrip())]
+    trailing = text[len(leading) + len(body):]
+    if not body:
+        return [], [text]
+
+    # Alternating content and boundary pieces: content, boundary, content, ...
+    pieces = _BOUNDARY_PATTERN.split(body)
+    chunks: List[str] = []
+    separators = [leading]
+    current = pieces[0]
+    for index in range(1, len(pieces), 2):
+        boundary, content = pieces[index], pieces[index + 1]
+        paragraph_break = boundary.count("\n") >= 2
+        if (len(current) + len(boundary) + len(content) > max_chars
+                or (paragraph_break and len(current) >= max_chars // 2)):
+            chunks.append(current)
+            separators.append(boundary)
+            current = content
+        else:
+            current += boundary + content
+    chunks.append(current)
+    separators.append(trailing)
+    return chunks, separators
+
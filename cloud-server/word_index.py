@@ -0,0 +1,221 @@
+"""
+word_index.py - Compact word-frequency index used to score layout candidates locally.
+
+The index is a sorted array of UTF-8 words stored in a single binary file and
+memory-mapped read-only, so every gunicorn worker shares the same pages and
+lookups are a binary search with no per-process parsing cost.
+
+A text scores by the frequency of its words: a word at least as frequent as
+the median word of the index counts fully, a rarer one by the log of its
+frequency relative to the median, so an accidental match on a rare word
+weighs little against common words.
+
+File layout (little-endian):
+    magic      4 bytes  b"KFWI"
+    version    uint32
+    count      uint32
+    reference  uint32   median frequency
+    offsets    uint32[count + 1]   record offsets relative to the data section
+    data       records of (uint32 frequency, UTF-8 word bytes)
+"""
+
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+import tempfile
+from typing import Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"KFWI"
+VERSION = 2
+_HEADER = struct.Struct("<4sIII")
+_UINT32 = struct.Struct("<I")
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+DEFAULT_SOURCE_PATH = os.path.join(DATA_DIR, "word_frequencies.tsv")
+
+# Hebrew letters (without niqqud) and ASCII letters
+_WORD_PATTERN = re.compile(r"[A-Za-z]+|[א-ת]+")
+
+
+def build_index(entries: Iterable[Tuple[str, int]], path: str) -> None:
+    """
+    Write a binary index file from (word, frequency) pairs.
+
+    Args:
+        entries: Iterable of (word, frequency) pairs; duplicates keep the highest frequency
+        path: Destination file path
+    """
+    frequencies = {}
+    for word, frequency in entries:
+        key = word.lower().encode("utf-8")
+        frequencies[key] = max(frequency, frequencies.get(key, 0))
+
+    offsets = []
+    data = bytearray()
+    for key in sorted(frequencies):
+        offsets.append(len(data))
+        data += _UINT32.pack(frequencies[key]) + key
+    offsets.append(len(data))
+    ranked = sorted(frequencies.values())
+    reference = ranked[len(ranked) // 2] if ranked else 1
+
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(frequencies), reference))
+        f.write(struct.pack(f"<{len(offsets)}I", *offsets))
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def read_frequency_list(path: str) -> List[Tuple[str, int]]:
+    """
+    Read a tab-separated `word<TAB>count` file, skipping blank and comment lines.
+    """
+    entries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            word, _, count = line.partition("\t")
+            entries.append((word, int(count or 1)))
+    return entries
+
+
+class WordFrequencyIndex:
+    """
+    Read-only, memory-mapped word-frequency lookup
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, count, reference = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            self._mmap.close()
+            raise ValueError(f"Not a version {VERSION} word index file: {path}")
+
+        self.count = count
+        self.reference_frequency = reference
+        self._log_reference = math.log1p(max(1, reference))
+        self._offsets_start = _HEADER.size
+        self._data_start = self._offsets_start + (count + 1) * _UINT32.size
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _record(self, position: int) -> Tuple[bytes, int]:
+        start, end = struct.unpack_from("<2I", self._mmap, self._offsets_start + position * _UINT32.size)
+        start += self._data_start
+        end += self._data_start
+        frequency = _UINT32.unpack_from(self._mmap, start)[0]
+        return self._mmap[start + _UINT32.size:end], frequency
+
+    def frequency(self, word: str) -> int:
+        """
+        Return the frequency of a word, or 0 when the word is unknown.
+        """
+        key = word.lower().encode("utf-8")
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            candidate, frequency = self._record(middle)
+            if candidate < key:
+                low = middle + 1
+            elif candidate > key:
+                high = middle
+            else:
+                return frequency
+        return 0
+
+    def __contains__(self, word: str) -> bool:
+        return self.frequency(word) > 0
+
+    def word_score(self, word: str) -> float:
+        """
+        Return 1 for a word at least as frequent as the median word, less for rarer
+        words on a log scale, and 0 for unknown words.
+        """
+        return min(1.0, math.log1p(self.frequency(word)) / self._log_reference)
+
+    def score(self, text: str) -> float:
+        """
+        Score how plausible a text is as real Hebrew/English.
+
+        Returns:
+            Mean word_score of the words of two letters or more, between 0 and 1
+        """
+        words = [word for word in _WORD_PATTERN.findall(text) if len(word) > 1]
+        if not words:
+            return 0.0
+        return sum(self.word_score(word) for word in words) / len(words)
+
+    def choose_candidate(self, original_text: str, converted_text: str) -> Tuple[Optional[str], float]:
+        """
+        Pick the more plausible of the original and layout-converted text.
+
+        Returns:
+            Tuple of (chosen text or None when undecided, confidence between 0 and 1).
+            Confidence is the winner's score reduced by the loser's.
+        """
+        if original_text == converted_text:
+            return None, 0.0
+
+        original_score = self.score(original_text)
+        converted_score = self.score(converted_text)
+        if converted_score > original_score:
+            return converted_text, converted_score - original_score
+        if original_score > converted_score:
+            return original_text, original_score - converted_score
+        return None, 0.0
+
+    def close(self):
+        self._mmap.close()
+
+
+def load_word_index(path: Optional[str] = None) -> Optional[WordFrequencyIndex]:
+    """
+    Load the word index, compiling the bundled frequency list when needed.
+
+    Args:
+        path: Compiled index path; defaults to WORD_INDEX_PATH or a file compiled
+              from data/word_frequencies.tsv into the temp directory
+
+    Returns:
+        WordFrequencyIndex instance, or None if the index could not be loaded
+    """
+    try:
+        path = path or os.getenv("WORD_INDEX_PATH")
+        if not path:
+            source_mtime = int(os.path.getmtime(DEFAULT_SOURCE_PATH))
+            path = os.path.join(tempfile.gettempdir(), f"keyfixer_word_index_v{VERSION}_{source_mtime}.bin")
+            if not os.path.exists(path):
+                build_index(read_frequency_list(DEFAULT_SOURCE_PATH), path)
+                logger.info(f"Compiled word index to {path}")
+
+        index = WordFrequencyIndex(path)
+        logger.info(f"Loaded word index with {len(index)} words")
+        return index
+    except Exception as e:
+        logger.warning(f"Word index not available, local fast path disabled: {str(e)}")
+        return None
+
+
+# Compile a frequency list into an index file
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 3:
+        print("Usage: python word_index.py <word_frequencies.tsv> <output.bin>")
+        sys.exit(1)
+
+    build_index(read_frequency_list(sys.argv[1]), sys.argv[2])
+    index = WordFrequencyIndex(sys.argv[2])
+    print(f"Wrote {len(index)} words to {sys.argv[2]}")
@@ -0,0 +1,185 @@
+"""
+word_memo.py - Word-level correction memo learned from LLM results.
+
+The result cache only helps when the exact same text comes back, while most
+words of a new sentence have been corrected before. After every successful
+LLM analysis the original, converted and corrected texts are split into words;
+layout conversion maps characters one to one and the prompt forbids adding,
+removing, merging or splitting words, so the three word lists line up. Each
+(original word, converted word) pair counts the corrections the model gave it.
+
+A new text is answered from the memo when every one of its word pairs has been
+seen at least WORD_MEMO_MIN_COUNT times and one correction accounts for at least
+WORD_MEMO_CONFIDENCE of them. The answer keeps the whitespace of the original
+text.
+
+WORD_MEMO_MODE selects the behavior:
+    - off: no memo
+    - shadow (default): learn, and for every text sent to the LLM compare the
+      answer the memo would have given with the model's, without serving it
+    - on: also answer covered texts locally (path "memo") instead of calling the LLM
+
+The memo is bounded by WORD_MEMO_MAX_ENTRIES word pairs; when it is full, the
+least often seen pairs are evicted.
+"""
+
+import os
+import re
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+MODE_OFF = "off"
+MODE_SHADOW = "shadow"
+MODE_ON = "on"
+
+_WORD_PATTERN = re.compile(r"\S+")
+
+# Different corrections kept per word pair; a pair the model answers in more ways is not memorable anyway
+MAX_CORRECTIONS_PER_WORD = 4
+
+
+class WordMemo:
+    """
+    Frequency-weighted store of per-word corrections and the local answers built from it
+    """
+
+    def __init__(self, mode: str = MODE_SHADOW, max_entries: int = 100000, min_count: int = 3,
+                 min_confidence: float = 0.95):
+        self.mode = mode
+        self.max_entries = max_entries
+        self.min_count = min_count
+        self.min_confidence = min_confidence
+        self.lock = threading.Lock()
+        # (original word, converted word) -> {corrected word: times seen}
+        self.entries: Dict[Tuple[str, str], Dict[str, int]] = {}
+        # Counters
+        self.learned = 0
+        self.misaligned = 0
+        self.evictions = 0
+        self.lookups = 0
+        self.hits = 0
+        self.shadow_compared = 0
+        self.shadow_agreed = 0
+
+    @property
+    def serving(self) -> bool:
+        return self.mode == MODE_ON
+
+    def learn(self, text: str, converted_text: str, corrected_text: str) -> bool:
+        """
+        Record the per-word corrections of one LLM answer.
+
+        Returns:
+            False when the answer did not keep the word count and was not learned
+        """
+        original_words = text.split()
+        converted_words = converted_text.split()
+        corrected_words = corrected_text.split()
+        if not original_words or not len(original_words) == len(converted_words) == len(corrected_words):
+            with self.lock:
+                self.misaligned += 1
+            return False
+
+        with self.lock:
+            self.learned += 1
+            for key, corrected_word in zip(zip(original_words, converted_words), corrected_words):
+                counts = self.entries.get(key)
+                if counts is None:
+                    counts = self.entries[key] = {}
+                counts[corrected_word] = counts.get(corrected_word, 0) + 1
+                if len(counts) > MAX_CORRECTIONS_PER_WORD:
+                    del counts[min(counts, key=counts.get)]
+            if len(self.entries) > self.max_entries:
+                self._evict()
+        return True
+
+    def _evict(self) -> None:
+        """
+        Keep the 90% most often seen word pairs; called with the lock held.
+
+        Evicting a tenth at a time keeps the sort off the path of most inserts. Among
+        pairs seen equally often the most recently added are kept, so new words get a
+        chance to gather observations.
+        """
+        keep = int(self.max_entries * 0.9)
+        ranked = sorted(reversed(list(self.entries.items())), key=lambda item: sum(item[1].values()), reverse=True)
+        self.evictions += len(ranked) - keep
+        self.entries = dict(ranked[:keep])
+
+    def lookup(self, text: str, converted_text: str) -> Optional[str]:
+        """
+        Build the correction of text from the memo.
+
+        Returns:
+            The corrected text, or None unless every word is covered with enough
+            observations and agreement
+        """
+        original_words = text.split()
+        converted_words = converted_text.split()
+        corrected_words = []
+        with self.lock:
+            self.lookups += 1
+            if not original_words or len(original_words) != len(converted_words):
+                return None
+            for key in zip(original_words, converted_words):
+                counts = self.entries.get(key)
+                if counts is None:
+                    return None
+                total = sum(counts.values())
+                corrected_word = max(counts, key=counts.get)
+                if total < self.min_count or counts[corrected_word] < total * self.min_confidence:
+                    return None
+                corrected_words.append(corrected_word)
+            self.hits += 1
+
+        words = iter(corrected_words)
+        return _WORD_PATTERN.sub(lambda match: next(words), text)
+
+    def compare(self, memo_text: str, llm_text: str) -> bool:
+        """
+        Count a shadow-mode comparison of the memo's answer with the model's.
+
+        Returns:
+            Whether both have the same words
+        """
+        agreed = memo_text.split() == llm_text.split()
+        with self.lock:
+            self.shadow_compared += 1
+            self.shadow_agreed += agreed
+        return agreed
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return memo counters for the health endpoint.
+        """
+        with self.lock:
+            return {
+                'mode': self.mode,
+                'entries': len(self.entries),
+                'learned': self.learned,
+                'misaligned': self.misaligned,
+                'evictions': self.evictions,
+                'lookups': self.lookups,
+                'hits': self.hits,
+                'hit_ratio': round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+                'shadow_compared': self.shadow_compared,
+                'shadow_agreed': self.shadow_agreed,
+                'agreement_ratio': round(self.shadow_agreed / self.shadow_compared, 4) if self.shadow_compared else None
+            }
+
+
+def create_word_memo() -> Optional[WordMemo]:
+    """
+    Build the word memo from environment variables, or None when WORD_MEMO_MODE=off.
+    """
+    mode = os.getenv("WORD_MEMO_MODE", MODE_SHADOW).lower()
+    if mode == MODE_OFF:
+        return None
+    if mode not in (MODE_SHADOW, MODE_ON):
+        raise ValueError(f"Unknown WORD_MEMO_MODE: {mode}")
+    return WordMemo(
+        mode=mode,
+        max_entries=int(os.getenv("WORD_MEMO_MAX_ENTRIES", "100000")),
+        min_count=int(os.getenv("WORD_MEMO_MIN_COUNT", "3")),
+        min_confidence=float(os.getenv("WORD_MEMO_CONFIDENCE", "0.95"))
+    )
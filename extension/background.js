@@ -9,17 +9,29 @@ const REQUEST_DELAY_MS = 500;
 const API_ENDPOINT = 'https://external-server-api.ew.r.appspot.com/api/convert';
 const TRANSLATION_ENDPOINT = 'https://external-server-api.ew.r.appspot.com/api/translate';
 const REPHRASE_ENDPOINT = 'https://external-server-api.ew.r.appspot.com/api/rephrase_to_prompt';
+// Incremental correction session per tab: the server reuses its previous correction
+// (identified by prefixHash) and only analyzes the text typed after it
+const convertSessions = new Map();
+
+function getConvertSession(tabId) {
+    if (!convertSessions.has(tabId)) {
+        convertSessions.set(tabId, { sessionId: crypto.randomUUID(), prefixHash: null });
+    }
+    return convertSessions.get(tabId);
+}
+
 // Simple request manager
-function sendRequest(text, sendResponse) {
+function sendRequest(text, sendResponse, tabId) {
     // Check if we can make a new request
     if (activeRequests >= MAX_CONCURRENT_REQUESTS) {
         // If not, try again after delay
-        setTimeout(() => sendRequest(text, sendResponse), REQUEST_DELAY_MS);
+        setTimeout(() => sendRequest(text, sendResponse, tabId), REQUEST_DELAY_MS);
         return;
     }
 
     // Increment active requests counter
     activeRequests++;
+    const session = getConvertSession(tabId);
 
     // Send the request to the server
    fetch(API_ENDPOINT, {
@@ -28,7 +40,7 @@ function sendRequest(text, sendResponse) {
             'Content-Type': 'application/json',
             'Accept': 'application/json'
         },
-        body: JSON.stringify({ text: text })
+        body: JSON.stringify({ text: text, session_id: session.sessionId, prefix_hash: session.prefixHash })
    })
     .then(response => {
         console.log('Response status:', response.status);
@@ -47,6 +59,7 @@ function sendRequest(text, sendResponse) {
             console.error('API Error:', data.error);
             sendResponse({ error: data.error });
         } else {
+            session.prefixHash = data.prefixHash || null;
             sendResponse({ convertedText: data.convertedText });
         }
     })
@@ -167,7 +180,7 @@ function sendRephraseRequest(text, sendResponse) {
 chrome.runtime.onMessage.addListener((request, sender, sendResponse) => {
     if (request.action === 'convertText') {
         // Process the conversion request
-        sendRequest(request.text, sendResponse);
+        sendRequest(request.text, sendResponse, sender.tab ? sender.tab.id : -1);
         return true; // Keep message channel open for async response
     } else if (request.action === 'translateText') {
         // Process the translation request
@@ -179,6 +192,10 @@ chrome.runtime.onMessage.addListener((request, sender, sendResponse) => {
     }
 });
 
+chrome.tabs.onRemoved.addListener(tabId => {
+    convertSessions.delete(tabId);
+});
+
 // Initialize extension
 chrome.runtime.onInstalled.addListener(() => {
     console.log('Keyboard Layout Fixer extension installed');